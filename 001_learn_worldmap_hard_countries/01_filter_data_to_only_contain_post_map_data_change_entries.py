@@ -1,34 +1,65 @@
+import argparse
 import json
+from collections import Counter
 
-# Load worldmap data to get valid countries
-with open('data/full/worldmap.geo.json', 'r') as f:
-    worldmap_data = json.load(f)
-
-# Create set of valid country names from admin field
-valid_countries = set()
-for feature in worldmap_data['features']:
-    if 'properties' in feature and 'admin' in feature['properties']:
-        valid_countries.add(feature['properties']['admin'])
-
-# Load learning data
-with open('data/full/learning_data.json', 'r') as f:
-    data = json.load(f)
-
-# Filter entries
-filtered_data = {}
-invalid_countries = set()
-for entry_id, entry in data.items():
-    if entry['country'] in valid_countries:
-        filtered_data[entry_id] = entry
-    else:
-        invalid_countries.add(entry['country'])
-
-# Save filtered data
-with open('data/full/learning_data_after_cutoff.json', 'w') as f:
-    json.dump(filtered_data, f, indent=2)
+from analytics.export_stream import iter_export, open_text, to_ndjson_line
+from analytics.geo_index import load_geo_index
+from analytics.instrumentation import stage
+
+parser = argparse.ArgumentParser(description="Keep only learning events for countries of the current map.")
+parser.add_argument('--stream', action='store_true',
+                    help="parse and write one event at a time, as line-delimited JSON")
+parser.add_argument('--compress', action='store_true',
+                    help="gzip the line-delimited output (only with --stream)")
+args = parser.parse_args()
+if args.compress and not args.stream:
+    parser.error('--compress requires --stream')
+
+# Valid country names are the admin names of the current map
+with stage('geo_index'):
+    valid_countries = set(load_geo_index().admin_names())
+
+invalid_counts = Counter()
+
+if args.stream:
+    # Filter entries while reading, so memory stays flat regardless of export size
+    output_path = 'data/full/learning_data_after_cutoff.ndjson' + ('.gz' if args.compress else '')
+    original_count = 0
+    filtered_count = 0
+    with stage('filter_stream') as record, open_text(output_path, 'w') as out:
+        for entry_id, entry in iter_export('data/full/learning_data.json'):
+            original_count += 1
+            if entry['country'] in valid_countries:
+                out.write(to_ndjson_line(entry_id, entry))
+                filtered_count += 1
+            else:
+                invalid_counts[entry['country']] += 1
+        record.rows = original_count
+else:
+    # Load learning data
+    with stage('parse') as record, open('data/full/learning_data.json', 'r') as f:
+        data = json.load(f)
+        record.rows = len(data)
+
+    # Filter entries
+    filtered_data = {}
+    with stage('filter', rows=len(data)):
+        for entry_id, entry in data.items():
+            if entry['country'] in valid_countries:
+                filtered_data[entry_id] = entry
+            else:
+                invalid_counts[entry['country']] += 1
+
+    # Save filtered data
+    with stage('write', rows=len(filtered_data)), open('data/full/learning_data_after_cutoff.json', 'w') as f:
+        json.dump(filtered_data, f, indent=2)
+
+    original_count = len(data)
+    filtered_count = len(filtered_data)
 
 # Print summary
-print(f"Original entries: {len(data)}")
-print(f"Filtered entries: {len(filtered_data)}")
-print(f"Removed entries: {len(data) - len(filtered_data)}")
-print(f"Invalid countries: {sorted(invalid_countries)}") 
\ No newline at end of file
+print(f"Original entries: {original_count}")
+print(f"Filtered entries: {filtered_count}")
+print(f"Removed entries: {original_count - filtered_count}")
+print(f"Invalid countries: {sorted(invalid_counts)}")
+print(f"Removed entries per invalid country: {dict(invalid_counts.most_common())}")
@@ -1,39 +1,62 @@
-import json
-from collections import defaultdict
+import argparse
 
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
+from analytics.day_cube import add_window_arguments, country_table_from_args
+from analytics.geo_spatial import load_country_covariates
+from analytics.rate_intervals import add_interval_arguments, interval_from_args
 
-# Initialize counters for each country
-country_stats = defaultdict(lambda: {'total': 0, 'wrong': 0})
+parser = argparse.ArgumentParser(description="Print the 10 countries most often guessed wrong.")
+parser.add_argument('--geo', action='store_true',
+                    help="add neighbour count, area and island status from the map geometry")
+add_interval_arguments(parser)
+add_window_arguments(parser)
+args = parser.parse_args()
 
-# Process each entry
-for entry in data.values():
-    country = entry['country']
-    country_stats[country]['total'] += 1
-    if entry['numberOfClicksNeeded'] > 1:
-        country_stats[country]['wrong'] += 1
+# Load the per-country table of the learning data
+table = country_table_from_args(args)
+totals = table.attempts
+wrongs = table.wrong
+covariates = load_country_covariates(table.countries) if args.geo else None
+interval = interval_from_args(args, wrongs, totals)
 
 # Calculate percentages and prepare results
 results = []
-for country, stats in country_stats.items():
+for code, country in enumerate(table.countries):
+    stats = {'total': int(totals[code]), 'wrong': int(wrongs[code])}
     if stats['total'] >= 5:  # Only consider countries with at least 5 attempts
         percentage_wrong = (stats['wrong'] / stats['total']) * 100
         results.append({
             'country': country,
             'percentage_wrong': percentage_wrong,
             'total_attempts': stats['total'],
-            'wrong_attempts': stats['wrong']
+            'wrong_attempts': stats['wrong'],
+            'code': code,
+            'ci': (interval[0][code] * 100, interval[1][code] * 100) if interval else None
         })
 
-# Sort by percentage wrong (descending) and get top 10
-top_10 = sorted(results, key=lambda x: x['percentage_wrong'], reverse=True)[:10]
+# Sort by percentage wrong, or the lower bound of its interval (descending), and get top 10
+rank_key = (lambda x: x['ci'][0]) if args.rank_by_lower_bound else (lambda x: x['percentage_wrong'])
+top_10 = sorted(results, key=rank_key, reverse=True)[:10]
 
 # Print results
 print("\nTop 10 Countries Most Often Guessed Wrong:")
 print("----------------------------------------")
-print(f"{'Country':<25} {'% Wrong':<10} {'Total Attempts':<15} {'Wrong Attempts':<15}")
-print("-" * 65)
+header = f"{'Country':<25} {'% Wrong':<10} {'Total Attempts':<15} {'Wrong Attempts':<15}"
+width = 65
+if interval is not None:
+    header += f" {f'{args.confidence * 100:g}% CI':<14}"
+    width += 15
+if covariates is not None:
+    header += f" {'Neighbours':<11} {'Area (km²)':<12} {'Island':<6}"
+    width += 31
+print(header)
+print("-" * width)
 for entry in top_10:
-    print(f"{entry['country']:<25} {entry['percentage_wrong']:.1f}%{'':<5} {entry['total_attempts']:<15} {entry['wrong_attempts']:<15}")
+    line = f"{entry['country']:<25} {entry['percentage_wrong']:.1f}%{'':<5} {entry['total_attempts']:<15} {entry['wrong_attempts']:<15}"
+    if interval is not None:
+        ci = f"[{entry['ci'][0]:.1f}, {entry['ci'][1]:.1f}]"
+        line += f" {ci:<14}"
+    if covariates is not None:
+        code = entry['code']
+        line += (f" {covariates['n_neighbours'][code]:<11} {covariates['area_km2'][code]:<12,.0f}"
+                 f" {'yes' if covariates['is_island'][code] else 'no':<6}")
+    print(line)
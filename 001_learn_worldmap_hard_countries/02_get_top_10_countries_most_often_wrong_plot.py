@@ -1,51 +1,52 @@
-import json
-from collections import defaultdict
-import numpy as np
+import argparse
 import os
 
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
+from analytics.day_cube import add_window_arguments, country_table_from_args
+from analytics.rate_intervals import add_interval_arguments, interval_from_args
 
-# Initialize data structure to store all attempts for each country
-country_attempts = defaultdict(list)
+parser = argparse.ArgumentParser(description="Write the LaTeX table of the 10 countries most often guessed wrong.")
+add_interval_arguments(parser)
+add_window_arguments(parser)
+args = parser.parse_args()
 
-# Process each entry
-for entry in data.values():
-    country = entry['country']
-    # Store 1 for wrong (multiple clicks), 0 for right (single click)
-    is_wrong = 1 if entry['numberOfClicksNeeded'] > 1 else 0
-    country_attempts[country].append(is_wrong)
+# Load the per-country table of the learning data
+table = country_table_from_args(args)
+totals = table.attempts
+wrongs = table.wrong
+interval = interval_from_args(args, wrongs, totals)
 
 # Calculate statistics for each country
 results = []
-for country, attempts in country_attempts.items():
-    if len(attempts) >= 5:  # Only consider countries with at least 5 attempts
-        percentage_wrong = (sum(attempts) / len(attempts)) * 100
+for code, country in enumerate(table.countries):
+    if totals[code] >= 5:  # Only consider countries with at least 5 attempts
+        percentage_wrong = (wrongs[code] / totals[code]) * 100
         results.append({
             'country': country,
             'percentage_wrong': percentage_wrong,
-            'total_attempts': len(attempts),
-            'wrong_attempts': sum(attempts)
+            'total_attempts': int(totals[code]),
+            'wrong_attempts': int(wrongs[code]),
+            'ci': (interval[0][code] * 100, interval[1][code] * 100) if interval else None
         })
 
-# Sort by percentage wrong (descending) and get top 10
-top_10 = sorted(results, key=lambda x: x['percentage_wrong'], reverse=True)[:10]
+# Sort by percentage wrong, or the lower bound of its interval (descending), and get top 10
+rank_key = (lambda x: x['ci'][0]) if args.rank_by_lower_bound else (lambda x: x['percentage_wrong'])
+top_10 = sorted(results, key=rank_key, reverse=True)[:10]
 
 # Generate LaTeX table
 latex_table = """\\begin{table}[htbp]
 \\centering
 \\caption{Top 10 Countries Most Often Guessed Wrong}
 \\label{tab:wrong-guesses}
-\\begin{tabular}{lrrr}
+\\begin{tabular}{lrrr""" + ("r" if interval else "") + """}
 \\toprule
-Country & \\% of guesses wrong & N & Wrong \\\\
+Country & \\% of guesses wrong & N & Wrong""" + (f" & {args.confidence * 100:g}\\% CI" if interval else "") + """ \\\\
 \\midrule
 """
 
 # Add data rows
 for entry in top_10:
-    latex_table += f"{entry['country']} & {entry['percentage_wrong']:.1f} & {entry['total_attempts']} & {entry['wrong_attempts']} \\\\\n"
+    ci = f" & [{entry['ci'][0]:.1f}, {entry['ci'][1]:.1f}]" if interval else ""
+    latex_table += f"{entry['country']} & {entry['percentage_wrong']:.1f} & {entry['total_attempts']} & {entry['wrong_attempts']}{ci} \\\\\n"
 
 # Close the table
 latex_table += """\\bottomrule
@@ -1,39 +1,48 @@
-import json
-from collections import defaultdict
+import argparse
 
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
+from analytics.day_cube import add_window_arguments, country_table_from_args
+from analytics.rate_intervals import add_interval_arguments, interval_from_args
 
-# Initialize counters for each country
-country_stats = defaultdict(lambda: {'total': 0, 'right': 0})
+parser = argparse.ArgumentParser(description="Print the 10 countries most often guessed right.")
+add_interval_arguments(parser)
+add_window_arguments(parser)
+args = parser.parse_args()
 
-# Process each entry
-for entry in data.values():
-    country = entry['country']
-    country_stats[country]['total'] += 1
-    if entry['numberOfClicksNeeded'] == 1:
-        country_stats[country]['right'] += 1
+# Load the per-country table of the learning data
+table = country_table_from_args(args)
+totals = table.attempts
+rights = table.right
+interval = interval_from_args(args, rights, totals)
 
 # Calculate percentages and prepare results
 results = []
-for country, stats in country_stats.items():
+for code, country in enumerate(table.countries):
+    stats = {'total': int(totals[code]), 'right': int(rights[code])}
     if stats['total'] >= 5:  # Only consider countries with at least 5 attempts
         percentage_right = (stats['right'] / stats['total']) * 100
         results.append({
             'country': country,
             'percentage_right': percentage_right,
             'total_attempts': stats['total'],
-            'right_attempts': stats['right']
+            'right_attempts': stats['right'],
+            'ci': (interval[0][code] * 100, interval[1][code] * 100) if interval else None
         })
 
-# Sort by percentage right (descending) and get top 10
-top_10 = sorted(results, key=lambda x: x['percentage_right'], reverse=True)[:10]
+# Sort by percentage right, or the lower bound of its interval (descending), and get top 10
+rank_key = (lambda x: x['ci'][0]) if args.rank_by_lower_bound else (lambda x: x['percentage_right'])
+top_10 = sorted(results, key=rank_key, reverse=True)[:10]
 
 # Print results
 print("\nTop 10 Countries Most Often Guessed Right:")
 print("----------------------------------------")
-print(f"{'Country':<25} {'% Right':<10} {'Total Attempts':<15} {'Right Attempts':<15}")
-print("-" * 65)
+header = f"{'Country':<25} {'% Right':<10} {'Total Attempts':<15} {'Right Attempts':<15}"
+if interval is not None:
+    header += f" {f'{args.confidence * 100:g}% CI':<14}"
+print(header)
+print("-" * (65 if interval is None else 80))
 for entry in top_10:
-    print(f"{entry['country']:<25} {entry['percentage_right']:.1f}%{'':<5} {entry['total_attempts']:<15} {entry['right_attempts']:<15}")
+    line = f"{entry['country']:<25} {entry['percentage_right']:.1f}%{'':<5} {entry['total_attempts']:<15} {entry['right_attempts']:<15}"
+    if interval is not None:
+        ci = f"[{entry['ci'][0]:.1f}, {entry['ci'][1]:.1f}]"
+        line += f" {ci:<14}"
+    print(line)
@@ -1,50 +1,52 @@
-import json
-from collections import defaultdict
+import argparse
 import os
 
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
+from analytics.day_cube import add_window_arguments, country_table_from_args
+from analytics.rate_intervals import add_interval_arguments, interval_from_args
 
-# Initialize data structure to store all attempts for each country
-country_attempts = defaultdict(list)
+parser = argparse.ArgumentParser(description="Write the LaTeX table of the 10 countries most often guessed right.")
+add_interval_arguments(parser)
+add_window_arguments(parser)
+args = parser.parse_args()
 
-# Process each entry
-for entry in data.values():
-    country = entry['country']
-    # Store 1 for right (single click), 0 for wrong (multiple clicks)
-    is_right = 1 if entry['numberOfClicksNeeded'] == 1 else 0
-    country_attempts[country].append(is_right)
+# Load the per-country table of the learning data
+table = country_table_from_args(args)
+totals = table.attempts
+rights = table.right
+interval = interval_from_args(args, rights, totals)
 
 # Calculate statistics for each country
 results = []
-for country, attempts in country_attempts.items():
-    if len(attempts) >= 5:  # Only consider countries with at least 5 attempts
-        percentage_right = (sum(attempts) / len(attempts)) * 100
+for code, country in enumerate(table.countries):
+    if totals[code] >= 5:  # Only consider countries with at least 5 attempts
+        percentage_right = (rights[code] / totals[code]) * 100
         results.append({
             'country': country,
             'percentage_right': percentage_right,
-            'total_attempts': len(attempts),
-            'right_attempts': sum(attempts)
+            'total_attempts': int(totals[code]),
+            'right_attempts': int(rights[code]),
+            'ci': (interval[0][code] * 100, interval[1][code] * 100) if interval else None
         })
 
-# Sort by percentage right (descending) and get top 10
-top_10 = sorted(results, key=lambda x: x['percentage_right'], reverse=True)[:10]
+# Sort by percentage right, or the lower bound of its interval (descending), and get top 10
+rank_key = (lambda x: x['ci'][0]) if args.rank_by_lower_bound else (lambda x: x['percentage_right'])
+top_10 = sorted(results, key=rank_key, reverse=True)[:10]
 
 # Generate LaTeX table
 latex_table = """\\begin{table}[htbp]
 \\centering
 \\caption{Top 10 Countries Most Often Guessed Right}
 \\label{tab:right-guesses}
-\\begin{tabular}{lrrr}
+\\begin{tabular}{lrrr""" + ("r" if interval else "") + """}
 \\toprule
-Country & \\% of guesses right & N & Right \\\\
+Country & \\% of guesses right & N & Right""" + (f" & {args.confidence * 100:g}\\% CI" if interval else "") + """ \\\\
 \\midrule
 """
 
 # Add data rows
 for entry in top_10:
-    latex_table += f"{entry['country']} & {entry['percentage_right']:.1f} & {entry['total_attempts']} & {entry['right_attempts']} \\\\\n"
+    ci = f" & [{entry['ci'][0]:.1f}, {entry['ci'][1]:.1f}]" if interval else ""
+    latex_table += f"{entry['country']} & {entry['percentage_right']:.1f} & {entry['total_attempts']} & {entry['right_attempts']}{ci} \\\\\n"
 
 # Close the table
 latex_table += """\\bottomrule
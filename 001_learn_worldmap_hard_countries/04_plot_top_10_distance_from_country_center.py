@@ -1,25 +1,24 @@
-import json
-from collections import defaultdict
+import argparse
+
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
+from analytics.country_table import load_country_table
+from analytics.geo_spatial import load_country_covariates
 
-# Initialize data structure to store distances for each country
-country_distances = defaultdict(list)
+parser = argparse.ArgumentParser(description="Box plot of click distances for the 10 countries clicked furthest off.")
+parser.add_argument('--geo', action='store_true',
+                    help="also print area, neighbour count and distance to the nearest country of the plotted countries")
+args = parser.parse_args()
 
-# Process each entry
-for entry in data.values():
-    country = entry['country']
-    distance = entry['distanceOfFirstClickToCenterOfCountry']
-    country_distances[country].append(distance)
+# Load the per-country table of the learning data
+table = load_country_table()
 
 # Calculate average distances and prepare data for plotting
 results = []
-for country, distances in country_distances.items():
+for code, country in enumerate(table.countries):
+    distances = table.distances_of(code)
     if len(distances) >= 5:  # Only consider countries with at least 5 attempts
         avg_distance = np.mean(distances)
         results.append({
@@ -33,6 +32,14 @@ top_10 = sorted(results, key=lambda x: x['avg_distance'], reverse=True)[:10]
 
 # Prepare data for box plot
 countries = [entry['country'] for entry in top_10]
+
+if args.geo:
+    covariates = load_country_covariates(countries)
+    print(f"{'Country':<25} {'Avg Distance':<14} {'Area (km²)':<12} {'Neighbours':<11} {'Nearest (km)':<12}")
+    print("-" * 74)
+    for i, entry in enumerate(top_10):
+        print(f"{entry['country']:<25} {entry['avg_distance']:<14.1f} {covariates['area_km2'][i]:<12,.0f} "
+              f"{covariates['n_neighbours'][i]:<11} {covariates['nearest_neighbour_km'][i]:<12.1f}")
 distances_data = [entry['distances'] for entry in top_10]
 
 # Create the box plot
@@ -1,44 +1,38 @@
-import json
+import argparse
 from collections import defaultdict
 
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
+from analytics.day_cube import add_window_arguments, country_table_from_args
+from analytics.geo_index import load_geo_index
+from analytics.geo_spatial import load_country_covariates
 
-# Load the geo.json file
-with open('data/full/worldmap.geo.json', 'r') as f:
-    geo_data = json.load(f)
+parser = argparse.ArgumentParser(description="Find the country most often guessed wrong per region and subregion.")
+parser.add_argument('--geo', action='store_true',
+                    help="add neighbour count and island status to the printed results")
+add_window_arguments(parser)
+args = parser.parse_args()
 
-# Create a mapping of country names to their regions
-country_to_regions = {}
-for feature in geo_data['features']:
-    country_name = feature['properties']['name']
-    region_un = feature['properties']['region_un']
-    subregion = feature['properties']['subregion']
-    country_to_regions[country_name] = (region_un, subregion)
+# Load the per-country table of the learning data
+table = country_table_from_args(args)
+totals = table.attempts
+wrongs = table.wrong
+covariates = load_country_covariates(table.countries) if args.geo else None
 
-# Initialize counters for each country
-country_stats = defaultdict(lambda: {'total': 0, 'wrong': 0})
-
-# Process each entry
-for entry in data.values():
-    country = entry['country']
-    country_stats[country]['total'] += 1
-    if entry['numberOfClicksNeeded'] > 1:
-        country_stats[country]['wrong'] += 1
+# Regions of the map's countries; names are resolved against admin and the map's other name fields
+geo_index = load_geo_index()
 
 # Calculate percentages and group by regions
 region_stats = defaultdict(lambda: defaultdict(list))
-for country, stats in country_stats.items():
+for code, country in enumerate(table.countries):
+    stats = {'total': int(totals[code]), 'wrong': int(wrongs[code])}
     if stats['total'] >= 5:  # Only consider countries with at least 5 attempts
         percentage_wrong = (stats['wrong'] / stats['total']) * 100
-        regions = country_to_regions.get(country, ('Unknown', 'Unknown'))
-        region_un, subregion = regions
+        region_un, subregion = geo_index.region_of(country)
         region_stats[region_un][subregion].append({
             'country': country,
             'percentage_wrong': percentage_wrong,
             'total_attempts': stats['total'],
-            'wrong_attempts': stats['wrong']
+            'wrong_attempts': stats['wrong'],
+            'code': code
         })
 
 # Find worst performing country per subregion
@@ -59,7 +53,12 @@ print("----------------------------------")
 for region_un, subregions in sorted_regions:
     print(f"\n{region_un}:")
     for subregion, stats in sorted(subregions.items()):
-        print(f"  {subregion}: {stats['country']} ({stats['percentage_wrong']:.1f}%)")
+        if covariates is None:
+            print(f"  {subregion}: {stats['country']} ({stats['percentage_wrong']:.1f}%)")
+        else:
+            code = stats['code']
+            print(f"  {subregion}: {stats['country']} ({stats['percentage_wrong']:.1f}%, "
+                  f"{covariates['n_neighbours'][code]} neighbours{', island' if covariates['is_island'][code] else ''})")
 
 # Save LaTeX table
 with open('plots/error_rates_by_region.tex', 'w') as f:
@@ -1,83 +1,48 @@
-import json
-from collections import defaultdict
-from datetime import datetime
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 
+from analytics.attempt_cube import DEFAULT_MAX_ATTEMPTS, AttemptCube
+from analytics.attempt_index import load_attempt_index
+from analytics.event_store import load_events
+
 # Configuration
-TARGET_COUNTRY = "Dominica"  # Change this to analyze different countries
-MAX_ATTEMPTS = 10  # Maximum number of attempts to analyze
-
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
-
-# Group attempts by deviceId
-user_attempts = defaultdict(list)
-
-# Process each entry
-for entry in data.values():
-    if entry['country'] == TARGET_COUNTRY:
-        # Convert timestamp to datetime for sorting
-        timestamp = datetime.fromisoformat(entry['timestamp'].replace('Z', '+00:00'))
-        user_attempts[entry['deviceId']].append({
-            'timestamp': timestamp,
-            'distance': entry['distanceOfFirstClickToCenterOfCountry']
-        })
-
-# Sort attempts by timestamp for each user
-for device_id in user_attempts:
-    user_attempts[device_id].sort(key=lambda x: x['timestamp'])
-
-# Calculate average distances for each attempt number (only up to attempt 10)
-attempt_distances = defaultdict(list)
-
-for attempts in user_attempts.values():
-    for i, attempt in enumerate(attempts, 1):
-        if i <= MAX_ATTEMPTS:  # Only include attempts up to 10
-            attempt_distances[i].append(attempt['distance'])
-
-# Calculate statistics
-results = []
-for attempt_num in range(1, MAX_ATTEMPTS + 1):
-    distances = attempt_distances[attempt_num]
-    if distances:  # Only include attempt numbers that have data
-        q1, median, q3 = np.percentile(distances, [25, 50, 75])
-        iqr = q3 - q1
-        lower_bound = q1 - 1.5 * iqr
-        upper_bound = q3 + 1.5 * iqr
-        
-        # Find whiskers (non-outlier min/max)
-        whisker_min = min(d for d in distances if d >= lower_bound)
-        whisker_max = max(d for d in distances if d <= upper_bound)
-        
-        # Find outliers
-        outliers = [d for d in distances if d < lower_bound or d > upper_bound]
-        
-        results.append({
-            'attempt_number': attempt_num,
-            'q1': q1,
-            'median': median,
-            'q3': q3,
-            'whisker_min': whisker_min,
-            'whisker_max': whisker_max,
-            'outliers': outliers,
-            'n_attempts': len(distances)
-        })
-
-# Print results to terminal
-print(f"\nLearning Trajectory for {TARGET_COUNTRY}")
-print("----------------------------------------")
-print(f"{'Attempt #':<10} {'Median':<15} {'Q1':<15} {'Q3':<15} {'N':<10}")
-print("-" * 65)
-for result in results:
-    print(f"{result['attempt_number']:<10} {result['median']:.2f}{'':<5} {result['q1']:.2f}{'':<5} {result['q3']:.2f}{'':<5} {result['n_attempts']:<10}")
-
-# Generate LaTeX table
-latex_table = """\\begin{table}[htbp]
+TARGET_COUNTRY = "Dominica"  # Default country when none are given on the command line
+
+# Figure reused for every country rendered by a process
+_figure = None
+
+def country_trajectory(cube: AttemptCube, country: str) -> Tuple[List[List[float]], List[Dict]]:
+    """Distances per attempt number and their box plot statistics, empty for countries without data."""
+    if country not in cube.countries:
+        return [[] for _ in range(cube.max_attempts)], []
+    code = cube.countries.index(country)
+    return cube.attempt_distances(code), cube.box_statistics(code)
+
+def render_trajectory(target_country: str, attempt_distances: List[List[float]], results: List[Dict]) -> str:
+    """Write the LaTeX table and box plot of one country; returns the terminal report."""
+    global _figure
+
+    # Results for the terminal
+    lines = [
+        f"\nLearning Trajectory for {target_country}",
+        "----------------------------------------",
+        f"{'Attempt #':<10} {'Median':<15} {'Q1':<15} {'Q3':<15} {'N':<10}",
+        "-" * 65,
+    ]
+    for result in results:
+        lines.append(f"{result['attempt_number']:<10} {result['median']:.2f}{'':<5} {result['q1']:.2f}{'':<5} {result['q3']:.2f}{'':<5} {result['n_attempts']:<10}")
+
+    # Generate LaTeX table
+    latex_table = """\\begin{table}[htbp]
 \\centering
-\\caption{Learning Trajectory for """ + TARGET_COUNTRY + """}
+\\caption{Learning Trajectory for """ + target_country + """}
 \\label{tab:learning-trajectory}
 \\begin{tabular}{rrrrr}
 \\toprule
@@ -85,61 +50,102 @@ Attempt & Median & Q1 & Q3 & N \\\\
 \\midrule
 """
 
-# Add data rows
-for result in results:
-    latex_table += f"{result['attempt_number']} & {result['median']:.2f} & {result['q1']:.2f} & {result['q3']:.2f} & {result['n_attempts']} \\\\\n"
+    # Add data rows
+    for result in results:
+        latex_table += f"{result['attempt_number']} & {result['median']:.2f} & {result['q1']:.2f} & {result['q3']:.2f} & {result['n_attempts']} \\\\\n"
 
-# Close the table
-latex_table += """\\bottomrule
+    # Close the table
+    latex_table += """\\bottomrule
 \\end{tabular}
 \\end{table}"""
 
-# Ensure plots directory exists
-os.makedirs('plots', exist_ok=True)
-
-# Save LaTeX table to file
-table_filename = f'plots/learning_trajectory_{TARGET_COUNTRY.lower().replace(" ", "_")}_table.tex'
-with open(table_filename, 'w') as f:
-    f.write(latex_table)
-
-# Create box plot
-plt.figure(figsize=(10, 6))
-
-# Prepare data for boxplot
-box_data = [attempt_distances[i] for i in range(1, MAX_ATTEMPTS + 1) if attempt_distances[i]]
-
-# Define boxplot properties
-boxprops = dict(facecolor='white', color='black', linewidth=1.5)
-whiskerprops = dict(color='black', linewidth=1.5)
-capprops = dict(color='black', linewidth=1.5)
-medianprops = dict(color='black', linewidth=2)
-flierprops = dict(marker='o', markerfacecolor='none', markeredgecolor='black', markersize=6, alpha=0.6)
-
-# Create boxplot with properties
-boxplot = plt.boxplot(box_data, 
-                     positions=range(1, len(box_data) + 1),
-                     widths=0.6,
-                     patch_artist=True,
-                     showfliers=True,
-                     boxprops=boxprops,
-                     whiskerprops=whiskerprops,
-                     capprops=capprops,
-                     medianprops=medianprops,
-                     flierprops=flierprops)
-
-plt.title(f'Learning Trajectory for {TARGET_COUNTRY}')
-plt.xlabel('Attempt Number')
-plt.ylabel('Distance from Country Center (pixels)')
-plt.grid(True, linestyle='--', alpha=0.7, axis='y')
-
-# Set x-axis ticks to match attempt numbers
-plt.xticks(range(1, len(box_data) + 1))
-
-# Save plot
-plot_filename = f'plots/learning_trajectory_{TARGET_COUNTRY.lower().replace(" ", "_")}.png'
-plt.savefig(plot_filename, bbox_inches='tight', dpi=300)
-plt.close()
-
-print(f"\nResults saved to:")
-print(f"- Table: {table_filename}")
-print(f"- Plot: {plot_filename}")
+    # Save LaTeX table to file
+    table_filename = f'plots/learning_trajectory_{target_country.lower().replace(" ", "_")}_table.tex'
+    with open(table_filename, 'w') as f:
+        f.write(latex_table)
+
+    # Create box plot, reusing this process's figure
+    if _figure is None:
+        _figure = plt.figure(figsize=(10, 6))
+    _figure.clear()
+    ax = _figure.add_subplot()
+
+    # Prepare data for boxplot
+    box_data = [distances for distances in attempt_distances if distances]
+
+    # Define boxplot properties
+    boxprops = dict(facecolor='white', color='black', linewidth=1.5)
+    whiskerprops = dict(color='black', linewidth=1.5)
+    capprops = dict(color='black', linewidth=1.5)
+    medianprops = dict(color='black', linewidth=2)
+    flierprops = dict(marker='o', markerfacecolor='none', markeredgecolor='black', markersize=6, alpha=0.6)
+
+    # Create boxplot with properties
+    ax.boxplot(box_data,
+               positions=range(1, len(box_data) + 1),
+               widths=0.6,
+               patch_artist=True,
+               showfliers=True,
+               boxprops=boxprops,
+               whiskerprops=whiskerprops,
+               capprops=capprops,
+               medianprops=medianprops,
+               flierprops=flierprops)
+
+    ax.set_title(f'Learning Trajectory for {target_country}')
+    ax.set_xlabel('Attempt Number')
+    ax.set_ylabel('Distance from Country Center (pixels)')
+    ax.grid(True, linestyle='--', alpha=0.7, axis='y')
+
+    # Set x-axis ticks to match attempt numbers
+    ax.set_xticks(range(1, len(box_data) + 1))
+
+    # Save plot
+    plot_filename = f'plots/learning_trajectory_{target_country.lower().replace(" ", "_")}.png'
+    _figure.savefig(plot_filename, bbox_inches='tight', dpi=300)
+
+    lines += ["\nResults saved to:", f"- Table: {table_filename}", f"- Plot: {plot_filename}"]
+    return "\n".join(lines)
+
+def render_trajectories(cube: AttemptCube, countries: List[str], workers: int = 1) -> None:
+    """Render every country, on `workers` processes, printing the reports in order."""
+    trajectories = [country_trajectory(cube, country) for country in countries]
+    if workers > 1 and len(countries) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            reports = pool.map(render_trajectory, countries, *zip(*trajectories))
+            for report in reports:
+                print(report)
+    else:
+        for country, (attempt_distances, results) in zip(countries, trajectories):
+            print(render_trajectory(country, attempt_distances, results))
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Plot learning trajectories (distance by attempt number) per country.")
+    parser.add_argument('countries', nargs='*', help=f"countries to render (default: {TARGET_COUNTRY})")
+    parser.add_argument('--all', action='store_true', help="render every country in the data")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="processes to render on (default: one per CPU)")
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help=f"attempt numbers to analyze (default: {DEFAULT_MAX_ATTEMPTS})")
+    args = parser.parse_args(argv)
+    if args.max_attempts < 1:
+        parser.error('--max-attempts must be at least 1')
+
+    # Load the learning data
+    events = load_events()
+    if args.all:
+        countries = sorted(events.countries[code] for code in np.unique(events.country))
+    else:
+        countries = args.countries or [TARGET_COUNTRY]
+        unknown = [country for country in countries if country not in events.countries]
+        if unknown:
+            parser.error(f"no attempts for {', '.join(unknown)}")
+
+    # Ensure plots directory exists
+    os.makedirs('plots', exist_ok=True)
+
+    cube = AttemptCube.from_index(events, load_attempt_index(events=events), max_attempts=args.max_attempts)
+    render_trajectories(cube, countries, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,44 @@
-import json
-from collections import defaultdict
-from datetime import datetime
+import argparse
+
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 from mpl_toolkits.mplot3d import Axes3D
 
-# Configuration
-MAX_ATTEMPTS = 10  # Maximum number of attempts to analyze
+from analytics.attempt_cube import DEFAULT_MAX_ATTEMPTS, AttemptCube
+from analytics.attempt_index import load_attempt_index
+from analytics.event_store import load_events
+
+parser = argparse.ArgumentParser(description="3D surface of the incorrect percentage by country and attempt number.")
+parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                    help=f"attempt numbers to analyze (default: {DEFAULT_MAX_ATTEMPTS})")
+args = parser.parse_args()
+if args.max_attempts < 1:
+    parser.error('--max-attempts must be at least 1')
+MAX_ATTEMPTS = args.max_attempts
 
 # Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
-
-# Group attempts by country and deviceId
-country_attempts = defaultdict(lambda: defaultdict(list))
-
-# Process each entry
-for entry in data.values():
-    country = entry['country']
-    device_id = entry['deviceId']
-    timestamp = datetime.fromisoformat(entry['timestamp'].replace('Z', '+00:00'))
-    country_attempts[country][device_id].append({
-        'timestamp': timestamp,
-        'incorrect': entry['numberOfClicksNeeded'] > 1
-    })
-
-# Sort attempts by timestamp for each user and country
-for country in country_attempts:
-    for device_id in country_attempts[country]:
-        country_attempts[country][device_id].sort(key=lambda x: x['timestamp'])
-
-# Calculate percentage incorrect for each attempt number for each country
-country_stats = {}
-
-for country, user_attempts in country_attempts.items():
-    attempt_incorrect = defaultdict(lambda: {'total': 0, 'incorrect': 0})
-    
-    for attempts in user_attempts.values():
-        for i, attempt in enumerate(attempts, 1):
-            if i <= MAX_ATTEMPTS:
-                attempt_incorrect[i]['total'] += 1
-                if attempt['incorrect']:
-                    attempt_incorrect[i]['incorrect'] += 1
-    
-    # Only include countries with enough data
-    if attempt_incorrect[1]['total'] >= 5:  # At least 5 users
-        percentages = []
-        for attempt_num in range(1, MAX_ATTEMPTS + 1):
-            if attempt_incorrect[attempt_num]['total'] > 0:
-                percentage = (attempt_incorrect[attempt_num]['incorrect'] / 
-                            attempt_incorrect[attempt_num]['total']) * 100
-                percentages.append(percentage)
-            else:
-                percentages.append(np.nan)
-        
-        country_stats[country] = {
-            'first_attempt_percentage': percentages[0],
-            'percentages': percentages
-        }
+events = load_events()
+
+# Attempt and incorrect counts for each country and attempt number, in one grouped pass
+cube = AttemptCube.from_index(events, load_attempt_index(events=events), max_attempts=MAX_ATTEMPTS)
+
+# Percentage incorrect for each country and attempt number (NaN without attempts)
+percentages = cube.error_rate * 100
+
+# Only include countries with enough data: at least 5 users
+included = np.flatnonzero(cube.attempts[:, 0] >= 5)
 
 # Sort countries by their first attempt performance (descending order - best to worst)
-sorted_countries = sorted(country_stats.items(), 
-                        key=lambda x: x[1]['first_attempt_percentage'],
-                        reverse=True)  # Sort from best to worst
+included = included[np.argsort(-percentages[included, 0], kind='stable')]
 
 # Prepare data for 3D plot
-countries = [country for country, _ in sorted_countries]
+countries = [events.countries[code] for code in included]
 attempts = range(1, MAX_ATTEMPTS + 1)
 X, Y = np.meshgrid(range(len(countries)), attempts)
 
 # Create Z matrix (percentages)
-Z = np.array([stats['percentages'] for _, stats in sorted_countries]).T
+Z = percentages[included].T
 
 # Create 3D plot
 fig = plt.figure(figsize=(15, 10))
@@ -109,11 +76,11 @@ print("\nSummary Statistics:")
 print("------------------")
 print(f"Total countries analyzed: {len(countries)}")
 print("\nTop 5 countries (best first attempt):")
-for country, stats in sorted_countries[:5]:
-    print(f"{country}: {stats['first_attempt_percentage']:.1f}% incorrect")
+for code in included[:5]:
+    print(f"{events.countries[code]}: {percentages[code, 0]:.1f}% incorrect")
 
 print("\nBottom 5 countries (worst first attempt):")
-for country, stats in sorted_countries[-5:]:
-    print(f"{country}: {stats['first_attempt_percentage']:.1f}% incorrect")
+for code in included[-5:]:
+    print(f"{events.countries[code]}: {percentages[code, 0]:.1f}% incorrect")
 
 print(f"\nPlot saved to: plots/learning_trajectories_3d.png")
@@ -2,76 +2,68 @@
 # to validate that something is first see, we need to see that the device_id
 # never interacted with that country before
 
-import json
-from collections import defaultdict
-from datetime import datetime
-from typing import Dict, List, Set, Tuple
+import argparse
 
-# Load the learning data
-with open('data/full/learning_data_after_cutoff.json', 'r') as f:
-    data = json.load(f)
+from analytics.day_cube import add_window_arguments, country_table_from_args
+from analytics.rate_intervals import add_interval_arguments, interval_from_args
 
-# Initialize data structures
-country_first_attempts: Dict[str, List[bool]] = defaultdict(list)  # List of success/failure for first attempts
-user_country_history: Dict[str, Set[str]] = defaultdict(set)  # Track which countries each user has seen
+parser = argparse.ArgumentParser(description="Error rate of each country on a user's first attempt at it.")
+add_interval_arguments(parser)
+add_window_arguments(parser)
+args = parser.parse_args()
 
-# Sort entries by timestamp to process in chronological order
-sorted_entries = sorted(
-    data.values(),
-    key=lambda x: datetime.fromisoformat(x['timestamp'].replace('Z', '+00:00'))
-)
-
-# Process each entry chronologically
-for entry in sorted_entries:
-    country = entry['country']
-    device_id = entry['deviceId']
-    
-    # Check if this is the user's first interaction with this country
-    if country not in user_country_history[device_id]:
-        # Record the attempt (True if correct on first try, False if not)
-        is_correct = entry['numberOfClicksNeeded'] == 1
-        country_first_attempts[country].append(is_correct)
-        
-        # Mark this country as seen by this user
-        user_country_history[device_id].add(country)
+# Load the per-country table, which records the outcome of every user's first attempt at a country
+table = country_table_from_args(args)
+total_first = table.first_see_attempts
+successful_first = table.first_see_correct
+interval = interval_from_args(args, total_first - successful_first, total_first)
 
 # Calculate statistics for each country
 results = []
-for country, attempts in country_first_attempts.items():
-    if len(attempts) >= 5:  # Only consider countries with at least 5 first attempts
-        error_rate = (1 - sum(attempts) / len(attempts)) * 100
+for code in table.first_see_order:
+    if total_first[code] >= 5:  # Only consider countries with at least 5 first attempts
+        error_rate = (1 - successful_first[code] / total_first[code]) * 100
         results.append({
-            'country': country,
+            'country': table.countries[code],
             'error_rate': error_rate,
-            'total_first_attempts': len(attempts),
-            'successful_first_attempts': sum(attempts)
+            'total_first_attempts': int(total_first[code]),
+            'successful_first_attempts': int(successful_first[code]),
+            'ci': (interval[0][code] * 100, interval[1][code] * 100) if interval else None
         })
 
-# Sort by error rate (descending)
-results.sort(key=lambda x: x['error_rate'], reverse=True)
+# Sort by error rate, or the lower bound of its interval (descending)
+results.sort(key=(lambda x: x['ci'][0]) if args.rank_by_lower_bound else (lambda x: x['error_rate']), reverse=True)
 
 # Print results
 print("\nError Rate on First See per Country:")
 print("----------------------------------------")
-print(f"{'Country':<25} {'Error Rate':<10} {'Total First Attempts':<20} {'Successful First Attempts':<25}")
-print("-" * 80)
+header = f"{'Country':<25} {'Error Rate':<10} {'Total First Attempts':<20} {'Successful First Attempts':<25}"
+if interval is not None:
+    header += f" {f'{args.confidence * 100:g}% CI':<14}"
+print(header)
+print("-" * (80 if interval is None else 95))
 for entry in results:
-    print(f"{entry['country']:<25} {entry['error_rate']:.1f}%{'':<5} {entry['total_first_attempts']:<20} {entry['successful_first_attempts']:<25}")
+    line = f"{entry['country']:<25} {entry['error_rate']:.1f}%{'':<5} {entry['total_first_attempts']:<20} {entry['successful_first_attempts']:<25}"
+    if interval is not None:
+        ci = f"[{entry['ci'][0]:.1f}, {entry['ci'][1]:.1f}]"
+        line += f" {ci:<14}"
+    print(line)
 
 # Generate LaTeX table
 latex_table = """\\begin{table}[htbp]
 \\centering
 \\caption{Error Rate on First See per Country}
 \\label{tab:first-see-error-rates}
-\\begin{tabular}{lrrr}
+\\begin{tabular}{lrrr""" + ("r" if interval else "") + """}
 \\toprule
-Country & \\% Error Rate & N & Successful \\\\
+Country & \\% Error Rate & N & Successful""" + (f" & {args.confidence * 100:g}\\% CI" if interval else "") + """ \\\\
 \\midrule
 """
 
 # Add data rows
 for entry in results:
-    latex_table += f"{entry['country']} & {entry['error_rate']:.1f} & {entry['total_first_attempts']} & {entry['successful_first_attempts']} \\\\\n"
+    ci = f" & [{entry['ci'][0]:.1f}, {entry['ci'][1]:.1f}]" if interval else ""
+    latex_table += f"{entry['country']} & {entry['error_rate']:.1f} & {entry['total_first_attempts']} & {entry['successful_first_attempts']}{ci} \\\\\n"
 
 # Close the table
 latex_table += """\\bottomrule
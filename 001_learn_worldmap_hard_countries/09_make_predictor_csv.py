@@ -1,113 +1,71 @@
-import json
-from datetime import datetime
-from typing import Dict, List, Tuple
+from typing import Optional, Sequence
 import pandas as pd
-from collections import defaultdict
 import numpy as np
 
-def load_data(filepath: str) -> Dict:
-    """Load JSON data from file."""
-    with open(filepath, 'r') as f:
-        return json.load(f)
+from analytics.attempt_index import AttemptIndex, load_attempt_index
+from analytics.event_store import EventStore, load_events
+from analytics.interning import key_order
+from analytics.rank_rates import DEFAULT_RANKS, attempt_numbers, attempt_rank_success_rates, ordinal
 
-def convert_timestamp_to_unix(timestamp: str) -> int:
-    """Convert ISO timestamp to UNIX timestamp."""
-    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-    return int(dt.timestamp())
+# Attempt ranks for which the per-country success rate columns are written
+SUCCESS_RATE_RANKS = DEFAULT_RANKS
 
-def process_data(data: Dict) -> pd.DataFrame:
+def process_data(events: EventStore, ranks: Sequence[int] = SUCCESS_RATE_RANKS,
+                 index: Optional[AttemptIndex] = None) -> pd.DataFrame:
     """Process the data and create a DataFrame with required columns."""
-    # Initialize data structures
-    user_country_data = defaultdict(list)
-    user_total_guesses = defaultdict(int)
-    country_attempts = defaultdict(lambda: defaultdict(list))
+    device = np.asarray(events.device)
+    country = np.asarray(events.country)
+    timestamp = events.timestamp // 1000
+    is_correct = events.is_correct
     
-    # First pass: collect all data
-    for entry_id, entry in data.items():
-        device_id = entry['deviceId']
-        country = entry['country']
-        timestamp = convert_timestamp_to_unix(entry['timestamp'])
-        is_correct = entry['numberOfClicksNeeded'] == 1
-        
-        # Store entry
-        user_country_data[(device_id, country)].append({
-            'timestamp': timestamp,
-            'is_correct': is_correct
-        })
-        
-        # Update user total guesses
-        user_total_guesses[device_id] += 1
-        
-        # Store country attempt data
-        country_attempts[country][device_id].append(is_correct)
+    # Attempts of each (device, country) pair in time order, from the attempt index
+    if index is None:
+        index = AttemptIndex.from_events(events)
+    order = index.order
+    pair_correct = is_correct[order]
+    starts = index.pair_offsets[:-1]
+    ends = index.pair_offsets[1:]
+    total_guesses = ends - starts
     
-    # Prepare DataFrame rows
-    rows = []
+    # Streak of correct guesses at the end of each pair's attempts
+    last_wrong = np.maximum.reduceat(np.where(pair_correct, -1, np.arange(len(order))), starts)
+    current_streak = ends - np.maximum(last_wrong + 1, starts)
     
-    for (device_id, country), attempts in user_country_data.items():
-        # Sort attempts by timestamp
-        attempts.sort(key=lambda x: x['timestamp'])
-        
-        # Calculate metrics
-        total_guesses = len(attempts)
-        last_guess_timestamp = attempts[-1]['timestamp']
-        
-        # Calculate streak
-        current_streak = 0
-        for attempt in reversed(attempts):
-            if attempt['is_correct']:
-                current_streak += 1
-            else:
-                break
-        
-        # Calculate correct guess percentage
-        correct_guesses = sum(1 for a in attempts if a['is_correct'])
-        correct_guess_percentage = correct_guesses / total_guesses if total_guesses > 0 else -1
-        
-        # Calculate country success rates
-        first_attempts = []
-        third_attempts = []
-        fifth_attempts = []
-        
-        for user_attempts in country_attempts[country].values():
-            if len(user_attempts) >= 1:
-                first_attempts.append(user_attempts[0])
-            if len(user_attempts) >= 3:
-                third_attempts.append(user_attempts[2])
-            if len(user_attempts) >= 5:
-                fifth_attempts.append(user_attempts[4])
-        
-        first_guess_success_rate = sum(first_attempts) / len(first_attempts) if first_attempts else 0
-        third_guess_success_rate = sum(third_attempts) / len(third_attempts) if third_attempts else 0
-        fifth_guess_success_rate = sum(fifth_attempts) / len(fifth_attempts) if fifth_attempts else 0
-        
-        # Create row
-        row = {
-            'deviceId_country': f"{device_id}_{country}",
-            'total_guesses': total_guesses,
-            'user_total_guesses': user_total_guesses[device_id],
-            'last_guess_timestamp': last_guess_timestamp,
-            'current_streak': current_streak,
-            'correct_guess_percentage': correct_guess_percentage,
-            'first_guess_success_rate': first_guess_success_rate,
-            'first_guess_sample_size': len(first_attempts),
-            'third_guess_success_rate': third_guess_success_rate,
-            'third_guess_sample_size': len(third_attempts),
-            'fifth_guess_success_rate': fifth_guess_success_rate,
-            'fifth_guess_sample_size': len(fifth_attempts)
-        }
-        rows.append(row)
+    # Calculate correct guess percentage
+    correct_guesses = np.add.reduceat(pair_correct.astype(np.int64), starts)
     
-    # Create DataFrame and sort by compound key
-    df = pd.DataFrame(rows)
-    df = df.sort_values('deviceId_country')
+    # Country success rates by attempt rank, computed once per country; ranks count
+    # each user's attempts at a country in export order
+    export_order, export_numbers = attempt_numbers(device, country, np.arange(len(device)))
+    success_rates = attempt_rank_success_rates(country[export_order], export_numbers, is_correct[export_order],
+                                               len(events.countries), ranks)
+    
+    # Sort by compound key, deviceId_country, using the collation ranks of its parts
+    final = key_order(events.device_interner.collation_ranks('_')[index.pair_device],
+                      events.country_interner.collation_ranks()[index.pair_country])
+    pair_device = index.pair_device[final]
+    pair_country = index.pair_country[final]
+    
+    # Create DataFrame, looking up the strings only for output
+    df = pd.DataFrame({
+        'deviceId_country': events.device_interner.decode(pair_device) + '_' + events.country_interner.decode(pair_country),
+        'total_guesses': total_guesses[final],
+        'user_total_guesses': np.bincount(device, minlength=len(events.devices))[pair_device],
+        'last_guess_timestamp': timestamp[order][ends - 1][final],
+        'current_streak': current_streak[final],
+        'correct_guess_percentage': (correct_guesses / total_guesses)[final],
+    })
+    for rank in ranks:
+        rates, sample_sizes = success_rates[rank]
+        df[f'{ordinal(rank)}_guess_success_rate'] = rates[pair_country]
+        df[f'{ordinal(rank)}_guess_sample_size'] = sample_sizes[pair_country]
     
     return df
 
 def main():
     # Process full dataset
-    data = load_data('data/full/learning_data_after_cutoff.json')
-    df_full = process_data(data)
+    events = load_events()
+    df_full = process_data(events, index=load_attempt_index(events=events))
     df_full.to_csv('data/csv/predictor_data_full.csv', index=False)
     
     # Create demo version (first 200 rows)
@@ -1,200 +1,263 @@
-import json
-from datetime import datetime
-from typing import Dict, List, Tuple
+import argparse
+import math
+import os
+import tempfile
+from contextlib import ExitStack
+from typing import Dict, List, Optional, Tuple
+
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
-from tqdm import tqdm
-
-def load_data(filepath: str) -> Dict:
-    """Load JSON data from file."""
-    print("Loading JSON data...")
-    with open(filepath, 'r') as f:
-        data = json.load(f)
-    print(f"Loaded {len(data)} entries")
-    return data
-
-def convert_timestamp_to_unix(timestamp: str) -> int:
-    """Convert ISO timestamp to UNIX timestamp."""
-    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-    return int(dt.timestamp())
-
-def is_same_day(timestamp1: int, timestamp2: int) -> bool:
-    """Check if two timestamps are from the same day."""
-    dt1 = datetime.fromtimestamp(timestamp1)
-    dt2 = datetime.fromtimestamp(timestamp2)
-    return dt1.date() == dt2.date()
-
-def process_data(data: Dict) -> pd.DataFrame:
-    """Process the data and create a DataFrame with required columns."""
-    print("Converting data to DataFrame...")
-    # Convert to DataFrame for vectorized operations
-    entries_df = pd.DataFrame([
-        {
-            'deviceId': entry['deviceId'],
-            'country': entry['country'],
-            'timestamp': convert_timestamp_to_unix(entry['timestamp']),
-            'is_correct': entry['numberOfClicksNeeded'] == 1
-        }
-        for entry in tqdm(data.values(), desc="Converting entries")
-    ])
-    
-    print("Sorting and calculating attempt numbers...")
-    # Sort by timestamp
-    entries_df = entries_df.sort_values('timestamp')
-    
-    # Calculate attempt numbers using cumcount
-    tqdm.pandas(desc="Calculating attempt numbers")
-    entries_df['attempt_num'] = entries_df.groupby(['deviceId', 'country']).cumcount() + 1
-    
-    print("Calculating global statistics...")
-    # Calculate global stats using vectorized operations
-    tqdm.pandas(desc="Processing first attempts")
-    first_attempts = entries_df[entries_df['attempt_num'] == 1].groupby('country')['is_correct'].progress_apply(list)
+
+from analytics.alt_features import compute_alt_features
+from analytics.event_store import EventStore, ensure_event_store, load_events, load_segment, read_meta
+from analytics.feature_dataset import DEFAULT_DATASET, FeatureDatasetWriter, write_feature_dataset
+from analytics.geo_spatial import COVARIATE_COLUMNS, load_country_covariates
+from analytics.instrumentation import add_report_arguments, stage, start_report
+from analytics.interning import decimal_string_ranks, key_order
+from analytics.out_of_core import DEFAULT_PARTITION_ROWS, PermutedCsvWriter, iter_partition_features
+
+# Time zone that decides where a day starts for is_first_guess_of_day ('local' or 'utc')
+DAY_TIMEZONE = 'local'
+
+# Rows per chunk when writing the CSVs
+CSV_CHUNK_ROWS = 200_000
+
+# Split -> CSV file in data/csv/
+CSV_NAMES = {
+    'full': 'predictor_data_alt_full.csv',
+    'train': 'predictor_data_alt_train.csv',
+    'val': 'predictor_data_alt_val.csv',
+    'demo': 'predictor_data_alt_demo.csv',
+}
+
+COMPOUND_KEY = {
+    'name': 'deviceId_country_timestamp',
+    'parts': ['deviceId', 'country', 'current_guess_timestamp'],
+    'separator': '_',
+}
+
+def compute_columns(events: EventStore, workers: int = 1) -> Dict[str, np.ndarray]:
+    """Output columns sorted by the compound key, on `workers` processes.
     
-    tqdm.pandas(desc="Processing third attempts")
-    third_attempts = entries_df[entries_df['attempt_num'] == 3].groupby('country')['is_correct'].progress_apply(list)
+    deviceId and country are codes into events.devices and events.countries;
+    the compound key column itself is not built.
+    """
+    # Sort by timestamp, keeping export order for guesses in the same second
+    with stage('sort_by_timestamp', rows=len(events)):
+        timestamp = events.timestamp // 1000
+        order = np.argsort(timestamp, kind='stable')
+        device = np.asarray(events.device)[order]
+        country = np.asarray(events.country)[order]
+        timestamp = timestamp[order]
+        is_correct = events.is_correct[order]
     
-    tqdm.pandas(desc="Processing fifth attempts")
-    fifth_attempts = entries_df[entries_df['attempt_num'] == 5].groupby('country')['is_correct'].progress_apply(list)
+    with stage('features', rows=len(order)):
+        features = compute_alt_features(device, country, timestamp, is_correct,
+                                        len(events.countries), day_timezone=DAY_TIMEZONE, workers=workers)
     
-    print("Computing success rates...")
-    global_stats = pd.DataFrame({
-        'first_guess_success_rate': first_attempts.apply(lambda x: sum(x) / len(x) if x else 0),
-        'first_guess_sample_size': first_attempts.apply(len),
-        'third_guess_success_rate': third_attempts.apply(lambda x: sum(x) / len(x) if x else 0),
-        'third_guess_sample_size': third_attempts.apply(len),
-        'fifth_guess_success_rate': fifth_attempts.apply(lambda x: sum(x) / len(x) if x else 0),
-        'fifth_guess_sample_size': fifth_attempts.apply(len)
-    }).fillna(0)
+    with stage('sort_by_compound_key', rows=len(order)):
+        return sorted_columns(events, device, country, timestamp, is_correct, features)
+
+def sorted_columns(events: EventStore, device: np.ndarray, country: np.ndarray, timestamp: np.ndarray,
+                   is_correct: np.ndarray, features: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Output columns of rows given in timestamp order, sorted by the compound key."""
+    # Sort by compound key, deviceId_country_timestamp, using the collation ranks of its parts
+    device_ranks = events.device_interner.collation_ranks('_')
+    country_ranks = events.country_interner.collation_ranks('_')
+    final = key_order(device_ranks[device], country_ranks[country], decimal_string_ranks(timestamp))
     
-    print("Calculating user statistics...")
-    # Calculate user-country histories
-    tqdm.pandas(desc="Building user-country histories")
-    user_country_history = entries_df.groupby(['deviceId', 'country']).progress_apply(
-        lambda x: list(zip(x['timestamp'], x['is_correct']))
-    ).to_dict()
+    columns = {
+        'deviceId': device[final],
+        'country': country[final],
+        'current_guess_timestamp': timestamp[final],
+        'total_guesses': features['attempt_num'][final],
+        'user_total_guesses': features['user_total_guesses'][final],
+        'previous_guess_timestamp': features['prev_timestamp'][final],
+        'current_streak': features['streak'][final],
+        'correct_guess_percentage': features['correct_guess_percentage'][final],
+        'time_since_last_country_guess': features['time_since_last_country'][final],
+        'time_since_last_user_guess': features['time_since_last_user'][final],
+        'countries_attempted_since_last': features['countries_attempted_since_last'][final],
+        'is_first_guess_of_day': features['is_first_guess_of_day'][final],
+        'is_correct': is_correct[final],
+    }
     
-    # Calculate user total guesses up to each timestamp
-    tqdm.pandas(desc="Calculating user total guesses")
-    entries_df['user_total_guesses'] = entries_df.groupby('deviceId').cumcount() + 1
+    # Add global stats columns
+    for col, values in features.items():
+        if col.endswith(('_success_rate', '_sample_size')):
+            columns[col] = values[final]
     
-    print("Calculating streaks and time-based features...")
-    # Calculate streaks using vectorized operations
-    tqdm.pandas(desc="Calculating streaks")
-    entries_df['streak'] = entries_df.groupby(['deviceId', 'country'])['is_correct'].transform(
-        lambda x: x[::-1].cumsum()[::-1] * x[::-1].cumprod()[::-1]
+    return columns
+
+def add_geo_columns(events: EventStore, columns: Dict[str, np.ndarray]) -> None:
+    """Append the map covariates of each row's country (area, neighbours, island, ...)."""
+    covariates = load_country_covariates(events.countries)
+    for name in COVARIATE_COLUMNS:
+        columns[name] = covariates[name][columns['country']]
+
+def output_columns(columns: Dict[str, np.ndarray]) -> List[str]:
+    """Column order of the CSVs: the compound key follows is_correct."""
+    names = list(columns)
+    names.insert(names.index('is_correct') + 1, COMPOUND_KEY['name'])
+    return names
+
+def to_dataframe(events: EventStore, columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """DataFrame with the CSV columns, looking up the strings of the codes."""
+    categories = {'deviceId': events.devices, 'country': events.countries}
+    result_df = pd.DataFrame({
+        name: pd.Categorical.from_codes(values, categories[name]) if name in categories else values
+        for name, values in columns.items()
+    })
+    # Strings are only looked up for the output columns
+    result_df[COMPOUND_KEY['name']] = (
+        events.device_interner.decode(columns['deviceId']) + '_' + events.country_interner.decode(columns['country'])
+        + '_' + columns['current_guess_timestamp'].astype(str).astype(object)
     )
+    return result_df[output_columns(columns)]
+
+def process_data(events: EventStore, workers: int = 1) -> pd.DataFrame:
+    """Process the data and create a DataFrame with required columns, on `workers` processes."""
+    columns = compute_columns(events, workers)
+    with stage('dataframe', rows=len(columns['deviceId'])):
+        return to_dataframe(events, columns)
+
+def split_rows(n_rows: int, test_size: float = 0.5, seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """Shuffled train and validation row indices, the same as sklearn's train_test_split(np.arange(n_rows), ...)."""
+    n_test = math.ceil(test_size * n_rows)
+    permutation = np.random.RandomState(seed).permutation(n_rows)
+    return permutation[n_test:], permutation[:n_test]
+
+def write_csv(df: pd.DataFrame, path: str, rows: Optional[np.ndarray] = None) -> None:
+    """Write `df`, or the given rows of it, to CSV in chunks of CSV_CHUNK_ROWS rows."""
+    n_rows = len(df) if rows is None else len(rows)
+    with open(path, 'w', newline='') as f:
+        for start in range(0, max(n_rows, 1), CSV_CHUNK_ROWS):
+            chunk = slice(start, start + CSV_CHUNK_ROWS) if rows is None else rows[start:start + CSV_CHUNK_ROWS]
+            df.iloc[chunk].to_csv(f, index=False, header=start == 0)
+
+def build_in_memory(workers: int = 1, geo_features: bool = False, csv: bool = False) -> int:
+    """Write the dataset (and the CSVs) from the whole table at once; the number of rows."""
+    # Process full dataset
+    with stage('load') as record:
+        events = load_events()
+        record.rows = len(events)
+    columns = compute_columns(events, workers=workers)
+    if geo_features:
+        with stage('geo_features'):
+            add_geo_columns(events, columns)
+    n_rows = len(columns['deviceId'])
     
-    # Calculate time-based features
-    tqdm.pandas(desc="Calculating country time differences")
-    entries_df['prev_timestamp'] = entries_df.groupby(['deviceId', 'country'])['timestamp'].transform('shift')
-    entries_df['time_since_last_country'] = entries_df['timestamp'] - entries_df['prev_timestamp'].fillna(entries_df['timestamp'])
-    
-    tqdm.pandas(desc="Calculating user time differences")
-    entries_df['prev_user_timestamp'] = entries_df.groupby('deviceId')['timestamp'].transform('shift')
-    entries_df['time_since_last_user'] = entries_df['timestamp'] - entries_df['prev_user_timestamp'].fillna(entries_df['timestamp'])
-    
-    print("Calculating countries attempted since last...")
-    # Calculate countries attempted since last
-    def get_countries_since_last(group):
-        timestamps = group['timestamp'].values
-        countries = group['country'].values
-        result = np.zeros(len(group))
-        
-        for i in tqdm(range(1, len(group)), desc="Processing user entries", leave=False):
-            mask = (timestamps[:i] > timestamps[i-1]) & (timestamps[:i] < timestamps[i])
-            result[i] = len(np.unique(countries[:i][mask]))
-        
-        return pd.Series(result, index=group.index)
-    
-    tqdm.pandas(desc="Calculating countries attempted")
-    entries_df['countries_attempted_since_last'] = entries_df.groupby('deviceId').progress_apply(
-        get_countries_since_last
-    ).reset_index(level=0, drop=True)
-    
-    print("Calculating day-based features...")
-    # Calculate if first guess of day
-    tqdm.pandas(desc="Calculating day-based features")
-    entries_df['prev_day'] = entries_df.groupby('deviceId')['timestamp'].transform(
-        lambda x: pd.Series(x).apply(lambda t: datetime.fromtimestamp(t).date())
-    ).shift(1)
-    entries_df['current_day'] = entries_df['timestamp'].apply(lambda t: datetime.fromtimestamp(t).date())
-    entries_df['is_first_guess_of_day'] = entries_df['prev_day'] != entries_df['current_day']
-    
-    print("Calculating correct guess percentages...")
-    # Calculate correct guess percentage
-    tqdm.pandas(desc="Calculating correct guesses")
-    entries_df['correct_guesses'] = entries_df.groupby(['deviceId', 'country'])['is_correct'].transform('cumsum')
-    entries_df['correct_guess_percentage'] = entries_df['correct_guesses'] / (entries_df['attempt_num'] - 1)
-    entries_df['correct_guess_percentage'] = entries_df['correct_guess_percentage'].fillna(-1)
-    
-    print("Creating final DataFrame...")
-    # Create final DataFrame
-    tqdm.pandas(desc="Merging with global stats")
-    result_df = entries_df.merge(
-        global_stats,
-        on='country',
-        how='left'
-    )
+    # Split into train/val sets, as row indices into the full table
+    with stage('split', rows=n_rows):
+        train_rows, val_rows = split_rows(n_rows, test_size=0.5, seed=42)
     
-    # Create compound key before renaming columns
-    result_df['deviceId_country_timestamp'] = result_df['deviceId'] + '_' + result_df['country'] + '_' + result_df['timestamp'].astype(str)
+    # Create demo version (first 200 rows)
+    splits = {'train': train_rows, 'val': val_rows, 'demo': np.arange(min(200, n_rows))}
     
-    # Select and rename columns
-    final_columns = {
-        'deviceId': 'deviceId',
-        'country': 'country',
-        'timestamp': 'current_guess_timestamp',
-        'attempt_num': 'total_guesses',
-        'user_total_guesses': 'user_total_guesses',
-        'prev_timestamp': 'previous_guess_timestamp',
-        'streak': 'current_streak',
-        'correct_guess_percentage': 'correct_guess_percentage',
-        'time_since_last_country': 'time_since_last_country_guess',
-        'time_since_last_user': 'time_since_last_user_guess',
-        'countries_attempted_since_last': 'countries_attempted_since_last',
-        'is_first_guess_of_day': 'is_first_guess_of_day',
-        'is_correct': 'is_correct',
-        'deviceId_country_timestamp': 'deviceId_country_timestamp'
-    }
+    with stage('write_dataset', rows=n_rows):
+        write_feature_dataset(columns, {'deviceId': events.devices, 'country': events.countries}, splits,
+                              compound_key=COMPOUND_KEY, output_columns=output_columns(columns))
     
-    # Add global stats columns
-    for col in global_stats.columns:
-        final_columns[col] = col
+    if csv:
+        with stage('dataframe', rows=n_rows):
+            df_full = to_dataframe(events, columns)
+        for split, rows in [('full', None), ('train', train_rows), ('val', val_rows), ('demo', splits['demo'])]:
+            name = CSV_NAMES[split]
+            with stage(f'write {name}', rows=n_rows if rows is None else len(rows)):
+                write_csv(df_full, f'data/csv/{name}', rows)
+    return n_rows
+
+def build_out_of_core(partition_rows: int = DEFAULT_PARTITION_ROWS, geo_features: bool = False,
+                      csv: bool = False) -> int:
+    """Write the same dataset (and CSVs) one device partition at a time; the number of rows.
     
-    result_df = result_df[list(final_columns.keys())].rename(columns=final_columns)
+    Only one partition's rows are in memory at a time, plus the split indices.
+    """
+    with stage('load') as record:
+        ensure_event_store()
+        meta = read_meta()
+        # Only the store-wide dictionaries are used; the events are read in chunks
+        events = load_segment(meta['segments'][0]['name'])
+        n_rows = record.rows = meta['n_events']
     
-    # Sort by compound key
-    print("Sorting final DataFrame...")
-    result_df = result_df.sort_values('deviceId_country_timestamp')
+    with stage('split', rows=n_rows):
+        train_rows, val_rows = split_rows(n_rows, test_size=0.5, seed=42)
+    splits = {'train': train_rows, 'val': val_rows, 'demo': np.arange(min(200, n_rows))}
+    writer = FeatureDatasetWriter({'deviceId': events.devices, 'country': events.countries},
+                                  compound_key=COMPOUND_KEY)
     
-    return result_df
+    # Spilled partitions and CSV buckets go next to the data, not to a /tmp that may be held in memory
+    with tempfile.TemporaryDirectory(prefix='predictor_alt-', dir=os.path.dirname(DEFAULT_DATASET)) as work_dir, \
+            ExitStack() as files:
+        if csv:
+            full_csv = files.enter_context(open(f"data/csv/{CSV_NAMES['full']}", 'w', newline=''))
+            shuffled = {split: PermutedCsvWriter(f'data/csv/{CSV_NAMES[split]}', rows, n_rows, work_dir,
+                                                 bucket_rows=partition_rows)
+                        for split, rows in [('train', train_rows), ('val', val_rows)]}
+            demo: List[pd.DataFrame] = []
+        
+        start = 0
+        partitions = iter_partition_features(work_dir, events.device_interner.collation_ranks('_'),
+                                             len(events.countries), DAY_TIMEZONE, partition_rows)
+        for index, (partition, features) in enumerate(partitions):
+            with stage(f'write partition {index:05d}', rows=len(partition['row'])):
+                columns = sorted_columns(events, partition['device'], partition['country'], partition['timestamp'],
+                                         partition['is_correct'], features)
+                if geo_features:
+                    add_geo_columns(events, columns)
+                writer.output_columns = output_columns(columns)
+                writer.append(columns)
+                # A chunk of its own, rather than buffering rows up to a full chunk
+                writer.flush()
+                if csv:
+                    df = to_dataframe(events, columns)
+                    df.to_csv(full_csv, index=False, header=start == 0)
+                    for split_writer in shuffled.values():
+                        split_writer.append(df, start)
+                    if start < len(splits['demo']):
+                        demo.append(df.iloc[:len(splits['demo']) - start].copy())
+                    del df
+            start += len(partition['row'])
+            # Released before the next partition is built
+            del partition, features, columns
+        
+        with stage('write_dataset', rows=n_rows):
+            writer.close(splits)
+        if csv:
+            for split, split_writer in shuffled.items():
+                with stage(f"write {CSV_NAMES[split]}", rows=len(splits[split])):
+                    split_writer.close()
+            if demo:
+                write_csv(pd.concat(demo), f"data/csv/{CSV_NAMES['demo']}")
+    return n_rows
 
 def main():
-    print("Loading data...")
-    # Process full dataset
-    data = load_data('data/full/learning_data_after_cutoff.json')
-    df_full = process_data(data)
-    
-    print("Splitting data...")
-    # Split into train/val sets
-    df_train, df_val = train_test_split(df_full, test_size=0.5, random_state=42)
-    
-    # Create demo version (first 200 rows)
-    df_demo = df_full.head(200)
+    parser = argparse.ArgumentParser(description="Create the per-guess predictor dataset.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes to compute the features on, partitioned by device (default: 1)")
+    parser.add_argument('--csv', action='store_true',
+                        help="also write the full, train, val and demo CSVs to data/csv/")
+    parser.add_argument('--geo-features', action='store_true',
+                        help="add the country's area, neighbour count, island status, distance to the "
+                             "nearest country and centroid as columns")
+    parser.add_argument('--out-of-core', action='store_true',
+                        help="spill the events to disk by device and build one partition at a time, for "
+                             "exports that don't fit in memory")
+    parser.add_argument('--partition-rows', type=int, default=DEFAULT_PARTITION_ROWS,
+                        help=f"with --out-of-core: rows per partition (default: {DEFAULT_PARTITION_ROWS})")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    if args.out_of_core and args.workers > 1:
+        parser.error("--workers can't be combined with --out-of-core")
+    # Every stage is summarized on stderr as it finishes
+    start_report('10_make_alt_predictor_csv', args.report, args.profile, log=True)
     
-    print("Saving files...")
-    # Save all versions with progress bars
-    for name, df in tqdm([
-        ('predictor_data_alt_full.csv', df_full),
-        ('predictor_data_alt_train.csv', df_train),
-        ('predictor_data_alt_val.csv', df_val),
-        ('predictor_data_alt_demo.csv', df_demo)
-    ], desc="Saving files"):
-        df.to_csv(f'data/csv/{name}', index=False)
+    if args.out_of_core:
+        n_rows = build_out_of_core(args.partition_rows, args.geo_features, args.csv)
+    else:
+        n_rows = build_in_memory(args.workers, args.geo_features, args.csv)
     
-    print("Done!")
+    print(f"Saved {n_rows} rows to {DEFAULT_DATASET}" + (" and data/csv/" if args.csv else ''))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+"""Shared data access and computation helpers for the numbered analysis scripts."""
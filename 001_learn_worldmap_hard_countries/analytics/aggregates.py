@@ -0,0 +1,175 @@
+"""Per-country and per-device statistics, computed in one pass and maintained segment by segment.
+
+Every field can be merged (sums, min/max, concatenated samples, earliest
+attempt per pair), so after an ingest only the new segment is scanned and
+folded into the statistics cached in ``aggregates.npz``.
+"""
+import os
+from dataclasses import dataclass, fields
+from typing import Optional
+
+import numpy as np
+
+from analytics.event_store import DEFAULT_STORE, EventStore, ensure_event_store, load_segment, read_meta
+from analytics.instrumentation import stage
+from analytics.resident import resident
+
+_NO_TIMESTAMP_MIN = np.iinfo(np.int64).max
+_NO_TIMESTAMP_MAX = np.iinfo(np.int64).min
+
+
+def pair_keys(device: np.ndarray, country: np.ndarray) -> np.ndarray:
+    """Pack (device code, country code) into one int64 that stays valid as dictionaries grow."""
+    return (device.astype(np.int64) << 16) | country.astype(np.int64)
+
+
+@dataclass
+class Aggregates:
+    """Statistics indexed by country code, by device code and by (device, country) pair."""
+    country_attempts: np.ndarray
+    country_wrong: np.ndarray
+    country_distance_sum: np.ndarray
+    # Distance samples grouped by country (CSR), in export order within each country
+    distance_offsets: np.ndarray
+    distances: np.ndarray
+    device_attempts: np.ndarray
+    device_wrong: np.ndarray
+    device_first_timestamp: np.ndarray
+    device_last_timestamp: np.ndarray
+    # Each pair's first attempt: sorted pair keys, when (timestamp, global row) and whether it was correct
+    pair_key: np.ndarray
+    pair_first_timestamp: np.ndarray
+    pair_first_position: np.ndarray
+    pair_first_correct: np.ndarray
+
+    @property
+    def country_right(self) -> np.ndarray:
+        return self.country_attempts - self.country_wrong
+
+    @classmethod
+    def from_events(cls, events: EventStore, position_offset: int = 0) -> 'Aggregates':
+        """Scan `events` once; `position_offset` is the global row of its first event."""
+        n_countries = len(events.countries)
+        n_devices = len(events.devices)
+        country = np.asarray(events.country)
+        wrong = events.clicks > 1
+
+        first_timestamp = np.full(n_devices, _NO_TIMESTAMP_MIN, dtype=np.int64)
+        last_timestamp = np.full(n_devices, _NO_TIMESTAMP_MAX, dtype=np.int64)
+        np.minimum.at(first_timestamp, events.device, events.timestamp)
+        np.maximum.at(last_timestamp, events.device, events.timestamp)
+
+        country_attempts = np.bincount(country, minlength=n_countries)
+        by_country = np.argsort(country, kind='stable')
+
+        keys = pair_keys(events.device, country)
+        positions = np.arange(len(keys), dtype=np.int64) + position_offset
+        by_pair = np.lexsort((positions, events.timestamp, keys))
+        first = by_pair[np.unique(keys[by_pair], return_index=True)[1]]
+
+        return cls(
+            country_attempts=country_attempts,
+            country_wrong=np.bincount(country, weights=wrong, minlength=n_countries).astype(np.int64),
+            country_distance_sum=np.bincount(country, weights=events.distance, minlength=n_countries),
+            distance_offsets=np.r_[0, np.cumsum(country_attempts)],
+            distances=np.asarray(events.distance)[by_country],
+            device_attempts=np.bincount(events.device, minlength=n_devices),
+            device_wrong=np.bincount(events.device, weights=wrong, minlength=n_devices).astype(np.int64),
+            device_first_timestamp=first_timestamp,
+            device_last_timestamp=last_timestamp,
+            pair_key=keys[first],
+            pair_first_timestamp=np.asarray(events.timestamp)[first],
+            pair_first_position=positions[first],
+            pair_first_correct=events.is_correct[first],
+        )
+
+    def merge(self, other: 'Aggregates') -> 'Aggregates':
+        """Combine with the statistics of events that come after these in the store."""
+        merged = {
+            'country_attempts': _combine(self.country_attempts, other.country_attempts, np.add, 0),
+            'country_wrong': _combine(self.country_wrong, other.country_wrong, np.add, 0),
+            'country_distance_sum': _combine(self.country_distance_sum, other.country_distance_sum, np.add, 0),
+            'device_attempts': _combine(self.device_attempts, other.device_attempts, np.add, 0),
+            'device_wrong': _combine(self.device_wrong, other.device_wrong, np.add, 0),
+            'device_first_timestamp': _combine(self.device_first_timestamp, other.device_first_timestamp,
+                                               np.minimum, _NO_TIMESTAMP_MIN),
+            'device_last_timestamp': _combine(self.device_last_timestamp, other.device_last_timestamp,
+                                              np.maximum, _NO_TIMESTAMP_MAX),
+        }
+
+        # Interleave the distance samples per country, keeping ours first
+        n_countries = len(merged['country_attempts'])
+        labels = np.concatenate([
+            np.repeat(np.arange(len(self.distance_offsets) - 1), np.diff(self.distance_offsets)),
+            np.repeat(np.arange(len(other.distance_offsets) - 1), np.diff(other.distance_offsets)),
+        ])
+        order = np.argsort(labels, kind='stable')
+        merged['distances'] = np.concatenate([self.distances, other.distances])[order]
+        merged['distance_offsets'] = np.r_[0, np.cumsum(np.bincount(labels, minlength=n_countries))]
+
+        # A pair's first attempt is the earliest one on either side
+        keys = np.concatenate([self.pair_key, other.pair_key])
+        timestamps = np.concatenate([self.pair_first_timestamp, other.pair_first_timestamp])
+        positions = np.concatenate([self.pair_first_position, other.pair_first_position])
+        by_pair = np.lexsort((positions, timestamps, keys))
+        first = by_pair[np.unique(keys[by_pair], return_index=True)[1]]
+        merged['pair_key'] = keys[first]
+        merged['pair_first_timestamp'] = timestamps[first]
+        merged['pair_first_position'] = positions[first]
+        merged['pair_first_correct'] = np.concatenate([self.pair_first_correct, other.pair_first_correct])[first]
+        return Aggregates(**merged)
+
+
+def _combine(a: np.ndarray, b: np.ndarray, op: np.ufunc, fill) -> np.ndarray:
+    """Apply `op` elementwise, padding the shorter array (newer dictionary codes) with `fill`."""
+    size = max(len(a), len(b))
+    a = np.concatenate([a, np.full(size - len(a), fill, dtype=a.dtype)])
+    b = np.concatenate([b, np.full(size - len(b), fill, dtype=b.dtype)])
+    return op(a, b)
+
+
+def _aggregates_path(store_dir: str) -> str:
+    return os.path.join(store_dir, 'aggregates.npz')
+
+
+def _read_cached(store_dir: str, build_id: str) -> Optional[np.lib.npyio.NpzFile]:
+    path = _aggregates_path(store_dir)
+    if not os.path.exists(path):
+        return None
+    cached = np.load(path)
+    if str(cached['build_id']) != build_id or any(field.name not in cached for field in fields(Aggregates)):
+        return None
+    return cached
+
+
+@resident('store_dir')
+def load_aggregates(store_dir: str = DEFAULT_STORE) -> Aggregates:
+    """Return up-to-date aggregates, scanning only segments not folded in yet."""
+    ensure_event_store(store_dir=store_dir)
+    meta = read_meta(store_dir)
+    names = [segment['name'] for segment in meta['segments']]
+    starts = np.r_[0, np.cumsum([segment['n_events'] for segment in meta['segments']])]
+
+    aggregates = None
+    done = []
+    cached = _read_cached(store_dir, meta['build_id'])
+    if cached is not None:
+        cached_names = list(cached['segments'])
+        if cached_names == names[:len(cached_names)]:
+            aggregates = Aggregates(**{field.name: cached[field.name] for field in fields(Aggregates)})
+            done = cached_names
+
+    pending = range(len(done), len(names))
+    for index in pending:
+        with stage(f'aggregate {names[index]}', rows=meta['segments'][index]['n_events']):
+            segment_aggregates = Aggregates.from_events(load_segment(names[index], store_dir), int(starts[index]))
+        aggregates = segment_aggregates if aggregates is None else aggregates.merge(segment_aggregates)
+
+    if pending:
+        np.savez(
+            _aggregates_path(store_dir),
+            build_id=meta['build_id'],
+            segments=np.asarray(names),
+            **{field.name: getattr(aggregates, field.name) for field in fields(Aggregates)},
+        )
+    return aggregates
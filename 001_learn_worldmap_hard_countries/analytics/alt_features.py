@@ -0,0 +1,140 @@
+"""Per-guess feature columns of 10_make_alt_predictor_csv.py, computed with segment operations.
+
+The input rows are in the order 10 processes them (sorted by timestamp).
+Per-pair and per-device features are computed on a stable regrouping of
+those rows and scattered back, so every column lines up with the input.
+
+All features except the per-country success rates and the day boundary
+depend only on the rows of one device, so with `workers > 1` the rows are
+partitioned by device code across a process pool. Each worker also returns
+per-country attempt counts by rank, which are summed before the rates are
+computed; the output is identical to a serial run.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from analytics.device_windows import distinct_countries_between
+from analytics.instrumentation import stage
+from analytics.rank_rates import DEFAULT_RANKS, attempt_rank_counts, ordinal, success_rates_from_counts
+from analytics.segment_ops import (
+    group_order, segment_cumcount, segment_cumsum, segment_shift, segment_starts, segment_trailing_run,
+)
+from analytics.timestamps import day_buckets
+
+RankCounts = Dict[int, Tuple[np.ndarray, np.ndarray]]
+
+
+def device_features(device: np.ndarray, country: np.ndarray, timestamp: np.ndarray, is_correct: np.ndarray,
+                    n_countries: int, ranks: Sequence[int] = DEFAULT_RANKS
+                    ) -> Tuple[Dict[str, np.ndarray], RankCounts]:
+    """Features that only depend on each device's own rows, plus its per-country rank counts."""
+    n = len(timestamp)
+    features: Dict[str, np.ndarray] = {}
+
+    # Per (device, country) pair, in row order within the pair
+    with stage('group_pairs', rows=n):
+        by_pair = group_order(device, country)
+        new_pair = segment_starts(device[by_pair], country[by_pair])
+    with stage('pair_features', rows=n):
+        pair_correct = is_correct[by_pair]
+        attempt_num = np.empty(n, dtype=np.int64)
+        attempt_num[by_pair] = segment_cumcount(new_pair) + 1
+        streak = np.empty(n, dtype=np.int64)
+        streak[by_pair] = segment_trailing_run(pair_correct, new_pair)
+        prev_timestamp = np.empty(n)
+        prev_timestamp[by_pair] = segment_shift(timestamp[by_pair], new_pair)
+        correct_guesses = np.empty(n, dtype=np.int64)
+        correct_guesses[by_pair] = segment_cumsum(pair_correct, new_pair)
+
+    # Per device, in row order within the device
+    with stage('group_devices', rows=n):
+        by_device = group_order(device)
+        new_device = segment_starts(device[by_device])
+    with stage('device_features', rows=n):
+        user_total_guesses = np.empty(n, dtype=np.int64)
+        user_total_guesses[by_device] = segment_cumcount(new_device) + 1
+        prev_user_timestamp = np.empty(n)
+        prev_user_timestamp[by_device] = segment_shift(timestamp[by_device], new_device)
+
+    features['attempt_num'] = attempt_num
+    features['user_total_guesses'] = user_total_guesses
+    features['streak'] = streak
+    features['prev_timestamp'] = prev_timestamp
+    features['time_since_last_country'] = timestamp - np.where(np.isnan(prev_timestamp), timestamp, prev_timestamp)
+    features['prev_user_timestamp'] = prev_user_timestamp
+    since = np.where(np.isnan(prev_user_timestamp), timestamp, prev_user_timestamp)
+    features['time_since_last_user'] = timestamp - since
+
+    # Distinct countries between each user's previous guess and the current one
+    with stage('countries_since_last', rows=n):
+        countries_since_last = np.empty(n)
+        countries_since_last[by_device] = distinct_countries_between(
+            device[by_device], country[by_device], timestamp[by_device], since[by_device].astype(np.int64)
+        )
+    features['countries_attempted_since_last'] = countries_since_last
+
+    # Share of correct guesses (including the current one) over the previous attempts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentage = correct_guesses / (attempt_num - 1)
+    features['correct_guesses'] = correct_guesses
+    features['correct_guess_percentage'] = np.where(np.isnan(percentage), -1, percentage)
+
+    return features, attempt_rank_counts(country, attempt_num, is_correct, n_countries, ranks)
+
+
+def _sharded_device_features(device: np.ndarray, country: np.ndarray, timestamp: np.ndarray, is_correct: np.ndarray,
+                             n_countries: int, ranks: Sequence[int], workers: int
+                             ) -> Tuple[Dict[str, np.ndarray], RankCounts]:
+    """`device_features` over device partitions in a process pool, reassembled in input order."""
+    shard = device % workers
+    shards = [np.flatnonzero(shard == index) for index in range(workers)]
+    shards = [rows for rows in shards if len(rows)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            device_features,
+            *zip(*((device[rows], country[rows], timestamp[rows], is_correct[rows]) for rows in shards)),
+            [n_countries] * len(shards), [ranks] * len(shards),
+        ))
+
+    features: Dict[str, np.ndarray] = {}
+    for name, values in results[0][0].items():
+        features[name] = np.empty(len(device), dtype=values.dtype)
+    counts = {rank: (np.zeros(n_countries), np.zeros(n_countries, dtype=np.int64)) for rank in ranks}
+    for rows, (shard_features, shard_counts) in zip(shards, results):
+        for name, values in shard_features.items():
+            features[name][rows] = values
+        for rank, (correct, sample_sizes) in shard_counts.items():
+            counts[rank][0][:] += correct
+            counts[rank][1][:] += sample_sizes
+    return features, counts
+
+
+def compute_alt_features(device: np.ndarray, country: np.ndarray, timestamp: np.ndarray, is_correct: np.ndarray,
+                         n_countries: int, day_timezone: str = 'local',
+                         ranks: Sequence[int] = DEFAULT_RANKS, workers: int = 1) -> Dict[str, np.ndarray]:
+    """Feature columns keyed by 10's working column names, aligned with the input rows.
+
+    `timestamp` is in seconds, `device` and `country` are integer codes.
+    """
+    n = len(timestamp)
+    if workers > 1 and n:
+        # The workers' own stages aren't recorded, only the whole sharded computation
+        with stage('sharded_device_features', rows=n):
+            features, counts = _sharded_device_features(device, country, timestamp, is_correct, n_countries,
+                                                        ranks, workers)
+    else:
+        features, counts = device_features(device, country, timestamp, is_correct, n_countries, ranks)
+
+    # First guess of the day, comparing each guess's day with the row before it
+    with stage('first_guess_of_day', rows=n):
+        days = day_buckets(np.asarray(timestamp, dtype=np.int64) * 1000, tz=day_timezone)
+        features['is_first_guess_of_day'] = np.r_[True, days[1:] != days[:-1]] if n else np.zeros(0, dtype=bool)
+
+    # Global per-country success rates by attempt rank
+    with stage('success_rates', rows=n):
+        for rank, (rates, sample_sizes) in success_rates_from_counts(counts).items():
+            features[f'{ordinal(rank)}_guess_success_rate'] = rates[country]
+            features[f'{ordinal(rank)}_guess_sample_size'] = sample_sizes[country]
+    return features
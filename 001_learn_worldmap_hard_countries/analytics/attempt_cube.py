@@ -0,0 +1,136 @@
+"""Per (country, attempt number) statistics of all countries, computed in one grouped pass.
+
+06 and 07 both look at how guesses change from a user's first attempt at a
+country to the next ones. The cube groups the attempts of the attempt index
+by (country, attempt number) once and derives dense (countries,
+max_attempts) arrays from it: attempt and error counts, and the box plot
+statistics of the click distances (quartiles, whiskers, outliers).
+"""
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+from analytics.attempt_index import AttemptIndex
+from analytics.event_store import EventStore
+
+DEFAULT_MAX_ATTEMPTS = 10
+
+
+def _lerp(a: np.ndarray, b: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Interpolation between a and b exactly as np.percentile does it."""
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+@dataclass
+class AttemptCube:
+    """Dense (country code, attempt number - 1) arrays; distance statistics are NaN for empty cells."""
+    countries: List[str]
+    max_attempts: int
+    attempts: np.ndarray
+    incorrect: np.ndarray
+    q1: np.ndarray
+    median: np.ndarray
+    q3: np.ndarray
+    whisker_min: np.ndarray
+    whisker_max: np.ndarray
+    # Cell c = country * max_attempts + attempt - 1 has distances[cell_offsets[c]:cell_offsets[c + 1]],
+    # in the attempt index's order (by device, then time)
+    cell_offsets: np.ndarray
+    distances: np.ndarray
+
+    @property
+    def error_rate(self) -> np.ndarray:
+        """Share of incorrect attempts per cell, NaN for cells without attempts."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.attempts > 0, self.incorrect / self.attempts, np.nan)
+
+    def cell_distances(self, country: int, attempt_number: int) -> np.ndarray:
+        cell = country * self.max_attempts + attempt_number - 1
+        return self.distances[self.cell_offsets[cell]:self.cell_offsets[cell + 1]]
+
+    def attempt_distances(self, country: int) -> List[List[float]]:
+        """Distances of attempts 1..max_attempts of a country, as lists."""
+        return [self.cell_distances(country, attempt_num).tolist() for attempt_num in range(1, self.max_attempts + 1)]
+
+    def box_statistics(self, country: int) -> List[Dict]:
+        """Box plot statistics for each attempt number of a country with data."""
+        results = []
+        for attempt_num in range(1, self.max_attempts + 1):
+            cell = (country, attempt_num - 1)
+            if self.attempts[cell] == 0:
+                continue
+            distances = self.cell_distances(country, attempt_num)
+            iqr = self.q3[cell] - self.q1[cell]
+            lower_bound = self.q1[cell] - 1.5 * iqr
+            upper_bound = self.q3[cell] + 1.5 * iqr
+            results.append({
+                'attempt_number': attempt_num,
+                'q1': self.q1[cell],
+                'median': self.median[cell],
+                'q3': self.q3[cell],
+                'whisker_min': self.whisker_min[cell],
+                'whisker_max': self.whisker_max[cell],
+                'outliers': distances[(distances < lower_bound) | (distances > upper_bound)].tolist(),
+                'n_attempts': int(self.attempts[cell]),
+            })
+        return results
+
+    @classmethod
+    def from_index(cls, events: EventStore, index: AttemptIndex,
+                   max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> 'AttemptCube':
+        n_countries = len(events.countries)
+        n_cells = n_countries * max_attempts
+        shape = (n_countries, max_attempts)
+
+        # Attempts up to max_attempts, grouped by cell and kept in index order within it
+        keep = np.flatnonzero(index.attempt_number <= max_attempts)
+        rows = index.order[keep]
+        cells = events.country[rows].astype(np.int64) * max_attempts + index.attempt_number[keep] - 1
+        by_cell = np.argsort(cells, kind='stable')
+        rows, cells = rows[by_cell], cells[by_cell]
+        distances = events.distance[rows].astype(np.float64)
+        counts = np.bincount(cells, minlength=n_cells)
+        offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+        incorrect = np.bincount(cells, weights=events.clicks[rows] > 1, minlength=n_cells)
+
+        # Quartiles with np.percentile's linear interpolation, on each cell's sorted distances
+        sorted_distances = distances[np.lexsort((distances, cells))]
+        filled = np.flatnonzero(counts)
+        starts, sizes = offsets[filled], counts[filled]
+        quantiles = {}
+        for name, q in [('q1', 0.25), ('median', 0.5), ('q3', 0.75)]:
+            position = q * (sizes - 1)
+            below = np.floor(position).astype(np.int64)
+            above = np.minimum(below + 1, sizes - 1)
+            values = np.full(n_cells, np.nan)
+            values[filled] = _lerp(sorted_distances[starts + below], sorted_distances[starts + above],
+                                   position - below)
+            quantiles[name] = values
+
+        # Whiskers: the extreme distances within 1.5 IQR of the quartiles
+        iqr = quantiles['q3'] - quantiles['q1']
+        lower_bound = np.repeat(quantiles['q1'] - 1.5 * iqr, counts)
+        upper_bound = np.repeat(quantiles['q3'] + 1.5 * iqr, counts)
+        whisker_min = np.full(n_cells, np.nan)
+        whisker_max = np.full(n_cells, np.nan)
+        if len(filled):
+            whisker_min[filled] = np.minimum.reduceat(
+                np.where(sorted_distances >= lower_bound, sorted_distances, np.inf), starts)
+            whisker_max[filled] = np.maximum.reduceat(
+                np.where(sorted_distances <= upper_bound, sorted_distances, -np.inf), starts)
+
+        return cls(
+            countries=list(events.countries),
+            max_attempts=max_attempts,
+            attempts=counts.reshape(shape),
+            incorrect=incorrect.reshape(shape),
+            q1=quantiles['q1'].reshape(shape),
+            median=quantiles['median'].reshape(shape),
+            q3=quantiles['q3'].reshape(shape),
+            whisker_min=whisker_min.reshape(shape),
+            whisker_max=whisker_max.reshape(shape),
+            cell_offsets=offsets,
+            distances=distances,
+        )
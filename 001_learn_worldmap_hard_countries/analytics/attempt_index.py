@@ -0,0 +1,148 @@
+"""Events ordered by (device, country, timestamp), with CSR offsets per pair, device and country.
+
+Several scripts need "each user's attempts at each country, in time order".
+The index sorts the store once, numbers the attempts of every
+(device, country) pair and records where each pair, device and country
+starts, so those scripts slice it instead of regrouping the events. It is
+persisted in ``attempt_index/`` next to the store and rebuilt when the
+store changes.
+"""
+import json
+import os
+import shutil
+from dataclasses import dataclass, fields
+from typing import Optional
+
+import numpy as np
+
+from analytics.event_store import DEFAULT_STORE, EventStore, ensure_event_store, load_events, read_meta
+from analytics.instrumentation import stage
+from analytics.resident import resident
+from analytics.segment_ops import segment_cumcount, segment_starts
+
+_INDEX_DIR = 'attempt_index'
+
+
+@dataclass
+class AttemptIndex:
+    """Attempt order of the store; positions below refer to `order`, not to store rows."""
+    # Store rows sorted by device, country, timestamp, and export order for equal timestamps
+    order: np.ndarray
+    # 1 for a pair's first attempt (the user's first sight of the country), 2 for the second, ...
+    attempt_number: np.ndarray
+    # Pair p covers positions pair_offsets[p]:pair_offsets[p + 1]; pairs sorted by (device, country)
+    pair_offsets: np.ndarray
+    pair_device: np.ndarray
+    pair_country: np.ndarray
+    # Device d covers positions device_offsets[d]:device_offsets[d + 1] and pairs
+    # device_pair_offsets[d]:device_pair_offsets[d + 1]
+    device_offsets: np.ndarray
+    device_pair_offsets: np.ndarray
+    # Positions grouped by country (then device and time): country c is
+    # country_positions[country_offsets[c]:country_offsets[c + 1]]
+    country_positions: np.ndarray
+    country_offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @property
+    def is_first_see(self) -> np.ndarray:
+        return self.attempt_number == 1
+
+    @property
+    def n_pairs(self) -> int:
+        return len(self.pair_device)
+
+    def pair_index(self, device: int, country: int) -> int:
+        """Index of the (device, country) pair, or -1 if the device never attempted the country."""
+        start, end = self.device_pair_offsets[device], self.device_pair_offsets[device + 1]
+        pair = start + int(np.searchsorted(self.pair_country[start:end], country))
+        return pair if pair < end and self.pair_country[pair] == country else -1
+
+    def pair_rows(self, device: int, country: int) -> np.ndarray:
+        """Store rows of one pair's attempts, in time order."""
+        pair = self.pair_index(device, country)
+        if pair < 0:
+            return self.order[:0]
+        return self.order[self.pair_offsets[pair]:self.pair_offsets[pair + 1]]
+
+    def device_rows(self, device: int) -> np.ndarray:
+        """Store rows of one device's attempts, by country and then time."""
+        return self.order[self.device_offsets[device]:self.device_offsets[device + 1]]
+
+    def country_slice(self, country: int) -> np.ndarray:
+        """Positions of one country's attempts, by device and then time."""
+        return self.country_positions[self.country_offsets[country]:self.country_offsets[country + 1]]
+
+    @classmethod
+    def from_events(cls, events: EventStore) -> 'AttemptIndex':
+        device = np.asarray(events.device)
+        country = np.asarray(events.country)
+        order = np.lexsort((events.timestamp, country, device))
+        sorted_device = device[order]
+        sorted_country = country[order]
+
+        new_pair = segment_starts(sorted_device, sorted_country)
+        pair_starts = np.flatnonzero(new_pair)
+        pair_device = sorted_device[pair_starts]
+        pair_country = sorted_country[pair_starts]
+        n_devices = len(events.devices)
+        n_countries = len(events.countries)
+
+        return cls(
+            order=order,
+            attempt_number=(segment_cumcount(new_pair) + 1).astype(np.int32),
+            pair_offsets=np.r_[pair_starts, len(order)].astype(np.int64),
+            pair_device=pair_device,
+            pair_country=pair_country,
+            device_offsets=np.searchsorted(sorted_device, np.arange(n_devices + 1)).astype(np.int64),
+            device_pair_offsets=np.searchsorted(pair_device, np.arange(n_devices + 1)).astype(np.int64),
+            country_positions=np.argsort(sorted_country, kind='stable'),
+            country_offsets=np.r_[0, np.cumsum(np.bincount(country, minlength=n_countries))].astype(np.int64),
+        )
+
+
+def _read_persisted(index_dir: str, meta: dict) -> Optional[AttemptIndex]:
+    meta_path = os.path.join(index_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        index_meta = json.load(f)
+    if index_meta.get('build_id') != meta['build_id'] or index_meta.get('segments') != [
+            segment['name'] for segment in meta['segments']]:
+        return None
+    return AttemptIndex(**{
+        field.name: np.load(os.path.join(index_dir, f'{field.name}.npy'), mmap_mode='r')
+        for field in fields(AttemptIndex)
+    })
+
+
+def _persist(index: AttemptIndex, index_dir: str, meta: dict) -> None:
+    tmp_dir = index_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for field in fields(AttemptIndex):
+        np.save(os.path.join(tmp_dir, f'{field.name}.npy'), getattr(index, field.name))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'build_id': meta['build_id'], 'segments': [segment['name'] for segment in meta['segments']]}, f)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+
+@resident('store_dir', ignore=('events',))
+def load_attempt_index(store_dir: str = DEFAULT_STORE, events: Optional[EventStore] = None) -> AttemptIndex:
+    """The persisted index of the store, rebuilt and saved first if the store has changed.
+
+    Pass `events` if the store is already loaded, to save reloading it on a rebuild.
+    """
+    ensure_event_store(store_dir=store_dir)
+    meta = read_meta(store_dir)
+    index_dir = os.path.join(store_dir, _INDEX_DIR)
+    index = _read_persisted(index_dir, meta)
+    if index is None:
+        events = events if events is not None else load_events(store_dir=store_dir)
+        with stage('build_attempt_index', rows=len(events)):
+            index = AttemptIndex.from_events(events)
+            _persist(index, index_dir, meta)
+    return index
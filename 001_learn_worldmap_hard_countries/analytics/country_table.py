@@ -0,0 +1,65 @@
+"""Per-country table that the summary reports (02 to 05 and 08) are rendered from.
+
+It is derived from the cached aggregates, so regenerating every report costs
+at most one scan over events that haven't been aggregated yet.
+"""
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from analytics.aggregates import Aggregates, load_aggregates
+from analytics.event_store import DEFAULT_STORE, read_meta
+from analytics.instrumentation import stage
+from analytics.resident import resident
+
+
+@dataclass
+class CountryTable:
+    """Statistics per country code."""
+    countries: List[str]
+    attempts: np.ndarray
+    wrong: np.ndarray
+    distance_offsets: np.ndarray
+    distances: np.ndarray
+    first_see_attempts: np.ndarray
+    first_see_correct: np.ndarray
+    # Country codes in the order in which anyone saw them for the first time
+    first_see_order: np.ndarray
+
+    @property
+    def right(self) -> np.ndarray:
+        return self.attempts - self.wrong
+
+    def distances_of(self, code: int) -> np.ndarray:
+        """All distances of first clicks for a country, in export order."""
+        return self.distances[self.distance_offsets[code]:self.distance_offsets[code + 1]].astype(np.float64)
+
+
+def build_country_table(aggregates: Aggregates, countries: List[str]) -> CountryTable:
+    n_countries = len(countries)
+    pair_country = aggregates.pair_key & 0xFFFF
+
+    chronological = np.lexsort((aggregates.pair_first_position, aggregates.pair_first_timestamp))
+    seen_countries = pair_country[chronological]
+    _, first_positions = np.unique(seen_countries, return_index=True)
+
+    return CountryTable(
+        countries=countries,
+        attempts=aggregates.country_attempts,
+        wrong=aggregates.country_wrong,
+        distance_offsets=aggregates.distance_offsets,
+        distances=aggregates.distances,
+        first_see_attempts=np.bincount(pair_country, minlength=n_countries),
+        first_see_correct=np.bincount(pair_country, weights=aggregates.pair_first_correct,
+                                      minlength=n_countries).astype(np.int64),
+        first_see_order=seen_countries[np.sort(first_positions)],
+    )
+
+
+@resident('store_dir')
+def load_country_table(store_dir: str = DEFAULT_STORE) -> CountryTable:
+    """Build the table from the up-to-date aggregates of the event store."""
+    aggregates = load_aggregates(store_dir)
+    with stage('country_table'):
+        return build_country_table(aggregates, read_meta(store_dir)['countries'])
@@ -0,0 +1,260 @@
+"""Per-country statistics by calendar day, for reports over a date range.
+
+Attempts, wrong guesses, clicks and distance sums are counted per (day,
+country) cell and cached in ``day_cube.npz`` next to the store. Like the
+aggregates, the cache records the segments it has seen, and an ingested
+segment is counted and folded in on the next load, extending the day axis
+as new days arrive. First sights (each user's first attempt at a country)
+are taken from the aggregates, which already track the earliest attempt of
+every pair.
+
+`DayCube` holds prefix sums over the days, so the totals of any date range
+are one subtraction per country, whatever the number of events.
+`add_window_arguments` and `country_table_from_args` give the summary
+reports (02, 03, 05 and 08) their --since and --until options.
+
+Days are calendar days in `CUBE_TIMEZONE` (UTC), so the cache doesn't
+depend on the machine it was built on.
+"""
+import argparse
+import os
+from dataclasses import dataclass, fields
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from analytics.aggregates import load_aggregates
+from analytics.country_table import CountryTable, load_country_table
+from analytics.event_store import DEFAULT_STORE, EventStore, ensure_event_store, load_segment, read_meta
+from analytics.instrumentation import stage
+from analytics.resident import resident
+from analytics.timestamps import day_buckets
+
+CUBE_TIMEZONE = 'utc'
+
+_NO_FIRST_SEE = np.iinfo(np.int64).max
+_EPOCH = date(1970, 1, 1)
+
+
+@dataclass
+class DailyCounts:
+    """Event counts per (day, country code), shape (n_days, n_countries); row 0 is `first_day`."""
+    first_day: int
+    attempts: np.ndarray
+    wrong: np.ndarray
+    clicks: np.ndarray
+    distance_sum: np.ndarray
+
+    @property
+    def n_days(self) -> int:
+        return len(self.attempts)
+
+    @classmethod
+    def from_events(cls, events: EventStore, tz: str = CUBE_TIMEZONE) -> 'DailyCounts':
+        """Count `events` in one pass."""
+        n_countries = len(events.countries)
+        days = day_buckets(events.timestamp, tz=tz)
+        first_day = int(days.min()) if len(days) else 0
+        n_days = int(days.max()) - first_day + 1 if len(days) else 0
+        cell = (days - first_day) * n_countries + np.asarray(events.country, dtype=np.int64)
+
+        def count(weights: Optional[np.ndarray] = None, dtype: type = np.int64) -> np.ndarray:
+            counts = np.bincount(cell, weights=weights, minlength=n_days * n_countries)
+            return counts.astype(dtype).reshape(n_days, n_countries)
+
+        return cls(
+            first_day=first_day,
+            attempts=count(),
+            wrong=count(events.clicks > 1),
+            clicks=count(events.clicks),
+            distance_sum=count(events.distance, np.float64),
+        )
+
+    def merge(self, other: 'DailyCounts') -> 'DailyCounts':
+        """Add the counts of other events, widening the day range and country codes as needed."""
+        if not self.n_days:
+            return other
+        if not other.n_days:
+            return self
+        first_day = min(self.first_day, other.first_day)
+        n_days = max(self.first_day + self.n_days, other.first_day + other.n_days) - first_day
+        n_countries = max(self.attempts.shape[1], other.attempts.shape[1])
+        merged = {}
+        for name in ('attempts', 'wrong', 'clicks', 'distance_sum'):
+            total = np.zeros((n_days, n_countries), dtype=getattr(self, name).dtype)
+            for counts in (self, other):
+                values = getattr(counts, name)
+                offset = counts.first_day - first_day
+                total[offset:offset + counts.n_days, :values.shape[1]] += values
+            merged[name] = total
+        return DailyCounts(first_day=first_day, **merged)
+
+
+@dataclass
+class DayCube:
+    """Prefix sums over days of per-country statistics.
+
+    Row d of a prefix-sum array holds the totals of the days before
+    `first_day + d`, so the days [a, b) of the cube sum to row b - row a.
+    """
+    countries: List[str]
+    first_day: int
+    attempts: np.ndarray
+    wrong: np.ndarray
+    clicks: np.ndarray
+    distance_sum: np.ndarray
+    first_see_attempts: np.ndarray
+    first_see_correct: np.ndarray
+    # Earliest first sight per (day, country), as (timestamp, global row); _NO_FIRST_SEE where there is none
+    first_see_timestamp: np.ndarray
+    first_see_position: np.ndarray
+
+    @property
+    def n_days(self) -> int:
+        return len(self.attempts) - 1
+
+    def rows(self, since: Optional[int] = None, until: Optional[int] = None) -> Tuple[int, int]:
+        """Prefix-sum rows bounding the days `since` to `until` (inclusive, days since 1970-01-01)."""
+        start = 0 if since is None else since - self.first_day
+        stop = self.n_days if until is None else until - self.first_day + 1
+        start = min(max(start, 0), self.n_days)
+        return start, min(max(stop, start), self.n_days)
+
+    def totals(self, since: Optional[int] = None, until: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Per-country totals of the days `since` to `until`, inclusive; None leaves that end open."""
+        start, stop = self.rows(since, until)
+        return {
+            name: getattr(self, name)[stop] - getattr(self, name)[start]
+            for name in ('attempts', 'wrong', 'clicks', 'distance_sum', 'first_see_attempts', 'first_see_correct')
+        }
+
+    def first_see_order(self, since: Optional[int] = None, until: Optional[int] = None) -> np.ndarray:
+        """Codes of the countries first seen by someone in the range, in the order of their earliest such sight."""
+        start, stop = self.rows(since, until)
+        timestamps = self.first_see_timestamp[start:stop]
+        positions = self.first_see_position[start:stop]
+        seen = (timestamps != _NO_FIRST_SEE).any(axis=0) if stop > start else np.zeros(len(self.countries), bool)
+        # Days follow the timestamps, so a country's earliest sight is in its cell with the smallest timestamp
+        first_day = np.argmin(timestamps, axis=0) if stop > start else np.zeros(len(self.countries), int)
+        codes = np.flatnonzero(seen)
+        order = np.lexsort((positions[first_day[codes], codes], timestamps[first_day[codes], codes]))
+        return codes[order]
+
+    def country_table(self, since: Optional[int] = None, until: Optional[int] = None) -> CountryTable:
+        """The country table of the summary reports, restricted to the days `since` to `until`.
+
+        Distance samples aren't kept per day, so the table has none.
+        """
+        totals = self.totals(since, until)
+        return CountryTable(
+            countries=self.countries,
+            attempts=totals['attempts'],
+            wrong=totals['wrong'],
+            distance_offsets=np.zeros(len(self.countries) + 1, dtype=np.int64),
+            distances=np.zeros(0, dtype=np.float32),
+            first_see_attempts=totals['first_see_attempts'],
+            first_see_correct=totals['first_see_correct'],
+            first_see_order=self.first_see_order(since, until),
+        )
+
+
+def _prefix_sums(daily: np.ndarray) -> np.ndarray:
+    return np.concatenate([np.zeros((1, daily.shape[1]), dtype=daily.dtype), np.cumsum(daily, axis=0)])
+
+
+def _day_cube_path(store_dir: str) -> str:
+    return os.path.join(store_dir, 'day_cube.npz')
+
+
+def load_daily_counts(store_dir: str = DEFAULT_STORE) -> DailyCounts:
+    """Up-to-date daily counts, counting only segments not folded into the cache yet."""
+    ensure_event_store(store_dir=store_dir)
+    meta = read_meta(store_dir)
+    names = [segment['name'] for segment in meta['segments']]
+
+    counts = None
+    done: List[str] = []
+    path = _day_cube_path(store_dir)
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            cached_names = list(cached['segments'])
+            if (str(cached['build_id']) == meta['build_id'] and str(cached['tz']) == CUBE_TIMEZONE
+                    and cached_names == names[:len(cached_names)]):
+                counts = DailyCounts(**{field.name: cached[field.name] for field in fields(DailyCounts)})
+                counts.first_day = int(counts.first_day)
+                done = cached_names
+
+    pending = range(len(done), len(names))
+    for index in pending:
+        with stage(f'day_counts {names[index]}', rows=meta['segments'][index]['n_events']):
+            segment_counts = DailyCounts.from_events(load_segment(names[index], store_dir))
+        counts = segment_counts if counts is None else counts.merge(segment_counts)
+
+    if pending:
+        np.savez(path, build_id=meta['build_id'], segments=np.asarray(names), tz=CUBE_TIMEZONE,
+                 **{field.name: getattr(counts, field.name) for field in fields(DailyCounts)})
+    return counts
+
+
+@resident('store_dir')
+def load_day_cube(store_dir: str = DEFAULT_STORE) -> DayCube:
+    """The cube of the event store, with the daily counts brought up to date first."""
+    counts = load_daily_counts(store_dir)
+    aggregates = load_aggregates(store_dir)
+    countries = read_meta(store_dir)['countries']
+    with stage('day_cube') as record:
+        n_countries = len(countries)
+        n_days = counts.n_days
+        daily = {name: np.zeros((n_days, n_countries), dtype=getattr(counts, name).dtype)
+                 for name in ('attempts', 'wrong', 'clicks', 'distance_sum')}
+        for name, values in daily.items():
+            values[:, :getattr(counts, name).shape[1]] = getattr(counts, name)
+
+        # First sights by the day and country of each pair's first attempt
+        pair_country = aggregates.pair_key & 0xFFFF
+        cell = ((day_buckets(aggregates.pair_first_timestamp, tz=CUBE_TIMEZONE) - counts.first_day) * n_countries
+                + pair_country)
+        record.rows = len(cell)
+        first_see_attempts = np.bincount(cell, minlength=n_days * n_countries).reshape(n_days, n_countries)
+        first_see_correct = np.bincount(cell, weights=aggregates.pair_first_correct,
+                                        minlength=n_days * n_countries).astype(np.int64).reshape(n_days, n_countries)
+        earliest = np.lexsort((aggregates.pair_first_position, aggregates.pair_first_timestamp, cell))
+        earliest = earliest[np.unique(cell[earliest], return_index=True)[1]]
+        first_see_timestamp = np.full(n_days * n_countries, _NO_FIRST_SEE, dtype=np.int64)
+        first_see_position = np.full(n_days * n_countries, _NO_FIRST_SEE, dtype=np.int64)
+        first_see_timestamp[cell[earliest]] = aggregates.pair_first_timestamp[earliest]
+        first_see_position[cell[earliest]] = aggregates.pair_first_position[earliest]
+
+        return DayCube(
+            countries=countries,
+            first_day=counts.first_day,
+            **{name: _prefix_sums(values) for name, values in daily.items()},
+            first_see_attempts=_prefix_sums(first_see_attempts),
+            first_see_correct=_prefix_sums(first_see_correct),
+            first_see_timestamp=first_see_timestamp.reshape(n_days, n_countries),
+            first_see_position=first_see_position.reshape(n_days, n_countries),
+        )
+
+
+def day_number(value: str) -> int:
+    """Days since 1970-01-01 of an ISO date (YYYY-MM-DD)."""
+    try:
+        return (date.fromisoformat(value) - _EPOCH).days
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a date (YYYY-MM-DD): {value!r}")
+
+
+def add_window_arguments(parser: argparse.ArgumentParser) -> None:
+    """The --since and --until options of the reports that can be limited to a date range."""
+    parser.add_argument('--since', type=day_number, metavar='YYYY-MM-DD',
+                        help=f"only count guesses from this day on ({CUBE_TIMEZONE.upper()})")
+    parser.add_argument('--until', type=day_number, metavar='YYYY-MM-DD',
+                        help=f"only count guesses up to and including this day ({CUBE_TIMEZONE.upper()})")
+
+
+def country_table_from_args(args: argparse.Namespace) -> CountryTable:
+    """The full country table, or the one of the date range given by `add_window_arguments`' options."""
+    if args.since is None and args.until is None:
+        return load_country_table()
+    return load_day_cube().country_table(args.since, args.until)
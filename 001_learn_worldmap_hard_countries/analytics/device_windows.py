@@ -0,0 +1,104 @@
+"""Per-device window kernels over events sorted by (device, timestamp).
+
+`distinct_countries_between` answers "how many different countries did this
+device attempt strictly between time `since` and the current guess" for
+every event at once. A window is a contiguous run of the sorted events, and
+a country is counted once within it if its previous occurrence (same device
+and country) lies before the window start. That turns the question into a
+2D dominance count, answered offline: one sort of positions and windows by
+key, then a linear stable split per level of power-of-two blocks, O(n log n)
+overall instead of a mask and `np.unique` over the whole prefix for every
+event.
+"""
+import numpy as np
+
+
+def _group_index(device: np.ndarray) -> np.ndarray:
+    """Dense 0, 1, 2, ... index of each run of equal device codes."""
+    if len(device) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.r_[0, np.cumsum(device[1:] != device[:-1])].astype(np.int64)
+
+
+def previous_occurrence(device: np.ndarray, country: np.ndarray) -> np.ndarray:
+    """Position of the previous event with the same device and country, or -1."""
+    n = len(device)
+    order = np.lexsort((np.arange(n), country, device))
+    same_pair = np.zeros(n, dtype=bool)
+    same_pair[1:] = (device[order][1:] == device[order][:-1]) & (country[order][1:] == country[order][:-1])
+    previous = np.full(n, -1, dtype=np.int64)
+    previous[order[1:][same_pair[1:]]] = order[:-1][same_pair[1:]]
+    return previous
+
+
+def _count_prefix_at_least(previous: np.ndarray, ends: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """For each query k, count positions j < ends[k] with previous[j] >= starts[k].
+
+    Positions and queries are sorted once by key, each query just before the
+    positions with previous >= start, with a query placed at position ends[k].
+    Going down from one block holding everything, every power-of-two block is
+    split stably into its left and right half. A query heading into a right
+    half counts the left-half positions after it: exactly those of the prefix
+    block it needs with previous >= start. A split is a few cumulative sums,
+    so each level is linear and the whole count O(n log n).
+    """
+    n = len(previous)
+    counts = np.zeros(len(ends), dtype=np.int64)
+    if n == 0 or len(ends) == 0:
+        return counts
+    key = np.concatenate([2 * np.asarray(previous, dtype=np.int64) + 1, 2 * np.asarray(starts, dtype=np.int64)])
+    order = np.argsort(key, kind='stable')
+    position = np.concatenate([np.arange(n, dtype=np.int64), np.asarray(ends, dtype=np.int64)])[order]
+    # Query number of each item, negative for positions
+    query = order - n
+    index = np.arange(len(order), dtype=np.int64)
+    zero = np.zeros(1, dtype=np.int64)
+    for level in range(n.bit_length() - 1, -1, -1):
+        # Items are grouped by blocks of 2 ** (level + 1) positions, each sorted by key
+        block = position >> (level + 1)
+        left = ((position >> level) & 1) == 0
+        sizes = np.bincount(block, minlength=(n >> (level + 1)) + 1)
+        block_end = np.cumsum(sizes)
+        block_first = block_end - sizes
+
+        heads_right = np.flatnonzero(~left & (query >= 0))
+        positions_before = np.concatenate([zero, np.cumsum(left & (query < 0))])
+        counts[query[heads_right]] += positions_before[block_end][block[heads_right]] - positions_before[heads_right]
+
+        # Stable split: left-half items keep their order at the front of the block, right-half ones after them
+        lefts_before = np.concatenate([zero, np.cumsum(left)])
+        block_lefts_before = lefts_before[block_first]
+        left_before = lefts_before[:-1] - block_lefts_before[block]
+        left_total = lefts_before[block_end] - block_lefts_before
+        new_index = np.where(left, block_first[block] + left_before, index + left_total[block] - left_before)
+        position[new_index] = position.copy()
+        query[new_index] = query.copy()
+    return counts
+
+
+def distinct_countries_between(device: np.ndarray, country: np.ndarray, timestamp: np.ndarray,
+                               since: np.ndarray) -> np.ndarray:
+    """Number of distinct countries each event's device attempted with since < timestamp < own timestamp.
+
+    All arrays are aligned and sorted by (device, timestamp).
+    """
+    n = len(device)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Encode (device, timestamp) as one sortable integer via dense timestamp ranks
+    unique_timestamps = np.unique(timestamp)
+    group = _group_index(device)
+    stride = len(unique_timestamps) + 1
+    keys = group * stride + np.searchsorted(unique_timestamps, timestamp, side='right')
+    window_start = np.searchsorted(keys, group * stride + np.searchsorted(unique_timestamps, since, side='right'),
+                                   side='right')
+    window_end = np.searchsorted(keys, keys, side='left')
+
+    result = np.zeros(n, dtype=np.int64)
+    nonempty = window_start < window_end
+    if nonempty.any():
+        starts, ends = window_start[nonempty], window_end[nonempty]
+        repeats = _count_prefix_at_least(previous_occurrence(device, country), ends, starts)
+        result[nonempty] = (ends - starts) - repeats
+    return result
@@ -0,0 +1,359 @@
+"""Ad-hoc filters over the learning events, composed as set operations.
+
+Questions like "error rates of users with at least 50 guesses, in Africa,
+in April" are answered by combining selections instead of copying a script
+and adding conditions to its event loop:
+
+    query = EventQuery()
+    selection = query.activity(min_guesses=50) & query.region('Africa') & query.dates('2025-04-01', '2025-04-30')
+    table = selection.country_table()
+
+A `Selection` is a boolean mask over the store's rows, one byte per event,
+so &, |, - and ~ are single vectorized operations. Filters are built from
+sorted indexes rather than by scanning the events:
+
+- countries and devices: the CSR groups of the attempt index. A selective
+  filter expands only the matching rows; one that matches a large share of
+  the events looks its values up per event instead, which is faster then.
+- regions and subregions: the map's countries per region (`GeoIndex`).
+- activity tiers and first-seen dates: the per-device totals and first
+  timestamps of the aggregates, then the device filter.
+- dates: the store rows in timestamp order, persisted in ``time_index/``
+  next to the store; a date range is one slice of it.
+
+`Selection.country_table()` returns the CountryTable that 02 to 05 and 08
+render from, so their per-country aggregations run on any selection. A
+user's first sight of a country remains their first attempt in the whole
+store; a selection only decides which of those first sights count. Dates
+are UTC days, as in `analytics.day_cube`.
+"""
+import json
+import os
+import shutil
+from dataclasses import dataclass, fields
+from datetime import date
+from functools import cached_property
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from analytics.aggregates import load_aggregates
+from analytics.attempt_index import load_attempt_index
+from analytics.country_table import CountryTable
+from analytics.event_store import DEFAULT_STORE, EventStore, ensure_event_store, load_events, read_meta
+from analytics.geo_index import GEO_PATH, GeoIndex, load_geo_index
+from analytics.instrumentation import stage
+from analytics.resident import resident
+from analytics.timestamps import MS_PER_DAY
+
+_INDEX_DIR = 'time_index'
+_EPOCH = date(1970, 1, 1)
+
+# Activity tier -> (min, max) guesses of a device over the whole store, inclusive; None leaves it open
+ACTIVITY_TIERS: Dict[str, Tuple[int, Optional[int]]] = {
+    'light': (1, 9),
+    'casual': (10, 49),
+    'regular': (50, 199),
+    'heavy': (200, None),
+}
+
+# Filters matching less than this share of the events set their rows from the index; others look up every event
+SCATTER_SHARE = 1 / 16
+
+Day = Union[str, date]
+
+
+@dataclass
+class TimeIndex:
+    """Store rows in timestamp order, ties in export order."""
+    order: np.ndarray
+    timestamp: np.ndarray
+
+    @classmethod
+    def from_events(cls, events: EventStore) -> 'TimeIndex':
+        order = np.argsort(events.timestamp, kind='stable')
+        return cls(order=order, timestamp=np.asarray(events.timestamp)[order])
+
+
+def _read_persisted(index_dir: str, meta: dict) -> Optional[TimeIndex]:
+    meta_path = os.path.join(index_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        index_meta = json.load(f)
+    if index_meta.get('build_id') != meta['build_id'] or index_meta.get('segments') != [
+            segment['name'] for segment in meta['segments']]:
+        return None
+    return TimeIndex(**{
+        field.name: np.load(os.path.join(index_dir, f'{field.name}.npy'), mmap_mode='r')
+        for field in fields(TimeIndex)
+    })
+
+
+def _persist(index: TimeIndex, index_dir: str, meta: dict) -> None:
+    tmp_dir = index_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for field in fields(TimeIndex):
+        np.save(os.path.join(tmp_dir, f'{field.name}.npy'), getattr(index, field.name))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'build_id': meta['build_id'], 'segments': [segment['name'] for segment in meta['segments']]}, f)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+
+@resident('store_dir', ignore=('events',))
+def load_time_index(store_dir: str = DEFAULT_STORE, events: Optional[EventStore] = None) -> TimeIndex:
+    """The persisted time index of the store, rebuilt and saved first if the store has changed."""
+    ensure_event_store(store_dir=store_dir)
+    meta = read_meta(store_dir)
+    index_dir = os.path.join(store_dir, _INDEX_DIR)
+    index = _read_persisted(index_dir, meta)
+    if index is None:
+        events = events if events is not None else load_events(store_dir=store_dir)
+        with stage('build_time_index', rows=len(events)):
+            index = TimeIndex.from_events(events)
+            _persist(index, index_dir, meta)
+    return index
+
+
+def expand_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """The concatenation of arange(start, end) over the ranges, without a Python loop."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    # Within each range, positions count up from its start
+    shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(total, dtype=np.int64) + shifts
+
+
+def day_start_ms(day: Day) -> int:
+    """Epoch milliseconds of 00:00 UTC on a day, given as a date or YYYY-MM-DD."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return (day - _EPOCH).days * MS_PER_DAY
+
+
+class Selection:
+    """A set of store rows of an `EventQuery`, as a boolean mask."""
+
+    def __init__(self, query: 'EventQuery', mask: np.ndarray):
+        self.query = query
+        self.mask = mask
+
+    def __and__(self, other: 'Selection') -> 'Selection':
+        return Selection(self.query, self.mask & other.mask)
+
+    def __or__(self, other: 'Selection') -> 'Selection':
+        return Selection(self.query, self.mask | other.mask)
+
+    def __sub__(self, other: 'Selection') -> 'Selection':
+        return Selection(self.query, self.mask & ~other.mask)
+
+    def __invert__(self) -> 'Selection':
+        return Selection(self.query, ~self.mask)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.mask))
+
+    def rows(self) -> np.ndarray:
+        """Selected store rows, in export order."""
+        return np.flatnonzero(self.mask)
+
+    def events(self) -> EventStore:
+        """The selected events as an EventStore, with the store's dictionaries."""
+        rows = self.rows()
+        events = self.query.events
+        return EventStore(**{
+            field.name: getattr(events, field.name) if field.name in ('countries', 'devices')
+            else np.asarray(getattr(events, field.name))[rows]
+            for field in fields(EventStore)
+        })
+
+    def n_devices(self) -> int:
+        """Number of devices with at least one selected event."""
+        return int(np.count_nonzero(np.bincount(self.query.device_column[self.mask],
+                                                minlength=len(self.query.events.devices))))
+
+    def country_table(self) -> CountryTable:
+        """Per-country statistics of the selected events, as `load_country_table` computes them for all."""
+        events = self.query.events
+        n_countries = len(events.countries)
+        rows = self.rows()
+        country = self.query.country_column[rows]
+        attempts = np.bincount(country, minlength=n_countries)
+        by_country = np.argsort(country, kind='stable')
+
+        # Selected events that were a user's first attempt at the country, in the order they happened
+        first = rows[self.query.is_first_see[rows]]
+        first_country = self.query.country_column[first]
+        chronological = np.lexsort((first, np.asarray(events.timestamp)[first]))
+        seen_countries = first_country[chronological]
+        _, first_positions = np.unique(seen_countries, return_index=True)
+
+        return CountryTable(
+            countries=events.countries,
+            attempts=attempts,
+            wrong=np.bincount(country, weights=np.asarray(events.clicks)[rows] > 1,
+                              minlength=n_countries).astype(np.int64),
+            distance_offsets=np.r_[0, np.cumsum(attempts)],
+            distances=np.asarray(events.distance)[rows][by_country],
+            first_see_attempts=np.bincount(first_country, minlength=n_countries),
+            first_see_correct=np.bincount(first_country, weights=events.is_correct[first],
+                                          minlength=n_countries).astype(np.int64),
+            first_see_order=seen_countries[np.sort(first_positions)],
+        )
+
+
+class EventQuery:
+    """Filters over the events of a store, each returning a `Selection`."""
+
+    def __init__(self, store_dir: str = DEFAULT_STORE, geo_path: str = GEO_PATH):
+        self.events = load_events(store_dir=store_dir)
+        self.attempt_index = load_attempt_index(store_dir, events=self.events)
+        self.aggregates = load_aggregates(store_dir)
+        self.time_index = load_time_index(store_dir, events=self.events)
+        self.geo_path = geo_path
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    @cached_property
+    def country_column(self) -> np.ndarray:
+        return np.asarray(self.events.country)
+
+    @cached_property
+    def device_column(self) -> np.ndarray:
+        return np.asarray(self.events.device)
+
+    @cached_property
+    def is_first_see(self) -> np.ndarray:
+        """True for store rows that are a user's first attempt at a country."""
+        index = self.attempt_index
+        first = np.zeros(len(self.events), dtype=bool)
+        first[index.order[np.asarray(index.attempt_number) == 1]] = True
+        return first
+
+    @cached_property
+    def geo_index(self) -> GeoIndex:
+        return load_geo_index(self.geo_path)
+
+    @cached_property
+    def _country_codes(self) -> Dict[str, int]:
+        return {country: code for code, country in enumerate(self.events.countries)}
+
+    @cached_property
+    def _device_codes(self) -> Dict[str, int]:
+        return {device: code for code, device in enumerate(self.events.devices)}
+
+    def all(self) -> Selection:
+        return Selection(self, np.ones(len(self.events), dtype=bool))
+
+    def none(self) -> Selection:
+        return Selection(self, np.zeros(len(self.events), dtype=bool))
+
+    def _values(self, selected: np.ndarray, column: np.ndarray, rows_per_value: np.ndarray,
+                rows_of: Callable[[np.ndarray], np.ndarray]) -> Selection:
+        """Rows whose `column` value is selected; `rows_of` lists the store rows of given values."""
+        if rows_per_value[selected].sum() < len(self.events) * SCATTER_SHARE:
+            mask = np.zeros(len(self.events), dtype=bool)
+            mask[rows_of(np.flatnonzero(selected))] = True
+            return Selection(self, mask)
+        return Selection(self, selected[column])
+
+    def _countries(self, selected: np.ndarray) -> Selection:
+        index = self.attempt_index
+        offsets = np.asarray(index.country_offsets)
+        return self._values(
+            selected, self.country_column, np.diff(offsets),
+            lambda codes: index.order[index.country_positions[expand_ranges(offsets[codes], offsets[codes + 1])]],
+        )
+
+    def _devices(self, selected: np.ndarray) -> Selection:
+        index = self.attempt_index
+        offsets = np.asarray(index.device_offsets)
+        return self._values(selected, self.device_column, np.diff(offsets),
+                            lambda codes: index.order[expand_ranges(offsets[codes], offsets[codes + 1])])
+
+    def country(self, *names: str) -> Selection:
+        """Events of the given countries; any of the map's names for a country works."""
+        selected = np.zeros(len(self.events.countries), dtype=bool)
+        for name in names:
+            code = self._country_codes.get(name)
+            if code is None:
+                code = self._country_codes.get(self.geo_index.resolve(name) or '')
+            if code is None:
+                raise ValueError(f"No events for country {name!r}")
+            selected[code] = True
+        return self._countries(selected)
+
+    def region(self, region: str) -> Selection:
+        """Events of the countries in a UN region of the map (region_un, e.g. 'Africa')."""
+        return self._regions(region, 0)
+
+    def subregion(self, subregion: str) -> Selection:
+        """Events of the countries in a UN subregion of the map (e.g. 'Western Africa')."""
+        return self._regions(subregion, 1)
+
+    def _regions(self, name: str, level: int) -> Selection:
+        regions = [self.geo_index.region_of(country)[level] for country in self.events.countries]
+        if name not in regions:
+            known = ', '.join(sorted(set(regions)))
+            raise ValueError(f"No events in {'region' if level == 0 else 'subregion'} {name!r}; one of {known}")
+        return self._countries(np.array([region == name for region in regions], dtype=bool))
+
+    def device(self, *device_ids: str) -> Selection:
+        """Events of the given devices."""
+        selected = np.zeros(len(self.events.devices), dtype=bool)
+        for device_id in device_ids:
+            if device_id not in self._device_codes:
+                raise ValueError(f"No events for device {device_id!r}")
+            selected[self._device_codes[device_id]] = True
+        return self._devices(selected)
+
+    def activity(self, min_guesses: Optional[int] = None, max_guesses: Optional[int] = None) -> Selection:
+        """Events of devices with `min_guesses` to `max_guesses` guesses in the whole store (inclusive)."""
+        guesses = self.aggregates.device_attempts
+        selected = np.ones(len(guesses), dtype=bool)
+        if min_guesses is not None:
+            selected &= guesses >= min_guesses
+        if max_guesses is not None:
+            selected &= guesses <= max_guesses
+        return self._devices(selected)
+
+    def tier(self, name: str) -> Selection:
+        """Events of the devices in an activity tier of `ACTIVITY_TIERS`."""
+        if name not in ACTIVITY_TIERS:
+            raise ValueError(f"Unknown activity tier {name!r}; one of {', '.join(ACTIVITY_TIERS)}")
+        return self.activity(*ACTIVITY_TIERS[name])
+
+    def first_seen(self, since: Optional[Day] = None, until: Optional[Day] = None) -> Selection:
+        """Events of devices whose first guess was on the days `since` to `until` (inclusive): new users."""
+        first = self.aggregates.device_first_timestamp
+        selected = np.ones(len(first), dtype=bool)
+        if since is not None:
+            selected &= first >= day_start_ms(since)
+        if until is not None:
+            selected &= first < day_start_ms(until) + MS_PER_DAY
+        return self._devices(selected)
+
+    def dates(self, since: Optional[Day] = None, until: Optional[Day] = None) -> Selection:
+        """Events on the days `since` to `until` (inclusive, UTC)."""
+        timestamps = self.time_index.timestamp
+        start = 0 if since is None else int(np.searchsorted(timestamps, day_start_ms(since)))
+        stop = len(timestamps) if until is None else int(np.searchsorted(timestamps,
+                                                                          day_start_ms(until) + MS_PER_DAY))
+        stop = max(stop, start)
+        if stop - start < len(self.events) * SCATTER_SHARE:
+            mask = np.zeros(len(self.events), dtype=bool)
+            mask[self.time_index.order[start:stop]] = True
+            return Selection(self, mask)
+        # A wide range: compare every timestamp with the range's bounds, found in the index
+        column = np.asarray(self.events.timestamp)
+        mask = np.ones(len(self.events), dtype=bool)
+        if start > 0:
+            mask &= column >= timestamps[start]
+        if stop < len(timestamps):
+            mask &= column < timestamps[stop]
+        return Selection(self, mask)
@@ -0,0 +1,287 @@
+"""Columnar, memory-mapped store for the learning events.
+
+The filtered Firestore export is converted once into one ``.npy`` file per
+field. Strings are dictionary-encoded, so opening the store only maps a few
+typed arrays instead of parsing every event into Python objects.
+
+Events live in append-only segments (``seg-00000/``, ...). The initial build
+writes one; `analytics.ingest` adds one per new export.
+"""
+import json
+import os
+import shutil
+import uuid
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from analytics.export_stream import iter_export
+from analytics.instrumentation import stage
+from analytics.resident import resident
+from analytics.interning import Interner
+from analytics.timestamps import parse_iso_timestamps
+
+# Outputs of script 01, in either of its formats
+SOURCE_CANDIDATES = [
+    'data/full/learning_data_after_cutoff.json',
+    'data/full/learning_data_after_cutoff.ndjson',
+    'data/full/learning_data_after_cutoff.ndjson.gz',
+]
+DEFAULT_STORE = 'data/full/events'
+STORE_VERSION = 2
+
+# Column name -> on-disk dtype
+COLUMNS: Dict[str, type] = {
+    'timestamp': np.int64,        # epoch milliseconds (UTC)
+    'country': np.uint16,         # code into `countries`
+    'device': np.int32,           # code into `devices`
+    'clicks': np.uint8,           # numberOfClicksNeeded
+    'distance': np.float32,       # distanceOfFirstClickToCenterOfCountry
+    'ms_first_click': np.int32,   # msFromExerciseToFirstClick
+    'ms_finish_click': np.int32,  # msFromExerciseToFinishClick
+}
+
+
+@dataclass
+class EventStore:
+    """Learning events as parallel column arrays, in export order."""
+    timestamp: np.ndarray
+    country: np.ndarray
+    device: np.ndarray
+    clicks: np.ndarray
+    distance: np.ndarray
+    ms_first_click: np.ndarray
+    ms_finish_click: np.ndarray
+    doc_id: np.ndarray
+    countries: List[str]
+    devices: List[str]
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    @property
+    def is_correct(self) -> np.ndarray:
+        """True where the country was found with a single click."""
+        return self.clicks == 1
+
+    @cached_property
+    def country_interner(self) -> Interner:
+        """Country codes with their reverse lookup and collation ranks."""
+        return Interner(self.countries, COLUMNS['country'])
+
+    @cached_property
+    def device_interner(self) -> Interner:
+        """Device codes with their reverse lookup and collation ranks."""
+        return Interner(self.devices, COLUMNS['device'])
+
+    def country_name(self, code: int) -> str:
+        return self.countries[code]
+
+    def device_id(self, code: int) -> str:
+        return self.devices[code]
+
+
+def find_source() -> str:
+    """Pick the most recently written output of script 01."""
+    existing = [path for path in SOURCE_CANDIDATES if os.path.exists(path)]
+    if not existing:
+        return SOURCE_CANDIDATES[0]
+    return max(existing, key=os.path.getmtime)
+
+
+def source_fingerprint(source: str) -> Dict:
+    """Path, size and modification time of a source file, to detect changes."""
+    stat = os.stat(source)
+    return {'source': os.path.abspath(source), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _encode_entries(entries: Iterable[Tuple[str, Dict]], country_codes: Interner,
+                    device_codes: Interner) -> Dict[str, np.ndarray]:
+    """Turn (document id, event) pairs into typed columns, extending the dictionaries."""
+    columns: Dict[str, List] = {name: [] for name in COLUMNS}
+    doc_ids = []
+
+    for doc_id, entry in entries:
+        doc_ids.append(doc_id)
+        columns['timestamp'].append(entry['timestamp'])
+        columns['country'].append(country_codes.code(entry['country']))
+        columns['device'].append(device_codes.code(entry['deviceId']))
+        columns['clicks'].append(entry['numberOfClicksNeeded'])
+        columns['distance'].append(entry['distanceOfFirstClickToCenterOfCountry'])
+        columns['ms_first_click'].append(entry['msFromExerciseToFirstClick'])
+        columns['ms_finish_click'].append(entry['msFromExerciseToFinishClick'])
+
+    columns['timestamp'] = parse_iso_timestamps(columns['timestamp'])
+    arrays = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in COLUMNS.items()}
+    arrays['doc_id'] = np.asarray(doc_ids, dtype='S')
+    return arrays
+
+
+def _write_segment(segment_dir: str, arrays: Dict[str, np.ndarray]) -> Dict:
+    os.makedirs(segment_dir)
+    for name, values in arrays.items():
+        np.save(os.path.join(segment_dir, f'{name}.npy'), values)
+    timestamps = arrays['timestamp']
+    return {
+        'name': os.path.basename(segment_dir),
+        'n_events': len(timestamps),
+        'max_timestamp': int(timestamps.max()) if len(timestamps) else None,
+    }
+
+
+def _write_meta(store_dir: str, meta: Dict) -> None:
+    tmp_path = os.path.join(store_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(store_dir, 'meta.json'))
+
+
+def _next_segment_name(meta: Dict) -> str:
+    last = max(int(segment['name'].split('-')[1]) for segment in meta['segments'])
+    return f"seg-{last + 1:05d}"
+
+
+def build_event_store(source: Optional[str] = None, store_dir: str = DEFAULT_STORE) -> None:
+    """Convert a JSON or NDJSON export into the columnar store at `store_dir`."""
+    source = source or find_source()
+    country_codes = Interner(dtype=COLUMNS['country'])
+    device_codes = Interner(dtype=COLUMNS['device'])
+    arrays = _encode_entries(iter_export(source), country_codes, device_codes)
+
+    # Write next to the target and swap in, so readers never see a half-written store
+    tmp_dir = store_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    segment = _write_segment(os.path.join(tmp_dir, 'seg-00000'), arrays)
+    _write_meta(tmp_dir, {
+        'version': STORE_VERSION,
+        'build_id': uuid.uuid4().hex,
+        'n_events': segment['n_events'],
+        'countries': country_codes.values,
+        'devices': device_codes.values,
+        'segments': [segment],
+        'fingerprint': source_fingerprint(source),
+    })
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+
+
+def append_segment(entries: Iterable[Tuple[str, Dict]], store_dir: str = DEFAULT_STORE) -> Dict:
+    """Store new events as an additional segment and return its description.
+
+    Country and device codes of existing segments stay valid, new strings are
+    appended to the dictionaries.
+    """
+    meta = read_meta(store_dir)
+    country_codes = Interner(meta['countries'], COLUMNS['country'])
+    device_codes = Interner(meta['devices'], COLUMNS['device'])
+    arrays = _encode_entries(entries, country_codes, device_codes)
+
+    segment = _write_segment(os.path.join(store_dir, _next_segment_name(meta)), arrays)
+    meta['n_events'] += segment['n_events']
+    meta['countries'] = country_codes.values
+    meta['devices'] = device_codes.values
+    meta['segments'].append(segment)
+    _write_meta(store_dir, meta)
+    return segment
+
+
+def read_meta(store_dir: str = DEFAULT_STORE) -> Dict:
+    """Return the store's dictionaries and segment list."""
+    with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+
+def is_stale(source: Optional[str] = None, store_dir: str = DEFAULT_STORE) -> bool:
+    """Check whether the store is missing or was built from a different export."""
+    source = source or find_source()
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return True
+    meta = read_meta(store_dir)
+    if meta.get('version') != STORE_VERSION:
+        return True
+    if not os.path.exists(source):
+        return False
+    return meta['fingerprint'] != source_fingerprint(source)
+
+
+def ensure_event_store(source: Optional[str] = None, store_dir: str = DEFAULT_STORE) -> None:
+    """(Re)build the store from `source` if it is missing or outdated."""
+    source = source or find_source()
+    if is_stale(source, store_dir):
+        with stage('build_event_store') as record:
+            build_event_store(source, store_dir)
+            record.rows = read_meta(store_dir)['n_events']
+
+
+def _load_segment_arrays(store_dir: str, segment_name: str) -> Dict[str, np.ndarray]:
+    return {
+        name: np.load(os.path.join(store_dir, segment_name, f'{name}.npy'), mmap_mode='r')
+        for name in list(COLUMNS) + ['doc_id']
+    }
+
+
+def segment_names(store_dir: str = DEFAULT_STORE) -> List[str]:
+    return [segment['name'] for segment in read_meta(store_dir)['segments']]
+
+
+def load_segment(segment_name: str, store_dir: str = DEFAULT_STORE) -> EventStore:
+    """Open a single segment, with the store-wide dictionaries."""
+    meta = read_meta(store_dir)
+    arrays = _load_segment_arrays(store_dir, segment_name)
+    return EventStore(**arrays, countries=meta['countries'], devices=meta['devices'])
+
+
+@resident('store_dir')
+def load_events(source: Optional[str] = None, store_dir: str = DEFAULT_STORE) -> EventStore:
+    """Open the event store, (re)building it from `source` first if needed.
+
+    A single-segment store is returned as memory-mapped arrays; segments
+    appended by the ingest step are concatenated in memory until the store is
+    compacted.
+    """
+    with stage('load_events') as record:
+        ensure_event_store(source, store_dir)
+
+        meta = read_meta(store_dir)
+        record.rows = meta['n_events']
+        segments = [_load_segment_arrays(store_dir, segment['name']) for segment in meta['segments']]
+        if len(segments) == 1:
+            arrays = segments[0]
+        else:
+            arrays = {name: np.concatenate([segment[name] for segment in segments]) for name in segments[0]}
+        return EventStore(**arrays, countries=meta['countries'], devices=meta['devices'])
+
+
+def read_export_events(source: str) -> EventStore:
+    """Decode an export file into an in-memory EventStore without writing a store."""
+    country_codes = Interner(dtype=COLUMNS['country'])
+    device_codes = Interner(dtype=COLUMNS['device'])
+    arrays = _encode_entries(iter_export(source), country_codes, device_codes)
+    return EventStore(**arrays, countries=country_codes.values, devices=device_codes.values)
+
+
+def compact_event_store(store_dir: str = DEFAULT_STORE) -> None:
+    """Merge all segments into one, so the whole store is memory-mapped again."""
+    meta = read_meta(store_dir)
+    if len(meta['segments']) <= 1:
+        return
+    events = load_events(store_dir=store_dir)
+    arrays = {name: getattr(events, name) for name in list(COLUMNS) + ['doc_id']}
+
+    segment = _write_segment(os.path.join(store_dir, _next_segment_name(meta)), arrays)
+    old_names = [old['name'] for old in meta['segments']]
+    meta['segments'] = [segment]
+    _write_meta(store_dir, meta)
+    for name in old_names:
+        shutil.rmtree(os.path.join(store_dir, name))
+
+
+if __name__ == '__main__':
+    build_event_store()
+    events = load_events()
+    print(f"Stored {len(events)} events ({len(events.countries)} countries, "
+          f"{len(events.devices)} devices) in {DEFAULT_STORE}")
@@ -0,0 +1,116 @@
+"""Read and write learning-data exports one event at a time.
+
+Two formats are understood:
+
+- the Firestore export written by `00_get_firebase_data.js`, a single JSON
+  object mapping document ids to events, and
+- line-delimited JSON (NDJSON), one compact event per line with its
+  document id under `docId`.
+
+Either may be gzip-compressed (`.gz` suffix). Memory use stays flat no matter
+how large the export gets.
+"""
+import gzip
+import json
+from typing import Dict, IO, Iterator, Tuple
+
+DOC_ID_KEY = 'docId'
+
+_WHITESPACE = ' \t\n\r'
+_CHUNK_SIZE = 1 << 20
+
+
+def open_text(path: str, mode: str = 'r') -> IO[str]:
+    """Open a text file, transparently (de)compressing `.gz` paths."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=5)
+    return open(path, mode, encoding='utf-8')
+
+
+def is_ndjson(path: str) -> bool:
+    return path.endswith('.ndjson') or path.endswith('.ndjson.gz')
+
+
+class _ObjectReader:
+    """Incremental tokenizer for the members of one large top-level JSON object."""
+
+    def __init__(self, f: IO[str]):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(_CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character, or '' at end of file."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON export, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value, reading more input until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_export(path: str) -> Iterator[Tuple[str, Dict]]:
+    """Yield (document id, event) pairs from a Firestore JSON export."""
+    with open_text(path) as f:
+        reader = _ObjectReader(f)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            doc_id = reader.value()
+            reader.expect(':')
+            yield doc_id, reader.value()
+            separator = reader.peek()
+            if separator == '}':
+                return
+            reader.expect(',')
+
+
+def iter_ndjson(path: str) -> Iterator[Tuple[str, Dict]]:
+    """Yield (document id, event) pairs from a line-delimited export."""
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry.pop(DOC_ID_KEY), entry
+
+
+def iter_export(path: str) -> Iterator[Tuple[str, Dict]]:
+    """Yield (document id, event) pairs from an export in either format."""
+    if is_ndjson(path):
+        return iter_ndjson(path)
+    return iter_json_export(path)
+
+
+def to_ndjson_line(doc_id: str, entry: Dict) -> str:
+    """Serialize one event as a compact NDJSON line."""
+    return json.dumps({DOC_ID_KEY: doc_id, **entry}, separators=(',', ':'), ensure_ascii=False) + '\n'
@@ -0,0 +1,161 @@
+"""Chunked, compressed columnar storage for the per-guess predictor dataset of 10.
+
+The full table is written once, as compressed ``.npz`` chunks of at most
+`CHUNK_ROWS` rows. String columns are stored as interned codes with their
+lookup tables in ``meta.json``, and the compound key column is rebuilt from
+its parts on load instead of being stored. Train, val and demo are row-index
+sets in ``splits.npz`` rather than copies of the rows. `FeatureDatasetWriter` takes
+the rows in batches (10's out-of-core mode appends one partition at a time
+and flushes it as chunks of its own).
+"""
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_DATASET = 'data/full/predictor_alt'
+DATASET_VERSION = 1
+CHUNK_ROWS = 1_000_000
+
+
+class FeatureDatasetWriter:
+    """Writes a dataset from batches of rows, in chunks of `chunk_rows`, replacing the old one on `close`.
+
+    Columns named in `categories` hold codes into the given lookup tables.
+    `compound_key` ({'name': ..., 'parts': [...], 'separator': ...}) describes
+    a string column that is rebuilt from other columns on load, and
+    `output_columns` the column order of loaded tables.
+    """
+
+    def __init__(self, categories: Dict[str, List[str]], dataset_dir: str = DEFAULT_DATASET,
+                 compound_key: Optional[Dict] = None, output_columns: Optional[List[str]] = None,
+                 chunk_rows: int = CHUNK_ROWS):
+        self.categories = categories
+        self.dataset_dir = dataset_dir
+        self.compound_key = compound_key
+        self.output_columns = output_columns
+        self.chunk_rows = chunk_rows
+        self.tmp_dir = dataset_dir + '.tmp'
+        self.n_rows = 0
+        self.chunks: List[Dict] = []
+        self.dtypes: Dict[str, str] = {}
+        # Rows appended but not written yet, always fewer than chunk_rows between appends
+        self._pending: Dict[str, np.ndarray] = {}
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+
+    def _write_chunk(self, columns: Dict[str, np.ndarray]) -> None:
+        name = f'chunk-{len(self.chunks):05d}.npz'
+        np.savez_compressed(os.path.join(self.tmp_dir, name), **columns)
+        self.chunks.append({'name': name, 'n_rows': len(next(iter(columns.values()))) if columns else 0})
+
+    def append(self, columns: Dict[str, np.ndarray]) -> None:
+        """Add rows, given as columns of equal length, after the rows appended before."""
+        if not self.dtypes:
+            self.dtypes = {column: str(values.dtype) for column, values in columns.items()}
+        self.n_rows += len(next(iter(columns.values()))) if columns else 0
+        if self._pending_rows():
+            columns = {column: np.concatenate([self._pending[column], values]) for column, values in columns.items()}
+        n_rows = len(next(iter(columns.values()))) if columns else 0
+        start = 0
+        while n_rows - start >= self.chunk_rows:
+            # Slices are views, so only the compressed bytes are materialized
+            self._write_chunk({column: values[start:start + self.chunk_rows] for column, values in columns.items()})
+            start += self.chunk_rows
+        self._pending = {column: values[start:] for column, values in columns.items()}
+
+    def _pending_rows(self) -> int:
+        return len(next(iter(self._pending.values()))) if self._pending else 0
+
+    def flush(self) -> None:
+        """Write the rows not written yet as a (shorter) chunk, so no rows stay buffered."""
+        if self._pending_rows():
+            self._write_chunk(self._pending)
+        self._pending = {}
+
+    def close(self, splits: Dict[str, np.ndarray]) -> None:
+        """Write the remaining rows, the splits (row indices) and meta.json, and replace the old dataset."""
+        if self._pending_rows() or not self.chunks:
+            self._write_chunk(self._pending)
+        self._pending = {}
+        np.savez_compressed(os.path.join(self.tmp_dir, 'splits.npz'), **splits)
+
+        key = self.compound_key
+        meta = {
+            'version': DATASET_VERSION,
+            'n_rows': self.n_rows,
+            'columns': self.dtypes,
+            'categories': self.categories,
+            'compound_key': key,
+            'output_columns': self.output_columns or list(self.dtypes) + ([key['name']] if key else []),
+            'chunks': self.chunks,
+            'splits': {name: len(rows) for name, rows in splits.items()},
+        }
+        with open(os.path.join(self.tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(self.dataset_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.dataset_dir)
+
+
+def write_feature_dataset(columns: Dict[str, np.ndarray], categories: Dict[str, List[str]],
+                          splits: Dict[str, np.ndarray], dataset_dir: str = DEFAULT_DATASET,
+                          compound_key: Optional[Dict] = None, output_columns: Optional[List[str]] = None,
+                          chunk_rows: int = CHUNK_ROWS) -> None:
+    """Write `columns` as chunks, replacing any previous dataset (see `FeatureDatasetWriter`)."""
+    writer = FeatureDatasetWriter(categories, dataset_dir, compound_key, output_columns, chunk_rows)
+    writer.append(columns)
+    writer.close(splits)
+
+
+def read_dataset_meta(dataset_dir: str = DEFAULT_DATASET) -> Dict:
+    with open(os.path.join(dataset_dir, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+
+def load_split(name: str, dataset_dir: str = DEFAULT_DATASET) -> np.ndarray:
+    """Row indices of a split ('train', 'val' or 'demo') into the full table."""
+    with np.load(os.path.join(dataset_dir, 'splits.npz')) as splits:
+        return splits[name]
+
+
+def load_feature_columns(dataset_dir: str = DEFAULT_DATASET, columns: Optional[Sequence[str]] = None
+                         ) -> Dict[str, np.ndarray]:
+    """Stored columns of the full table as arrays (string columns as codes)."""
+    meta = read_dataset_meta(dataset_dir)
+    names = list(meta['columns']) if columns is None else list(columns)
+    parts: Dict[str, List[np.ndarray]] = {name: [] for name in names}
+    for chunk in meta['chunks']:
+        with np.load(os.path.join(dataset_dir, chunk['name'])) as arrays:
+            for name in names:
+                parts[name].append(arrays[name])
+    return {name: np.concatenate(values) for name, values in parts.items()}
+
+
+def load_feature_dataset(split: Optional[str] = None, dataset_dir: str = DEFAULT_DATASET,
+                         columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """The full table, or the rows of one split, as a DataFrame like 10's CSVs."""
+    meta = read_dataset_meta(dataset_dir)
+    key = meta['compound_key']
+    wanted = meta['output_columns'] if columns is None else list(columns)
+    needed = set(wanted)
+    if key and key['name'] in needed:
+        needed.update(key['parts'])
+    stored = [name for name in meta['columns'] if name in needed]
+    arrays = load_feature_columns(dataset_dir, stored)
+    rows = load_split(split, dataset_dir) if split else None
+
+    df = pd.DataFrame({
+        name: pd.Categorical.from_codes(values, meta['categories'][name]) if name in meta['categories'] else values
+        for name, values in ((name, arrays[name] if rows is None else arrays[name][rows]) for name in stored)
+    })
+    if key and key['name'] in wanted:
+        parts = [df[part].astype(str).astype(object) for part in key['parts']]
+        joined = parts[0]
+        for part in parts[1:]:
+            joined = joined + key['separator'] + part
+        df[key['name']] = joined
+    return df[wanted]
@@ -0,0 +1,224 @@
+"""Country metadata of the world map, without its geometry.
+
+The map is tens of megabytes of coordinates, but the scripts only need a
+few properties per country. The index scans the file once: it decodes
+each feature's ``properties`` object and reads the coordinate text of its
+geometry as a flat array of numbers for the bounding box, without building
+the nested polygon lists. The result is cached as small JSON next to the
+map and rebuilt when the map file changes.
+
+Names in the learning data follow ``admin``, but the map's other name
+fields (``name``, ``name_long``, ...) differ for some countries, e.g.
+"Antigua and Barb." for "Antigua and Barbuda". `GeoIndex.resolve` maps
+any of them to the canonical ``admin`` name.
+"""
+import bisect
+import json
+import os
+import re
+import unicodedata
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from analytics.event_store import source_fingerprint
+from analytics.export_stream import open_text
+from analytics.resident import resident
+
+GEO_PATH = 'data/full/worldmap.geo.json'
+INDEX_VERSION = 2
+UNKNOWN_REGION = ('Unknown', 'Unknown')
+
+# Properties that name a country, besides `admin`
+ALIAS_PROPERTIES = ['name', 'name_long', 'name_en', 'name_sort', 'name_ciawf', 'brk_name',
+                    'geounit', 'subunit', 'formal_en', 'abbrev', 'iso_a3', 'adm0_a3']
+
+_PROPERTIES = re.compile(r'"properties"\s*:\s*')
+_GEOMETRY = re.compile(r'"geometry"\s*:\s*')
+_COORDINATES = re.compile(r'"coordinates"\s*:\s*')
+_NOT_COORDINATE_TEXT = re.compile(r'[^\d\s\[\],.eE+-]')
+_BRACKETS = str.maketrans('[],', '   ')
+
+
+@dataclass
+class CountryInfo:
+    """Metadata of one map feature."""
+    admin: str
+    name: str
+    region: str
+    subregion: str
+    continent: str
+    iso_a3: str
+    # (min_lon, min_lat, max_lon, max_lat); all NaN for features without geometry
+    bbox: Tuple[float, float, float, float]
+    # Natural Earth's label point if the map has one, else the bbox centre
+    centroid: Tuple[float, float]
+    aliases: List[str] = field(default_factory=list)
+
+
+def normalize_name(name: str) -> str:
+    """Case-, accent-, punctuation- and whitespace-insensitive form of a name."""
+    decomposed = unicodedata.normalize('NFKD', name)
+    letters = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[.,\'’()-]', ' ', letters).casefold().replace('&', ' and ').split())
+
+
+class GeoIndex:
+    """Countries of the map by admin name, with a resolver for their other names."""
+
+    def __init__(self, countries: List[CountryInfo]):
+        self.countries: Dict[str, CountryInfo] = {country.admin: country for country in countries}
+        # Normalized alias -> admin; aliases shared by several countries are dropped
+        self._aliases: Dict[str, str] = {}
+        ambiguous = set()
+        for country in countries:
+            for alias in country.aliases:
+                key = normalize_name(alias)
+                if self._aliases.setdefault(key, country.admin) != country.admin:
+                    ambiguous.add(key)
+        for key in ambiguous:
+            del self._aliases[key]
+        # An admin name always resolves to its own country
+        for admin in self.countries:
+            self._aliases[normalize_name(admin)] = admin
+
+    def __len__(self) -> int:
+        return len(self.countries)
+
+    def __contains__(self, admin: str) -> bool:
+        return admin in self.countries
+
+    def admin_names(self) -> List[str]:
+        """Canonical country names, in map order."""
+        return list(self.countries)
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Admin name of the country called `name` in any of the map's name fields, or None."""
+        if name in self.countries:
+            return name
+        return self._aliases.get(normalize_name(name))
+
+    def get(self, name: str) -> Optional[CountryInfo]:
+        admin = self.resolve(name)
+        return self.countries[admin] if admin is not None else None
+
+    def region_of(self, name: str) -> Tuple[str, str]:
+        """(region_un, subregion) of a country, or ('Unknown', 'Unknown')."""
+        country = self.get(name)
+        return (country.region, country.subregion) if country is not None else UNKNOWN_REGION
+
+
+def _flatten(coordinates) -> Iterator[float]:
+    if isinstance(coordinates, list):
+        for item in coordinates:
+            yield from _flatten(item)
+    else:
+        yield coordinates
+
+
+def _coordinates(text: str, start: int, end: int) -> np.ndarray:
+    """Flat coordinates (x0, y0, x1, y1, ...) of the geometry whose value starts at `start`.
+
+    `end` bounds the search, so a geometry without its own "coordinates" key
+    doesn't pick up those of the next feature.
+    """
+    if text.startswith('null', start):
+        return np.empty(0)
+    match = _COORDINATES.search(text, start, end)
+    if match is None:
+        # E.g. a GeometryCollection: decode just this geometry and collect its members' coordinates
+        geometry, _ = json.JSONDecoder().raw_decode(text, start)
+        members = geometry.get('geometries') or [] if isinstance(geometry, dict) else []
+        return np.array([value for member in members if isinstance(member, dict)
+                         for value in _flatten(member.get('coordinates') or [])], dtype=np.float64)
+    stop = _NOT_COORDINATE_TEXT.search(text, match.end(), end)
+    raw = text[match.end():stop.start() if stop else end]
+    return np.array(raw.translate(_BRACKETS).split(), dtype=np.float64)
+
+
+def scan_features(text: str) -> Iterator[Tuple[Dict, np.ndarray]]:
+    """(properties, flat coordinates) of each feature of a GeoJSON FeatureCollection."""
+    decoder = json.JSONDecoder()
+    properties = []
+    # Offsets of every "properties" and "geometry" key: a geometry value ends before the next one
+    keys = []
+    position = 0
+    while True:
+        match = _PROPERTIES.search(text, position)
+        if match is None:
+            break
+        keys.append(match.start())
+        value, position = decoder.raw_decode(text, match.end())
+        properties.append(value)
+    geometry_matches = list(_GEOMETRY.finditer(text))
+    if len(geometry_matches) != len(properties):
+        raise ValueError(f"Found {len(properties)} properties but {len(geometry_matches)} geometries")
+    keys = sorted(keys + [match.start() for match in geometry_matches]) + [len(text)]
+    for props, match in zip(properties, geometry_matches):
+        end = keys[bisect.bisect_right(keys, match.start())]
+        yield props or {}, _coordinates(text, match.end(), end)
+
+
+def _country_info(props: Dict, coordinates: np.ndarray) -> CountryInfo:
+    if len(coordinates) >= 2:
+        x, y = coordinates[0::2], coordinates[1::2]
+        bbox = (float(x.min()), float(y.min()), float(x.max()), float(y.max()))
+    else:
+        bbox = (float('nan'),) * 4
+    if props.get('label_x') is not None and props.get('label_y') is not None:
+        centroid = (float(props['label_x']), float(props['label_y']))
+    else:
+        centroid = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+    admin = props['admin']
+    aliases = []
+    for name in ALIAS_PROPERTIES:
+        value = props.get(name)
+        if isinstance(value, str) and value and value != admin and value not in aliases:
+            aliases.append(value)
+    return CountryInfo(
+        admin=admin,
+        name=props.get('name') or admin,
+        region=props.get('region_un') or UNKNOWN_REGION[0],
+        subregion=props.get('subregion') or UNKNOWN_REGION[1],
+        continent=props.get('continent') or '',
+        iso_a3=props.get('iso_a3') or '',
+        bbox=bbox,
+        centroid=centroid,
+        aliases=aliases,
+    )
+
+
+def build_geo_index(geo_path: str = GEO_PATH) -> GeoIndex:
+    """Scan the map file; features without an `admin` property are skipped, like in script 01."""
+    with open_text(geo_path) as f:
+        text = f.read()
+    return GeoIndex([_country_info(props, coordinates) for props, coordinates in scan_features(text)
+                     if 'admin' in props])
+
+
+def _cache_path(geo_path: str) -> str:
+    base = geo_path[:-len('.json')] if geo_path.endswith('.json') else geo_path
+    return base + '.index.json'
+
+
+@resident('geo_path')
+def load_geo_index(geo_path: str = GEO_PATH) -> GeoIndex:
+    """The cached index of the map, rebuilt and saved first if the map file has changed."""
+    cache_path = _cache_path(geo_path)
+    fingerprint = source_fingerprint(geo_path)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('version') == INDEX_VERSION and cached.get('fingerprint') == fingerprint:
+            return GeoIndex([CountryInfo(**{**country, 'bbox': tuple(country['bbox']),
+                                            'centroid': tuple(country['centroid'])})
+                             for country in cached['countries']])
+
+    index = build_geo_index(geo_path)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'fingerprint': fingerprint,
+                   'countries': [asdict(country) for country in index.countries.values()]}, f)
+    os.replace(tmp_path, cache_path)
+    return index
@@ -0,0 +1,278 @@
+"""Geometric covariates of the map's countries: area, centroid, neighbours and isolation.
+
+The polygons of the map are loaded once into flat vertex arrays (all rings
+concatenated, with ring offsets), so areas and centroids are a few
+vectorized shoelace sums. For adjacency and nearest-neighbour distances the
+vertices are placed on the unit sphere: each country gets a bounding box
+there and a KD-tree over its vertices. Only pairs whose boxes come close
+are compared vertex by vertex, instead of testing every pair of polygons.
+
+Two countries are neighbours if they have vertices within
+`ADJACENCY_TOLERANCE_KM` of each other; Natural Earth shares the vertices
+of common borders, so that is the case exactly for land borders. Distances
+are measured between vertices, which slightly overestimates the gap
+between long, sparsely sampled coasts.
+
+The covariates are cached as JSON next to the map and rebuilt when the map
+file changes.
+"""
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from analytics.event_store import source_fingerprint
+from analytics.export_stream import open_text
+from analytics.geo_index import GEO_PATH, GeoIndex, load_geo_index
+from analytics.resident import resident
+
+SPATIAL_VERSION = 1
+EARTH_RADIUS_KM = 6371.0088
+ADJACENCY_TOLERANCE_KM = 1.0
+
+# Columns that `SpatialCovariates.columns_for` adds to per-country tables
+COVARIATE_COLUMNS = ['area_km2', 'n_neighbours', 'is_island', 'nearest_neighbour_km',
+                     'centroid_lon', 'centroid_lat']
+_FLOAT_FIELDS = {'area_km2', 'centroid_lon', 'centroid_lat', 'nearest_neighbour_km'}
+
+
+@dataclass
+class MapGeometry:
+    """Polygon rings of all countries as flat arrays."""
+    countries: List[str]
+    # Vertex i is (lon[i], lat[i]); ring r covers vertices ring_offsets[r]:ring_offsets[r + 1]
+    lon: np.ndarray
+    lat: np.ndarray
+    ring_offsets: np.ndarray
+    ring_country: np.ndarray
+    ring_is_hole: np.ndarray
+
+    @property
+    def vertex_country(self) -> np.ndarray:
+        return np.repeat(self.ring_country, np.diff(self.ring_offsets))
+
+    def unit_vectors(self) -> np.ndarray:
+        """Vertices on the unit sphere, shape (n_vertices, 3)."""
+        lon, lat = np.radians(self.lon), np.radians(self.lat)
+        return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+@dataclass
+class SpatialCovariates:
+    """Geometric covariates per country, in map order."""
+    countries: List[str]
+    area_km2: np.ndarray
+    centroid_lon: np.ndarray
+    centroid_lat: np.ndarray
+    # Smallest vertex-to-vertex distance to another country (about 0 for land neighbours), NaN if alone
+    nearest_neighbour_km: np.ndarray
+    nearest_neighbour: List[str]
+    neighbours: List[List[str]]
+
+    @property
+    def n_neighbours(self) -> np.ndarray:
+        return np.array([len(names) for names in self.neighbours], dtype=np.int64)
+
+    @property
+    def is_island(self) -> np.ndarray:
+        """Countries without a land border."""
+        return self.n_neighbours == 0
+
+    def columns_for(self, names: Sequence[str], geo_index: Optional[GeoIndex] = None) -> Dict[str, np.ndarray]:
+        """`COVARIATE_COLUMNS` aligned with `names`, e.g. a country table's countries.
+
+        Names are resolved through `geo_index`; countries missing from the map
+        get NaN, -1 neighbours and False for is_island.
+        """
+        positions = {admin: position for position, admin in enumerate(self.countries)}
+        rows = np.array([positions.get(geo_index.resolve(name) if geo_index else name, -1) for name in names],
+                        dtype=np.int64)
+        known = rows >= 0
+        columns = {}
+        for column in COVARIATE_COLUMNS:
+            values = getattr(self, column)
+            if values.dtype == bool:
+                columns[column] = np.where(known, values[rows], False)
+            elif np.issubdtype(values.dtype, np.integer):
+                columns[column] = np.where(known, values[rows], -1)
+            else:
+                columns[column] = np.where(known, values[rows], np.nan)
+        return columns
+
+
+def _rings(geometry: Optional[Dict]) -> List[Tuple[List, bool]]:
+    """(ring, is_hole) of a Polygon or MultiPolygon; other geometries have no area."""
+    if not geometry:
+        return []
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    return [(ring, index > 0) for polygon in polygons for index, ring in enumerate(polygon) if ring]
+
+
+def load_map_geometry(geo_path: str = GEO_PATH) -> MapGeometry:
+    """Rings of the features with an `admin` property, in map order."""
+    with open_text(geo_path) as f:
+        features = [feature for feature in json.load(f)['features'] if 'admin' in (feature.get('properties') or {})]
+    rings, ring_country, ring_is_hole = [], [], []
+    for code, feature in enumerate(features):
+        for ring, is_hole in _rings(feature.get('geometry')):
+            rings.append(np.asarray(ring, dtype=np.float64)[:, :2])
+            ring_country.append(code)
+            ring_is_hole.append(is_hole)
+    vertices = np.concatenate(rings) if rings else np.empty((0, 2))
+    return MapGeometry(
+        countries=[feature['properties']['admin'] for feature in features],
+        lon=vertices[:, 0],
+        lat=vertices[:, 1],
+        ring_offsets=np.r_[0, np.cumsum([len(ring) for ring in rings])].astype(np.int64),
+        ring_country=np.asarray(ring_country, dtype=np.int64),
+        ring_is_hole=np.asarray(ring_is_hole, dtype=bool),
+    )
+
+
+def _ring_sums(x: np.ndarray, y: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per ring: twice the signed area, and the first moments sum((x_i + x_j) * cross), same for y."""
+    starts, ends = offsets[:-1], offsets[1:]
+    # Edge i runs from vertex i to i + 1, and the last vertex of a ring closes back to its first
+    following = np.arange(1, len(x) + 1)
+    following[ends - 1] = starts
+    cross = x * y[following] - x[following] * y
+    reduce = lambda values: np.add.reduceat(values, starts) if len(values) else np.zeros(0)
+    return reduce(cross), reduce((x + x[following]) * cross), reduce((y + y[following]) * cross)
+
+
+def _areas_and_centroids(geometry: MapGeometry) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n_countries = len(geometry.countries)
+    # Holes count negatively whatever the winding of the file
+    sign = np.where(geometry.ring_is_hole, -1.0, 1.0)
+
+    # Areas on the sinusoidal projection, which preserves area
+    lat = np.radians(geometry.lat)
+    x = EARTH_RADIUS_KM * np.radians(geometry.lon) * np.cos(lat)
+    y = EARTH_RADIUS_KM * lat
+    cross, _, _ = _ring_sums(x, y, geometry.ring_offsets)
+    area = np.bincount(geometry.ring_country, weights=sign * np.abs(cross) / 2, minlength=n_countries)
+
+    # Centroids in longitude and latitude, each ring weighted by its (signed) planar area
+    cross, moment_x, moment_y = _ring_sums(geometry.lon, geometry.lat, geometry.ring_offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ring_weight = sign * np.abs(cross) / 2
+        ring_x = moment_x / (3 * cross)
+        ring_y = moment_y / (3 * cross)
+        weights = np.bincount(geometry.ring_country, weights=ring_weight, minlength=n_countries)
+        centroid_lon = np.bincount(geometry.ring_country, weights=np.nan_to_num(ring_x) * ring_weight,
+                                   minlength=n_countries) / weights
+        centroid_lat = np.bincount(geometry.ring_country, weights=np.nan_to_num(ring_y) * ring_weight,
+                                   minlength=n_countries) / weights
+    return area, centroid_lon, centroid_lat
+
+
+def _box_gaps(lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Euclidean gap between every pair of axis-aligned boxes, a lower bound on point distances."""
+    gap = np.maximum(0, np.maximum(lower[:, None, :] - upper[None, :, :], lower[None, :, :] - upper[:, None, :]))
+    return np.sqrt((gap ** 2).sum(axis=2))
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * np.arcsin(min(chord / 2, 1.0))
+
+
+def build_spatial_covariates(geo_path: str = GEO_PATH,
+                             tolerance_km: float = ADJACENCY_TOLERANCE_KM) -> SpatialCovariates:
+    """Compute the covariates of every country of the map."""
+    # Only needed on a rebuild, so reading the cache doesn't pay for importing scipy
+    from scipy.spatial import cKDTree
+
+    geometry = load_map_geometry(geo_path)
+    n_countries = len(geometry.countries)
+    area, centroid_lon, centroid_lat = _areas_and_centroids(geometry)
+
+    # Vertices per country on the unit sphere, with their bounding boxes and KD-trees
+    points = geometry.unit_vectors()
+    order = np.argsort(geometry.vertex_country, kind='stable')
+    offsets = np.searchsorted(geometry.vertex_country[order], np.arange(n_countries + 1))
+    country_points = [points[order[offsets[c]:offsets[c + 1]]] for c in range(n_countries)]
+    has_points = np.array([len(p) > 0 for p in country_points])
+    lower = np.array([p.min(axis=0) if len(p) else np.full(3, np.inf) for p in country_points]).reshape(-1, 3)
+    upper = np.array([p.max(axis=0) if len(p) else np.full(3, -np.inf) for p in country_points]).reshape(-1, 3)
+    trees = [cKDTree(p) if len(p) else None for p in country_points]
+
+    gaps = _box_gaps(lower, upper) if n_countries else np.zeros((0, 0))
+    np.fill_diagonal(gaps, np.inf)
+    gaps[~has_points, :] = np.inf
+    gaps[:, ~has_points] = np.inf
+
+    tolerance = 2 * np.sin(tolerance_km / EARTH_RADIUS_KM / 2)
+    nearest = np.full(n_countries, np.inf)
+    nearest_code = np.full(n_countries, -1)
+    adjacent = [set() for _ in range(n_countries)]
+    for a in range(n_countries):
+        # Candidates by increasing lower bound; stop once no box can beat the best distance
+        for b in np.argsort(gaps[a], kind='stable'):
+            bound = max(nearest[a], tolerance)
+            if gaps[a, b] > bound:
+                break
+            # Only a's vertices within reach of b's box can be closer than `bound`
+            candidates = country_points[a]
+            near_box = np.all((candidates >= lower[b] - bound) & (candidates <= upper[b] + bound), axis=1)
+            if not near_box.any():
+                continue
+            distance, _ = trees[b].query(candidates[near_box], distance_upper_bound=bound)
+            closest = distance.min()
+            if closest <= tolerance:
+                adjacent[a].add(b)
+                adjacent[b].add(a)
+            if closest < nearest[a]:
+                nearest[a], nearest_code[a] = closest, b
+
+    countries = geometry.countries
+    return SpatialCovariates(
+        countries=countries,
+        area_km2=area,
+        centroid_lon=centroid_lon,
+        centroid_lat=centroid_lat,
+        nearest_neighbour_km=np.array([_chord_to_km(d) if np.isfinite(d) else np.nan for d in nearest]),
+        nearest_neighbour=[countries[c] if c >= 0 else '' for c in nearest_code],
+        neighbours=[[countries[c] for c in sorted(adjacent[a])] for a in range(n_countries)],
+    )
+
+
+def _cache_path(geo_path: str) -> str:
+    base = geo_path[:-len('.json')] if geo_path.endswith('.json') else geo_path
+    return base + '.spatial.json'
+
+
+@resident('geo_path')
+def load_spatial_covariates(geo_path: str = GEO_PATH) -> SpatialCovariates:
+    """The cached covariates of the map, rebuilt and saved first if the map file has changed."""
+    cache_path = _cache_path(geo_path)
+    fingerprint = source_fingerprint(geo_path)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('version') == SPATIAL_VERSION and cached.get('fingerprint') == fingerprint:
+            return SpatialCovariates(**{
+                name: np.asarray(value, dtype=np.float64) if name in _FLOAT_FIELDS else value
+                for name, value in cached['covariates'].items()
+            })
+
+    covariates = build_spatial_covariates(geo_path)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': SPATIAL_VERSION, 'fingerprint': fingerprint, 'covariates': {
+            name: value.tolist() if isinstance(value, np.ndarray) else value
+            for name, value in vars(covariates).items()
+        }}, f)
+    os.replace(tmp_path, cache_path)
+    return covariates
+
+
+def load_country_covariates(countries: Sequence[str], geo_path: str = GEO_PATH) -> Dict[str, np.ndarray]:
+    """Covariate columns aligned with `countries`, names resolved like in script 05."""
+    return load_spatial_covariates(geo_path).columns_for(countries, load_geo_index(geo_path))
@@ -0,0 +1,132 @@
+"""Merge a fresh Firestore export into the event store incrementally.
+
+Instead of replacing the data and recomputing everything, the new export is
+diffed against the store: events newer than the store's timestamp watermark
+are new by definition, older ones are looked up by document id. Only the
+unseen events are appended as a segment, and the cached aggregates are
+updated from that segment alone.
+"""
+import argparse
+import csv
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from analytics.aggregates import load_aggregates
+from analytics.event_store import DEFAULT_STORE, EventStore, append_segment, ensure_event_store, load_events
+from analytics.export_stream import iter_export
+from analytics.geo_index import GEO_PATH, load_geo_index
+from analytics.online_features import OnlineFeatureState
+from analytics.timestamps import parse_iso_timestamps
+
+_BATCH_SIZE = 100_000
+
+
+@dataclass
+class IngestReport:
+    """What an ingest run added to the store."""
+    segment: str = ''
+    new_events: int = 0
+    known_events: int = 0
+    invalid_country_events: int = 0
+    late_events: int = 0  # new, but not newer than the previous watermark
+    touched_pairs: List[Tuple[str, str]] = field(default_factory=list)  # (deviceId, country)
+
+
+def load_valid_countries(geo_path: str = GEO_PATH) -> Set[str]:
+    """Country names of the current map, as used by script 01."""
+    return set(load_geo_index(geo_path).admin_names())
+
+
+def _batches(export_path: str) -> Iterator[List[Tuple[str, Dict]]]:
+    batch = []
+    for item in iter_export(export_path):
+        batch.append(item)
+        if len(batch) == _BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_new_features(events: EventStore, new_entries: List[Tuple[str, Dict]], features_path: str) -> None:
+    """Write the per-guess feature rows of 10 for `new_entries`, continuing from the stored `events`.
+
+    New guesses are taken in timestamp order; a late arrival gets the features
+    it would have had if it arrived after everything already stored.
+    """
+    state = OnlineFeatureState.from_events(events)
+    timestamps = parse_iso_timestamps([entry['timestamp'] for _, entry in new_entries]) // 1000
+    with open(features_path, 'w', newline='') as f:
+        writer = None
+        for index in np.argsort(timestamps, kind='stable').tolist():
+            _, entry = new_entries[index]
+            row = state.update(entry['deviceId'], entry['country'], int(timestamps[index]),
+                               entry['numberOfClicksNeeded'] == 1)
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+
+
+def ingest_export(export_path: str, store_dir: str = DEFAULT_STORE, geo_path: str = GEO_PATH,
+                  features_path: Optional[str] = None) -> IngestReport:
+    """Append the events of `export_path` that the store does not contain yet.
+
+    With `features_path`, the feature rows of the new guesses are written there as CSV.
+    """
+    ensure_event_store(store_dir=store_dir)
+    valid_countries = load_valid_countries(geo_path)
+    events = load_events(store_dir=store_dir)
+    known_ids = np.sort(np.asarray(events.doc_id))
+    watermark = int(events.timestamp.max()) if len(events) else -1
+
+    report = IngestReport()
+    new_entries = []
+    for batch in _batches(export_path):
+        timestamps = parse_iso_timestamps([entry['timestamp'] for _, entry in batch])
+        # Only events at or before the watermark can already be in the store
+        candidates = timestamps <= watermark
+        is_known = np.zeros(len(batch), dtype=bool)
+        if candidates.any() and len(known_ids):
+            ids = np.array([doc_id for doc_id, _ in batch], dtype='S')[candidates]
+            positions = np.minimum(np.searchsorted(known_ids, ids), len(known_ids) - 1)
+            is_known[candidates] = known_ids[positions] == ids
+
+        for (doc_id, entry), known, late in zip(batch, is_known, candidates):
+            if known:
+                report.known_events += 1
+            elif entry['country'] not in valid_countries:
+                report.invalid_country_events += 1
+            else:
+                new_entries.append((doc_id, entry))
+                report.late_events += int(late)
+
+    if new_entries:
+        report.segment = append_segment(new_entries, store_dir)['name']
+        report.new_events = len(new_entries)
+        report.touched_pairs = sorted({(entry['deviceId'], entry['country']) for _, entry in new_entries})
+        if features_path:
+            write_new_features(events, new_entries, features_path)
+        # Fold the new segment into the cached aggregates right away
+        load_aggregates(store_dir)
+
+    with open(os.path.join(store_dir, 'last_ingest.json'), 'w') as f:
+        json.dump(asdict(report), f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append the new events of an export to the event store.")
+    parser.add_argument('export_path', nargs='?', default='data/full/learning_data.json')
+    parser.add_argument('--features', metavar='CSV', help="also write the feature rows of the new guesses here")
+    args = parser.parse_args()
+    report = ingest_export(args.export_path, features_path=args.features)
+    print(f"New events: {report.new_events} (segment {report.segment or '-'})")
+    print(f"Already stored: {report.known_events}")
+    print(f"Invalid countries: {report.invalid_country_events}")
+    print(f"Late arrivals (older than the previous watermark): {report.late_events}")
+    print(f"Touched (deviceId, country) pairs: {len(report.touched_pairs)}")
@@ -0,0 +1,240 @@
+"""Wall time, CPU time, peak memory and row counts per named stage of a run.
+
+Scripts start a report with `start_report()` and wrap their steps in
+`stage()`. Library code marks its own steps the same way, and they are
+recorded nested under the enclosing stage (``features/day_boundaries``).
+Without a report, `stage()` yields a record that nobody keeps, so marking
+steps costs nothing when nobody measures.
+
+    with stage('load') as record:
+        events = load_events()
+        record.rows = len(events)
+
+On Linux the peak RSS is that of the stage alone: the kernel's high-water
+mark (VmHWM) is reset through /proc/self/clear_refs when a stage starts.
+Elsewhere it is the peak of the process so far. CPU time includes worker
+processes that finished within the stage.
+
+The report is written as JSON when the process exits. With PIPELINE_REPORT
+set to a path, every script that imports this module (directly or through
+`analytics.event_store`) starts a report on its own; PIPELINE_PROFILE set to
+a directory also saves a cProfile of each top-level stage there.
+"""
+import argparse
+import atexit
+import cProfile
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+REPORT_ENV = 'PIPELINE_REPORT'
+PROFILE_ENV = 'PIPELINE_PROFILE'
+REPORT_VERSION = 1
+
+
+@dataclass
+class StageRecord:
+    """Measurements of one stage; `name` is the path of nested stage names."""
+    name: str
+    depth: int = 0
+    rows: Optional[int] = None
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_rss_mb: float = 0.0
+    rss_mb: float = 0.0  # at the end of the stage
+    profile: Optional[str] = None
+
+
+def _status_kb(field: str) -> Optional[int]:
+    """A memory field of /proc/self/status in kB, None where there is none."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _max_rss_kb() -> int:
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's RSS high-water mark of this process; whether that worked."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _cpu_seconds() -> float:
+    """CPU time of this process and of its children that have been waited for."""
+    seconds = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        seconds += usage.ru_utime + usage.ru_stime
+    return seconds
+
+
+class RunReport:
+    """Stage records of one run of a script, in the order the stages started."""
+
+    def __init__(self, name: str, path: Optional[str] = None, profile_dir: Optional[str] = None,
+                 log: bool = False):
+        self.name = name
+        self.path = path
+        self.profile_dir = profile_dir
+        self.log = log
+        self.pid = os.getpid()
+        self.stages: List[StageRecord] = []
+        self.started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self._start_wall = time.perf_counter()
+        self._start_cpu = _cpu_seconds()
+        self._per_stage_peak = _status_kb('VmHWM') is not None and _reset_peak_rss()
+        # Open stages, innermost last, with the highest RSS (kB) seen while each was open
+        self._open: List[List] = []
+
+    def _peak_kb(self) -> int:
+        return (_status_kb('VmHWM') if self._per_stage_peak else None) or _max_rss_kb()
+
+    def _fold_peak(self) -> None:
+        """Record the current high-water mark in every open stage, before it is reset or read."""
+        peak = self._peak_kb()
+        for entry in self._open:
+            entry[1] = max(entry[1], peak)
+
+    @contextmanager
+    def stage(self, name: str, rows: Optional[int] = None) -> Iterator[StageRecord]:
+        self._fold_peak()
+        if self._per_stage_peak:
+            _reset_peak_rss()
+        parent = self._open[-1][0].name + '/' if self._open else ''
+        record = StageRecord(parent + name, depth=len(self._open), rows=rows)
+        number = len(self.stages) + 1
+        self.stages.append(record)
+        entry = [record, 0]
+        self._open.append(entry)
+
+        # Only top-level stages are profiled, as profilers can't be nested
+        profiler = cProfile.Profile() if self.profile_dir and record.depth == 0 else None
+        start_wall, start_cpu = time.perf_counter(), _cpu_seconds()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record.wall_s = round(time.perf_counter() - start_wall, 4)
+            record.cpu_s = round(_cpu_seconds() - start_cpu, 4)
+            self._fold_peak()
+            self._open.pop()
+            record.peak_rss_mb = round(entry[1] / 1024, 1)
+            record.rss_mb = round((_status_kb('VmRSS') or 0) / 1024, 1)
+            if profiler is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                file_name = re.sub(r'[^\w.-]+', '_', name)
+                record.profile = os.path.join(self.profile_dir, f'{number:02d}-{file_name}.prof')
+                profiler.dump_stats(record.profile)
+            if self.log:
+                print(f"{'  ' * record.depth}{name}: {record.wall_s:.2f}s wall, {record.cpu_s:.2f}s CPU, "
+                      f"{record.peak_rss_mb:.0f} MB peak" + (f", {record.rows:,} rows" if record.rows is not None else ''),
+                      file=sys.stderr)
+
+    def as_dict(self) -> Dict:
+        return {
+            'version': REPORT_VERSION,
+            'script': self.name,
+            'argv': sys.argv,
+            'started': self.started,
+            'wall_s': round(time.perf_counter() - self._start_wall, 4),
+            'cpu_s': round(_cpu_seconds() - self._start_cpu, 4),
+            'peak_rss_mb': round(_max_rss_kb() / 1024, 1),
+            'peak_rss_scope': 'stage' if self._per_stage_peak else 'process',
+            'stages': [asdict(record) for record in self.stages],
+        }
+
+    def write(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+_active: Optional[RunReport] = None
+
+
+def active_report() -> Optional[RunReport]:
+    """The report of this process, if one was started (forked workers don't inherit it)."""
+    if _active is not None and _active.pid == os.getpid():
+        return _active
+    return None
+
+
+@contextmanager
+def stage(name: str, rows: Optional[int] = None) -> Iterator[StageRecord]:
+    """Measure the enclosed block as a stage of the active report, if there is one."""
+    report = active_report()
+    if report is None:
+        yield StageRecord(name, rows=rows)
+        return
+    with report.stage(name, rows) as record:
+        yield record
+
+
+def finish_report() -> None:
+    """Write the active report, if it has a path, and stop recording; also done at exit."""
+    global _active
+    report = active_report()
+    if report is not None and report.path:
+        report.write()
+    _active = None
+
+
+def start_report(name: Optional[str] = None, path: Optional[str] = None, profile_dir: Optional[str] = None,
+                 log: bool = False) -> RunReport:
+    """Start recording stages, or configure the report already started from PIPELINE_REPORT.
+
+    The report is written to `path` (default: $PIPELINE_REPORT) when the
+    process exits; without either, it is only kept in memory. With `log`,
+    every finished stage is summarized on stderr.
+    """
+    global _active
+    report = active_report()
+    if report is None:
+        report = _active = RunReport(os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0])
+        atexit.unregister(finish_report)
+        atexit.register(finish_report)
+    report.name = name or report.name
+    report.path = path or report.path or os.environ.get(REPORT_ENV)
+    report.profile_dir = profile_dir or report.profile_dir or os.environ.get(PROFILE_ENV)
+    report.log = report.log or log
+    return report
+
+
+def add_report_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--report', metavar='PATH',
+                        help="write wall time, CPU time, peak RSS and rows of every stage to this JSON file")
+    parser.add_argument('--profile', metavar='DIR', help="also save a cProfile of every stage to this directory")
+
+
+# Scripts run with PIPELINE_REPORT set are measured without changes to them; worker processes
+# started by them see the variable too, but must not overwrite their report
+if os.environ.get(REPORT_ENV) and multiprocessing.parent_process() is None:
+    start_report()
@@ -0,0 +1,96 @@
+"""Interned string columns: dense integer codes plus a reverse lookup table.
+
+Device ids become int32 codes and country names uint16 codes (the event
+store keeps them that way on disk). Grouping and sorting run on the codes
+or on a packed int64 key; strings are only looked up again for output.
+
+Output files are sorted by joined keys such as ``f"{device}_{country}"``.
+`Interner.collation_ranks` gives each code its position in the string order
+of ``value + separator``, so sorting codes by (device rank, country rank, ...)
+reproduces the order of the joined strings as long as the separator does
+not occur inside the values.
+"""
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+class Interner:
+    """Dense codes 0, 1, 2, ... for strings in first-seen order."""
+
+    def __init__(self, values: Iterable[str] = (), dtype: type = np.int32):
+        self.dtype = dtype
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._ranks: Dict[str, np.ndarray] = {}
+        for value in values:
+            self.code(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value: str) -> int:
+        """Code of `value`, assigning the next one if it is new."""
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+            if code > np.iinfo(self.dtype).max:
+                raise OverflowError(f"More than {np.iinfo(self.dtype).max + 1} distinct values for {self.dtype.__name__}")
+        return code
+
+    def encode(self, values: Iterable[str]) -> np.ndarray:
+        """Codes of a column of strings."""
+        return np.fromiter((self.code(value) for value in values), dtype=self.dtype)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Strings of a column of codes, as an object array."""
+        return self.lookup_table()[codes]
+
+    def lookup_table(self) -> np.ndarray:
+        """Object array with the string of each code."""
+        return np.asarray(self.values, dtype=object)
+
+    def collation_ranks(self, separator: str = '') -> np.ndarray:
+        """Rank of each code in the sorted order of `value + separator`."""
+        ranks = self._ranks.get(separator)
+        if ranks is None or len(ranks) != len(self.values):
+            order = np.argsort(np.asarray([value + separator for value in self.values], dtype=str), kind='stable')
+            ranks = np.empty(len(self.values), dtype=np.int64)
+            ranks[order] = np.arange(len(self.values))
+            self._ranks[separator] = ranks
+        return ranks
+
+
+def decimal_string_ranks(values: np.ndarray) -> np.ndarray:
+    """Dense rank of each integer in the string order of its decimal representation."""
+    unique = np.unique(values)
+    if len(unique) and len(str(unique[0])) == len(str(unique[-1])) and unique[0] >= 0:
+        # Same number of digits: string order is numeric order
+        return np.searchsorted(unique, values)
+    as_strings = np.argsort(unique.astype(str), kind='stable')
+    ranks = np.empty(len(unique), dtype=np.int64)
+    ranks[as_strings] = np.arange(len(unique))
+    return ranks[np.searchsorted(unique, values)]
+
+
+def packed_key(*columns: np.ndarray) -> np.ndarray:
+    """Pack non-negative integer columns into one int64 key, first column most significant.
+
+    Raises OverflowError if the columns need more than 63 bits together.
+    """
+    widths = [max(int(values.max()).bit_length(), 1) if len(values) else 1 for values in columns]
+    if sum(widths) > 63:
+        raise OverflowError(f"Key needs {sum(widths)} bits, more than fit into int64")
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    for values, width in zip(columns, widths):
+        key = (key << width) | np.asarray(values, dtype=np.int64)
+    return key
+
+
+def key_order(*columns: np.ndarray) -> np.ndarray:
+    """Stable order of rows by several non-negative integer columns, via a packed key when it fits."""
+    try:
+        return np.argsort(packed_key(*columns), kind='stable')
+    except OverflowError:
+        return np.lexsort(columns[::-1])
@@ -0,0 +1,162 @@
+"""Streaming per-guess features: the columns of 10 for one new guess at a time.
+
+`OnlineFeatureState` keeps a few counters per (device, country) pair, per
+device and per country, and turns each incoming guess into its feature row
+in O(1). Fed the guesses of a store in timestamp order, the prefix columns
+(totals, previous timestamps, time deltas, correct percentage, first guess of
+the day) equal those of 10_make_alt_predictor_csv.py.
+
+Two kinds of columns in 10 look at the whole history rather than the past:
+`current_streak` counts correct guesses from a guess to the pair's last
+guess, and the success rates are over all users. A row emitted online has the
+values 10 would give if that guess were the latest one: the streak is 1 for a
+correct guess and 0 otherwise, and the rates are those of the guesses seen
+so far. `PairState.streak` keeps the run of correct guesses ending at the
+latest guess, as in 09.
+"""
+import math
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from analytics.event_store import EventStore
+from analytics.rank_rates import DEFAULT_RANKS, attempt_numbers, attempt_rank_counts, ordinal
+from analytics.segment_ops import segment_starts
+from analytics.timestamps import day_of
+
+
+class PairState:
+    """Counters of one (device, country) pair."""
+    __slots__ = ('attempts', 'correct', 'streak', 'last_timestamp')
+
+    def __init__(self, attempts: int = 0, correct: int = 0, streak: int = 0, last_timestamp: Optional[int] = None):
+        self.attempts = attempts
+        self.correct = correct
+        self.streak = streak
+        self.last_timestamp = last_timestamp
+
+
+class DeviceState:
+    """Counters of one device."""
+    __slots__ = ('guesses', 'last_timestamp')
+
+    def __init__(self, guesses: int = 0, last_timestamp: Optional[int] = None):
+        self.guesses = guesses
+        self.last_timestamp = last_timestamp
+
+
+class OnlineFeatureState:
+    """Feature state over all guesses seen so far, updated one guess at a time.
+
+    Timestamps are in seconds, as in 10's CSVs.
+    """
+
+    def __init__(self, ranks: Sequence[int] = DEFAULT_RANKS, day_timezone: str = 'local'):
+        self.ranks = tuple(ranks)
+        self.day_timezone = day_timezone
+        self.pairs: Dict[Tuple[str, str], PairState] = {}
+        self.devices: Dict[str, DeviceState] = {}
+        # country -> [correct, attempts] for each rank, in `ranks` order
+        self.rank_counts: Dict[str, list] = {}
+        self.last_day: Optional[int] = None
+
+    def update(self, device_id: str, country: str, timestamp: int, is_correct: bool) -> Dict:
+        """Record one guess and return its feature row, keyed like 10's columns."""
+        pair = self.pairs.get((device_id, country))
+        if pair is None:
+            pair = self.pairs[(device_id, country)] = PairState()
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.devices[device_id] = DeviceState()
+
+        previous_guess = pair.last_timestamp
+        previous_user_guess = device.last_timestamp
+        pair.attempts += 1
+        pair.correct += int(is_correct)
+        pair.streak = pair.streak + 1 if is_correct else 0
+        pair.last_timestamp = timestamp
+        device.guesses += 1
+        device.last_timestamp = timestamp
+
+        counts = self.rank_counts.get(country)
+        if counts is None:
+            counts = self.rank_counts[country] = [[0, 0] for _ in self.ranks]
+        if pair.attempts in self.ranks:
+            rank_count = counts[self.ranks.index(pair.attempts)]
+            rank_count[0] += int(is_correct)
+            rank_count[1] += 1
+
+        day = day_of(timestamp * 1000, self.day_timezone)
+        is_first_guess_of_day = day != self.last_day
+        self.last_day = day
+
+        # Correct guesses including this one over the previous attempts, as in 10
+        if pair.attempts > 1:
+            correct_guess_percentage = pair.correct / (pair.attempts - 1)
+        else:
+            correct_guess_percentage = math.inf if pair.correct else -1
+
+        row = {
+            'deviceId': device_id,
+            'country': country,
+            'current_guess_timestamp': timestamp,
+            'total_guesses': pair.attempts,
+            'user_total_guesses': device.guesses,
+            'previous_guess_timestamp': math.nan if previous_guess is None else float(previous_guess),
+            'current_streak': int(is_correct),
+            'correct_guess_percentage': correct_guess_percentage,
+            'time_since_last_country_guess': float(timestamp - (timestamp if previous_guess is None else previous_guess)),
+            'time_since_last_user_guess': float(timestamp - (timestamp if previous_user_guess is None else previous_user_guess)),
+            'countries_attempted_since_last': 0.0,
+            'is_first_guess_of_day': is_first_guess_of_day,
+            'is_correct': bool(is_correct),
+            'deviceId_country_timestamp': f"{device_id}_{country}_{timestamp}",
+        }
+        for rank, (correct, attempts) in zip(self.ranks, counts):
+            row[f'{ordinal(rank)}_guess_success_rate'] = correct / attempts if attempts else 0.0
+            row[f'{ordinal(rank)}_guess_sample_size'] = attempts
+        return row
+
+    @classmethod
+    def from_events(cls, events: EventStore, ranks: Sequence[int] = DEFAULT_RANKS,
+                    day_timezone: str = 'local') -> 'OnlineFeatureState':
+        """State after all guesses of `events`, built with array passes instead of replaying them."""
+        state = cls(ranks, day_timezone)
+        if len(events) == 0:
+            return state
+        device = np.asarray(events.device)
+        country = np.asarray(events.country)
+        timestamp = events.timestamp // 1000
+        is_correct = events.is_correct
+
+        # Pairs: attempts, correct guesses, trailing streak and last guess
+        order, numbers = attempt_numbers(device, country, timestamp)
+        pair_correct = is_correct[order]
+        starts = np.flatnonzero(segment_starts(device[order], country[order]))
+        ends = np.r_[starts[1:], len(order)]
+        last_wrong = np.maximum.reduceat(np.where(pair_correct, -1, np.arange(len(order))), starts)
+        streaks = ends - np.maximum(last_wrong + 1, starts)
+        corrects = np.add.reduceat(pair_correct.astype(np.int64), starts)
+        last = order[ends - 1]
+        for device_code, country_code, attempts, correct, streak, last_timestamp in zip(
+                device[last].tolist(), country[last].tolist(), (ends - starts).tolist(), corrects.tolist(),
+                streaks.tolist(), timestamp[last].tolist()):
+            key = (events.devices[device_code], events.countries[country_code])
+            state.pairs[key] = PairState(attempts, correct, streak, last_timestamp)
+
+        # Devices: guess count and last guess
+        guesses = np.bincount(device, minlength=len(events.devices))
+        last_timestamps = np.full(len(events.devices), np.iinfo(np.int64).min)
+        np.maximum.at(last_timestamps, device, timestamp)
+        for code in np.flatnonzero(guesses).tolist():
+            state.devices[events.devices[code]] = DeviceState(int(guesses[code]), int(last_timestamps[code]))
+
+        # Countries: attempts and correct attempts by rank
+        counts = attempt_rank_counts(country[order], numbers, is_correct[order], len(events.countries), state.ranks)
+        for code in np.unique(country).tolist():
+            state.rank_counts[events.countries[code]] = [
+                [int(counts[rank][0][code]), int(counts[rank][1][code])] for rank in state.ranks
+            ]
+
+        state.last_day = day_of(int(events.timestamp.max()) // 1000 * 1000, day_timezone)
+        return state
@@ -0,0 +1,272 @@
+"""Out-of-core build of 10's per-guess features, one device partition at a time.
+
+The events are read from the store in chunks and spilled to disk, split
+into partitions of whole devices. The partitions are contiguous ranges of
+the devices' collation ranks rather than hash buckets, so they follow each
+other in the output's compound-key order and can be written as they finish.
+Every partition holds about `partition_rows` rows; a single device larger
+than that gets a partition of its own.
+
+Two features aren't device-local. The per-country success rates come from
+attempt counts by rank, summed over all partitions in a first pass. The
+first guess of each day is the earliest (timestamp, row) of its day, kept
+per day while reading the store. Both are a few arrays per country or per
+day. The second pass computes the device features of one partition at a time
+and adds these two, so peak memory follows the largest partition instead
+of the whole table. The results are the same as 10's in-memory build, as
+long as calendar days follow the timestamps in order, which only a time zone
+setting its clocks back across midnight would break.
+
+`PermutedCsvWriter` writes rows that arrive in table order to a CSV in
+shuffled order (10's train and validation files), through bucket files on
+disk, so the table never has to be in memory at once either.
+"""
+import os
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analytics.alt_features import device_features
+from analytics.event_store import COLUMNS, DEFAULT_STORE, load_segment, read_meta
+from analytics.instrumentation import stage
+from analytics.rank_rates import (
+    DEFAULT_RANKS, attempt_numbers, attempt_rank_counts, ordinal, success_rates_from_counts,
+)
+from analytics.timestamps import day_buckets
+
+DEFAULT_PARTITION_ROWS = 500_000
+# Rows read from the store at a time
+READ_CHUNK_ROWS = 1_000_000
+
+# Spilled column -> dtype; 'row' is the event's position in the store
+SPILL_COLUMNS = {
+    'row': np.int64,
+    'device': COLUMNS['device'],
+    'country': COLUMNS['country'],
+    'timestamp': np.int64,  # seconds
+    'is_correct': np.bool_,
+}
+
+Partition = Dict[str, np.ndarray]
+
+
+def iter_store_chunks(store_dir: str = DEFAULT_STORE, chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[Partition]:
+    """The store's events in order, `chunk_rows` at a time, as SPILL_COLUMNS arrays.
+
+    Every chunk maps the segment files afresh, so pages read before are
+    released instead of adding up to the whole store.
+    """
+    offset = 0
+    for segment in read_meta(store_dir)['segments']:
+        for start in range(0, segment['n_events'], chunk_rows):
+            events = load_segment(segment['name'], store_dir)
+            stop = min(start + chunk_rows, segment['n_events'])
+            yield {
+                'row': np.arange(offset + start, offset + stop, dtype=np.int64),
+                'device': np.array(events.device[start:stop]),
+                'country': np.array(events.country[start:stop]),
+                'timestamp': events.timestamp[start:stop] // 1000,
+                'is_correct': events.clicks[start:stop] == 1,
+            }
+            del events
+        offset += segment['n_events']
+
+
+def plan_partitions(device_rows: np.ndarray, device_ranks: np.ndarray, partition_rows: int) -> np.ndarray:
+    """Partition number of each device code: ranges of collation ranks with about `partition_rows` rows each."""
+    by_rank = np.argsort(device_ranks)
+    rows_before = np.cumsum(device_rows[by_rank]) - device_rows[by_rank]
+    # Devices are numbered by the block their first row falls in, then renumbered without gaps
+    _, partition_by_rank = np.unique(rows_before // max(partition_rows, 1), return_inverse=True)
+    partition = np.empty(len(device_rows), dtype=np.int64)
+    partition[by_rank] = partition_by_rank.reshape(-1)
+    return partition
+
+
+class SpilledPartitions:
+    """Events spilled to `work_dir`, one set of column files per device partition.
+
+    Rows are appended in store order, so each partition keeps it.
+    """
+
+    def __init__(self, work_dir: str, device_partition: np.ndarray):
+        self.work_dir = work_dir
+        self.device_partition = device_partition
+        self.n_partitions = int(device_partition.max()) + 1 if len(device_partition) else 0
+        self.rows = np.zeros(self.n_partitions, dtype=np.int64)
+
+    def _path(self, partition: int, column: str) -> str:
+        return os.path.join(self.work_dir, f'part-{partition:05d}.{column}')
+
+    def append(self, chunk: Partition) -> None:
+        partition = self.device_partition[chunk['device']]
+        order = np.argsort(partition, kind='stable')
+        bounds = np.searchsorted(partition[order], np.arange(self.n_partitions + 1))
+        for index in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[index]:bounds[index + 1]]
+            for column, dtype in SPILL_COLUMNS.items():
+                with open(self._path(index, column), 'ab') as f:
+                    chunk[column][rows].astype(dtype, copy=False).tofile(f)
+            self.rows[index] += len(rows)
+
+    def read(self, partition: int) -> Partition:
+        return {
+            column: np.fromfile(self._path(partition, column), dtype=dtype) if self.rows[partition]
+            else np.zeros(0, dtype=dtype)
+            for column, dtype in SPILL_COLUMNS.items()
+        }
+
+    def remove(self, partition: int) -> None:
+        for column in SPILL_COLUMNS:
+            if os.path.exists(self._path(partition, column)):
+                os.remove(self._path(partition, column))
+
+
+def first_of_days(timestamp: np.ndarray, row: np.ndarray, day_timezone: str) -> np.ndarray:
+    """Positions of each day's earliest guess in the given arrays, earliest by (timestamp, row)."""
+    days = day_buckets(np.asarray(timestamp, dtype=np.int64) * 1000, tz=day_timezone)
+    order = np.lexsort((row, timestamp, days))
+    first = np.r_[True, days[order][1:] != days[order][:-1]] if len(order) else np.zeros(0, dtype=bool)
+    return order[first]
+
+
+def spill_events(work_dir: str, device_ranks: np.ndarray, partition_rows: int, day_timezone: str,
+                 store_dir: str = DEFAULT_STORE) -> Tuple[SpilledPartitions, np.ndarray]:
+    """Spill the store into device partitions; also the sorted rows that are the first guess of their day."""
+    with stage('count_device_rows') as record:
+        device_rows = np.zeros(len(device_ranks), dtype=np.int64)
+        for chunk in iter_store_chunks(store_dir):
+            device_rows += np.bincount(chunk['device'], minlength=len(device_ranks))
+        record.rows = int(device_rows.sum())
+    spilled = SpilledPartitions(work_dir, plan_partitions(device_rows, device_ranks, partition_rows))
+
+    with stage('spill_partitions', rows=int(device_rows.sum())):
+        first_timestamps: List[np.ndarray] = [np.zeros(0, dtype=np.int64)]
+        first_rows: List[np.ndarray] = [np.zeros(0, dtype=np.int64)]
+        for chunk in iter_store_chunks(store_dir):
+            spilled.append(chunk)
+            first = first_of_days(chunk['timestamp'], chunk['row'], day_timezone)
+            first_timestamps.append(chunk['timestamp'][first])
+            first_rows.append(chunk['row'][first])
+    # The earliest of the chunks' first guesses of each day
+    timestamps, rows = np.concatenate(first_timestamps), np.concatenate(first_rows)
+    return spilled, np.sort(rows[first_of_days(timestamps, rows, day_timezone)])
+
+
+def timestamp_order(partition: Partition) -> Partition:
+    """The partition's rows sorted by timestamp, ties in store order, as 10 processes them."""
+    order = np.argsort(partition['timestamp'], kind='stable')
+    return {column: values[order] for column, values in partition.items()}
+
+
+def partition_rank_counts(spilled: SpilledPartitions, n_countries: int, ranks: Sequence[int] = DEFAULT_RANKS
+                          ) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Correct and all attempts per country and attempt rank, summed over the partitions."""
+    counts = {rank: (np.zeros(n_countries), np.zeros(n_countries, dtype=np.int64)) for rank in ranks}
+    with stage('partition_rank_counts', rows=int(spilled.rows.sum())):
+        for index in range(spilled.n_partitions):
+            partition = spilled.read(index)
+            # Ties in timestamp keep store order, as in the stable timestamp sort
+            order, numbers = attempt_numbers(partition['device'], partition['country'], partition['timestamp'])
+            partition_counts = attempt_rank_counts(partition['country'][order], numbers,
+                                                   partition['is_correct'][order], n_countries, ranks)
+            for rank, (correct, sample_sizes) in partition_counts.items():
+                counts[rank][0][:] += correct
+                counts[rank][1][:] += sample_sizes
+    return counts
+
+
+def iter_partition_features(work_dir: str, device_ranks: np.ndarray, n_countries: int,
+                            day_timezone: str = 'local', partition_rows: int = DEFAULT_PARTITION_ROWS,
+                            ranks: Sequence[int] = DEFAULT_RANKS, store_dir: str = DEFAULT_STORE
+                            ) -> Iterator[Tuple[Partition, Dict[str, np.ndarray]]]:
+    """Each partition's events in timestamp order with their features, in device collation order.
+
+    The features are keyed like `compute_alt_features`' and equal its values
+    for these rows; `work_dir` holds the spilled partitions, each removed once
+    it has been yielded.
+    """
+    spilled, first_of_day = spill_events(work_dir, device_ranks, partition_rows, day_timezone, store_dir)
+    rates = success_rates_from_counts(partition_rank_counts(spilled, n_countries, ranks))
+    for index in range(spilled.n_partitions):
+        with stage(f'partition {index:05d}', rows=int(spilled.rows[index])):
+            partition = timestamp_order(spilled.read(index))
+            features, _ = device_features(partition['device'], partition['country'], partition['timestamp'],
+                                          partition['is_correct'], n_countries, ranks)
+            position = np.searchsorted(first_of_day, partition['row'])
+            features['is_first_guess_of_day'] = (
+                first_of_day[np.minimum(position, len(first_of_day) - 1)] == partition['row']
+                if len(first_of_day) else np.zeros(len(position), dtype=bool)
+            )
+            for rank, (country_rates, sample_sizes) in rates.items():
+                features[f'{ordinal(rank)}_guess_success_rate'] = country_rates[partition['country']]
+                features[f'{ordinal(rank)}_guess_sample_size'] = sample_sizes[partition['country']]
+        spilled.remove(index)
+        yield partition, features
+        # Released before the next partition is read
+        del partition, features
+
+
+class PermutedCsvWriter:
+    """Writes the rows `rows` of a table to a CSV in that order, while the table arrives in row order.
+
+    Each batch's rows go to bucket files by their position in `rows`, as CSV
+    text plus positions; `close` sorts one bucket at a time into the output,
+    so the bytes of one bucket of `bucket_rows` rows are the most it holds
+    in memory. Every row has to be a single line of CSV.
+    """
+
+    def __init__(self, path: str, rows: np.ndarray, n_rows: int, work_dir: str,
+                 bucket_rows: int = DEFAULT_PARTITION_ROWS):
+        self.path = path
+        self.work_dir = work_dir
+        self.bucket_rows = bucket_rows
+        self.n_buckets = max(-(-len(rows) // bucket_rows), 1)
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.header = None
+        # Position of every table row in the output, -1 for rows not written; on disk, as it's per row
+        self.position = np.lib.format.open_memmap(os.path.join(work_dir, f'{self.name}.position.npy'), mode='w+',
+                                                  dtype=np.int64, shape=(n_rows,))
+        self.position[:] = -1
+        for start in range(0, len(rows), READ_CHUNK_ROWS):
+            self.position[rows[start:start + READ_CHUNK_ROWS]] = np.arange(start, min(start + READ_CHUNK_ROWS,
+                                                                                      len(rows)))
+
+    def _bucket_path(self, bucket: int, extension: str) -> str:
+        return os.path.join(self.work_dir, f'{self.name}.{bucket:05d}.{extension}')
+
+    def append(self, df: pd.DataFrame, start: int) -> None:
+        """Add the table rows `start`, `start + 1`, ... given as `df`."""
+        if self.header is None:
+            self.header = df.iloc[:0].to_csv(index=False)
+        positions = np.asarray(self.position[start:start + len(df)])
+        selected = np.flatnonzero(positions >= 0)
+        buckets = positions[selected] // self.bucket_rows
+        order = np.argsort(buckets, kind='stable')
+        bounds = np.searchsorted(buckets[order], np.arange(self.n_buckets + 1))
+        for bucket in np.flatnonzero(np.diff(bounds)):
+            rows = selected[order[bounds[bucket]:bounds[bucket + 1]]]
+            with open(self._bucket_path(bucket, 'csv'), 'a', newline='', encoding='utf-8') as f:
+                df.iloc[rows].to_csv(f, index=False, header=False)
+            with open(self._bucket_path(bucket, 'position'), 'ab') as f:
+                positions[rows].tofile(f)
+
+    def close(self) -> None:
+        """Write the CSV from the buckets, then remove them."""
+        with open(self.path, 'wb') as out:
+            out.write((self.header or '').encode('utf-8'))
+            for bucket in range(self.n_buckets):
+                if not os.path.exists(self._bucket_path(bucket, 'csv')):
+                    continue
+                text = np.fromfile(self._bucket_path(bucket, 'csv'), dtype=np.uint8)
+                ends = np.flatnonzero(text == ord('\n')) + 1
+                starts = np.r_[0, ends[:-1]]
+                positions = np.fromfile(self._bucket_path(bucket, 'position'), dtype=np.int64)
+                lines = memoryview(text)
+                for index in np.argsort(positions):
+                    out.write(lines[starts[index]:ends[index]])
+                os.remove(self._bucket_path(bucket, 'csv'))
+                os.remove(self._bucket_path(bucket, 'position'))
+        del self.position
+        os.remove(os.path.join(self.work_dir, f'{self.name}.position.npy'))
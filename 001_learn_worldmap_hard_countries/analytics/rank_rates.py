@@ -0,0 +1,74 @@
+"""Global success rates per country and attempt rank.
+
+"Third guess success rate" of a country is the share of users whose third
+attempt at that country was correct, among users with at least three
+attempts. The rates depend only on the country, so they are computed once
+for all countries and ranks instead of per (device, country) row.
+"""
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_RANKS = (1, 3, 5)
+
+_ORDINALS = {1: 'first', 2: 'second', 3: 'third', 4: 'fourth', 5: 'fifth',
+             6: 'sixth', 7: 'seventh', 8: 'eighth', 9: 'ninth', 10: 'tenth'}
+
+
+def ordinal(rank: int) -> str:
+    """Column prefix for an attempt rank, e.g. 'third' for 3."""
+    return _ORDINALS.get(rank, f'{rank}th')
+
+
+def attempt_numbers(device: np.ndarray, country: np.ndarray, sequence: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Order of the events by pair and, in that order, each event's attempt number for its pair.
+
+    Returns `(order, numbers)`: `order` sorts the events by (device, country,
+    sequence), keeping export order for equal `sequence` values, and
+    `numbers[k]` is 1 for the first attempt of a (device, country) pair, 2 for
+    the second, ... `sequence` is usually the timestamp, or the export
+    position to number attempts in export order.
+    """
+    order = np.lexsort((sequence, country, device))
+    sorted_device = device[order]
+    sorted_country = country[order]
+    new_pair = np.ones(len(order), dtype=bool)
+    new_pair[1:] = (sorted_device[1:] != sorted_device[:-1]) | (sorted_country[1:] != sorted_country[:-1])
+    pair_start = np.maximum.accumulate(np.where(new_pair, np.arange(len(order)), 0))
+    return order, np.arange(len(order)) - pair_start + 1
+
+
+def attempt_rank_counts(country: np.ndarray, attempt_number: np.ndarray, is_correct: np.ndarray,
+                        n_countries: int, ranks: Sequence[int] = DEFAULT_RANKS
+                        ) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Correct attempts and all attempts per country code for each attempt rank.
+
+    Counts from disjoint sets of users can be summed before computing rates.
+    """
+    counts = {}
+    for rank in ranks:
+        at_rank = attempt_number == rank
+        sample_sizes = np.bincount(country[at_rank], minlength=n_countries)
+        correct = np.bincount(country[at_rank], weights=is_correct[at_rank], minlength=n_countries)
+        counts[rank] = (correct, sample_sizes)
+    return counts
+
+
+def success_rates_from_counts(counts: Dict[int, Tuple[np.ndarray, np.ndarray]]
+                              ) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Turn `attempt_rank_counts` output into (rates, sample sizes); the rate is 0 without attempts."""
+    stats = {}
+    for rank, (correct, sample_sizes) in counts.items():
+        rates = np.divide(correct, sample_sizes, out=np.zeros(len(sample_sizes)), where=sample_sizes > 0)
+        stats[rank] = (rates, sample_sizes)
+    return stats
+
+
+def attempt_rank_success_rates(country: np.ndarray, attempt_number: np.ndarray, is_correct: np.ndarray,
+                               n_countries: int, ranks: Sequence[int] = DEFAULT_RANKS
+                               ) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """Success rate and sample size per country code for each attempt rank.
+
+    The rate is 0 where a country has no attempt of that rank.
+    """
+    return success_rates_from_counts(attempt_rank_counts(country, attempt_number, is_correct, n_countries, ranks))
@@ -0,0 +1,101 @@
+"""Confidence intervals for per-country rates, for all countries at once.
+
+The reports rank countries by a share of guesses (wrong, right, wrong on
+first see). With a few dozen attempts such a share is noisy, so the
+reports can show an interval and rank by its lower bound instead, which
+keeps small-sample countries from jumping to the top by chance.
+
+Every function takes arrays of successes and totals, one entry per country,
+and returns arrays of lower and upper bounds, NaN where the total is 0.
+"""
+import argparse
+from typing import Optional, Tuple
+
+import numpy as np
+
+INTERVAL_METHODS = ['wilson', 'beta', 'bootstrap']
+DEFAULT_CONFIDENCE = 0.95
+BOOTSTRAP_REPLICATES = 10_000
+
+
+def _normal_quantile(confidence: float) -> float:
+    from scipy.special import ndtri
+    return float(ndtri(0.5 + confidence / 2))
+
+
+def wilson_interval(successes: np.ndarray, totals: np.ndarray, confidence: float = DEFAULT_CONFIDENCE
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Wilson score interval of successes / totals."""
+    successes = np.asarray(successes, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    z = _normal_quantile(confidence)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = successes / totals
+        denominator = 1 + z ** 2 / totals
+        centre = (rate + z ** 2 / (2 * totals)) / denominator
+        half_width = z * np.sqrt(rate * (1 - rate) / totals + z ** 2 / (4 * totals ** 2)) / denominator
+    return np.clip(centre - half_width, 0, 1), np.clip(centre + half_width, 0, 1)
+
+
+def beta_interval(successes: np.ndarray, totals: np.ndarray, confidence: float = DEFAULT_CONFIDENCE,
+                  prior: float = 0.5) -> Tuple[np.ndarray, np.ndarray]:
+    """Equal-tailed interval of the Beta(successes + prior, failures + prior) posterior (Jeffreys by default)."""
+    from scipy.special import betaincinv
+    successes = np.asarray(successes, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    alpha, beta = successes + prior, totals - successes + prior
+    tail = (1 - confidence) / 2
+    lower = np.where(successes > 0, betaincinv(alpha, beta, tail), 0.0)
+    upper = np.where(successes < totals, betaincinv(alpha, beta, 1 - tail), 1.0)
+    empty = totals <= 0
+    return np.where(empty, np.nan, lower), np.where(empty, np.nan, upper)
+
+
+def bootstrap_interval(successes: np.ndarray, totals: np.ndarray, confidence: float = DEFAULT_CONFIDENCE,
+                       replicates: int = BOOTSTRAP_REPLICATES, seed: Optional[int] = 0
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentile bootstrap interval, resampling every country's guesses in one batch.
+
+    Resampling n yes/no outcomes with replacement gives a Binomial(n, k / n)
+    number of successes, so all countries and replicates are drawn as one
+    (countries, replicates) binomial matrix instead of resampling the guesses.
+    """
+    successes = np.asarray(successes, dtype=np.int64)
+    totals = np.asarray(totals, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    safe_totals = np.maximum(totals, 1)
+    draws = rng.binomial(safe_totals[:, None], (successes / safe_totals)[:, None], size=(len(totals), replicates))
+    tail = (1 - confidence) / 2
+    lower, upper = np.quantile(draws, [tail, 1 - tail], axis=1) / safe_totals
+    empty = totals <= 0
+    return np.where(empty, np.nan, lower), np.where(empty, np.nan, upper)
+
+
+def rate_interval(successes: np.ndarray, totals: np.ndarray, method: str = 'wilson',
+                  confidence: float = DEFAULT_CONFIDENCE) -> Tuple[np.ndarray, np.ndarray]:
+    """Interval of successes / totals by one of `INTERVAL_METHODS`."""
+    if method == 'wilson':
+        return wilson_interval(successes, totals, confidence)
+    if method == 'beta':
+        return beta_interval(successes, totals, confidence)
+    if method == 'bootstrap':
+        return bootstrap_interval(successes, totals, confidence)
+    raise ValueError(f"Unknown interval method {method!r}, expected one of {INTERVAL_METHODS}")
+
+
+def add_interval_arguments(parser: argparse.ArgumentParser) -> None:
+    """The --interval, --confidence and --rank-by-lower-bound options shared by the rate reports."""
+    parser.add_argument('--interval', choices=INTERVAL_METHODS,
+                        help="show a confidence interval for each rate")
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE,
+                        help=f"confidence level of the interval (default: {DEFAULT_CONFIDENCE})")
+    parser.add_argument('--rank-by-lower-bound', action='store_true',
+                        help="rank by the interval's lower bound instead of the rate (wilson unless --interval is given)")
+
+
+def interval_from_args(args: argparse.Namespace, successes: np.ndarray, totals: np.ndarray
+                       ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Interval requested by the options of `add_interval_arguments`, or None."""
+    if args.interval is None and not args.rank_by_lower_bound:
+        return None
+    return rate_interval(successes, totals, args.interval or 'wilson', args.confidence)
@@ -0,0 +1,66 @@
+"""Keep loaded data in memory across calls, for a process that runs many reports.
+
+A loader decorated with `resident` returns the object it returned before for
+the same arguments, as long as the file it was loaded from is unchanged
+(the store's meta.json for a store directory, which every rebuild and
+appended segment rewrites). This is off unless `keep_resident()` is called:
+a script that runs once gains nothing from it. Callers must treat resident
+objects as read-only, as the next report gets the same object.
+"""
+import functools
+import inspect
+import os
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+_enabled = False
+# (module, loader name, working directory, arguments) -> (stamp of the source file, loaded object)
+_cache: Dict[Tuple, Tuple] = {}
+
+
+def keep_resident(enabled: bool = True) -> None:
+    """Turn caching on or off for this process; turning it off drops what is cached."""
+    global _enabled
+    _enabled = enabled
+    if not enabled:
+        _cache.clear()
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    if os.path.isdir(path):
+        path = os.path.join(path, 'meta.json')
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def resident(path_argument: str, ignore: Sequence[str] = ()) -> Callable:
+    """Cache the decorated loader's result while the file or store named by `path_argument` is unchanged.
+
+    Arguments in `ignore` (e.g. data passed in only to save a reload) are not part of the key.
+    """
+    def decorate(loader: Callable) -> Callable:
+        signature = inspect.signature(loader)
+
+        @functools.wraps(loader)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return loader(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            # Paths are relative to the working directory, which a daemon changes per request
+            key = (loader.__module__, loader.__qualname__, os.getcwd(),
+                   tuple((name, value) for name, value in bound.arguments.items() if name not in ignore))
+            stamp = _stamp(bound.arguments[path_argument])
+            cached = _cache.get(key)
+            if cached is not None and stamp is not None and cached[0] == stamp:
+                return cached[1]
+            result = loader(*args, **kwargs)
+            # Stamped after loading, as loading may have rebuilt the file
+            _cache[key] = (_stamp(bound.arguments[path_argument]), result)
+            return result
+
+        return wrapper
+
+    return decorate
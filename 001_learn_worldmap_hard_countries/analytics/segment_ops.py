@@ -0,0 +1,69 @@
+"""Group-wise operations on arrays whose groups are contiguous runs.
+
+Each function takes `new_segment`, a boolean mask that is True on the first
+element of every group, in place of a pandas groupby. Sorting rows into
+groups once with `group_order` and running these vectorized passes replaces
+per-group Python callbacks such as `groupby().transform(lambda ...)`.
+"""
+import numpy as np
+
+
+def group_order(*keys: np.ndarray) -> np.ndarray:
+    """Stable order that makes rows with equal keys contiguous, first key outermost."""
+    return np.lexsort(keys[::-1])
+
+
+def segment_starts(*sorted_keys: np.ndarray) -> np.ndarray:
+    """Mask of the first row of every run of equal keys."""
+    n = len(sorted_keys[0])
+    new_segment = np.zeros(n, dtype=bool)
+    if n:
+        new_segment[0] = True
+        for key in sorted_keys:
+            new_segment[1:] |= key[1:] != key[:-1]
+    return new_segment
+
+
+def segment_start_positions(new_segment: np.ndarray) -> np.ndarray:
+    """Position of the first row of each row's segment."""
+    return np.maximum.accumulate(np.where(new_segment, np.arange(len(new_segment)), 0))
+
+
+def segment_end_positions(new_segment: np.ndarray) -> np.ndarray:
+    """Position one past the last row of each row's segment."""
+    starts = np.flatnonzero(new_segment)
+    ends = np.r_[starts[1:], len(new_segment)]
+    return np.repeat(ends, np.diff(np.r_[starts, len(new_segment)]))
+
+
+def segment_cumcount(new_segment: np.ndarray) -> np.ndarray:
+    """0, 1, 2, ... within each segment, like `groupby().cumcount()`."""
+    return np.arange(len(new_segment)) - segment_start_positions(new_segment)
+
+
+def segment_cumsum(values: np.ndarray, new_segment: np.ndarray) -> np.ndarray:
+    """Running sum within each segment, including the current row."""
+    totals = np.cumsum(values, dtype=np.int64 if values.dtype == bool else None)
+    before_segment = np.r_[0, totals[:-1]][segment_start_positions(new_segment)] if len(totals) else totals
+    return totals - before_segment
+
+
+def segment_shift(values: np.ndarray, new_segment: np.ndarray) -> np.ndarray:
+    """Previous row's value within the segment, NaN on each segment's first row."""
+    shifted = np.empty(len(values), dtype=np.float64)
+    shifted[1:] = values[:-1]
+    shifted[new_segment] = np.nan
+    return shifted
+
+
+def segment_trailing_run(flags: np.ndarray, new_segment: np.ndarray) -> np.ndarray:
+    """Rows from each row to its segment's end if they are all True there, else 0.
+
+    Equivalent to the reversed `cumsum() * cumprod()` of the flags in each group.
+    """
+    positions = np.arange(len(flags))
+    last_false = np.where(flags, -1, positions)
+    if len(flags):
+        starts = np.flatnonzero(new_segment)
+        last_false = np.repeat(np.maximum.reduceat(last_false, starts), np.diff(np.r_[starts, len(flags)]))
+    return np.where(positions > last_false, segment_end_positions(new_segment) - positions, 0)
@@ -0,0 +1 @@
+"""Benchmarks and checks for the analysis pipeline, run from the project directory."""
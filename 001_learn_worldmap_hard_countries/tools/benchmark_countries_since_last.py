@@ -0,0 +1,88 @@
+"""Benchmark the countries_attempted_since_last kernel against the original per-device loop.
+
+Runs on the heaviest devices of the event store and checks that the kernel
+reproduces the column of 10_make_alt_predictor_csv.py. Because the window
+starts at the user's previous guess, those windows are always empty, so a
+second run starts each window at the previous guess of the same country and
+checks the kernel against a brute-force count.
+"""
+import argparse
+import time
+from typing import Callable, Tuple
+
+import numpy as np
+
+from analytics.device_windows import distinct_countries_between, previous_occurrence
+from analytics.event_store import load_events
+
+
+def legacy_countries_since_last(timestamps: np.ndarray, countries: np.ndarray) -> np.ndarray:
+    """The original implementation from 10, for the events of one device."""
+    result = np.zeros(len(timestamps))
+    for i in range(1, len(timestamps)):
+        mask = (timestamps[:i] > timestamps[i-1]) & (timestamps[:i] < timestamps[i])
+        result[i] = len(np.unique(countries[:i][mask]))
+    return result
+
+
+def brute_force_between(timestamps: np.ndarray, countries: np.ndarray, since: np.ndarray) -> np.ndarray:
+    """Distinct countries with since < timestamp < own timestamp, for the events of one device."""
+    return np.array([
+        len(np.unique(countries[(timestamps > since[i]) & (timestamps < timestamps[i])]))
+        for i in range(len(timestamps))
+    ])
+
+
+def timed(function: Callable) -> Tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def per_device(function: Callable, device: np.ndarray, *columns: np.ndarray) -> np.ndarray:
+    boundaries = np.flatnonzero(np.r_[True, device[1:] != device[:-1], True])
+    return np.concatenate([
+        function(*(column[start:end] for column in columns))
+        for start, end in zip(boundaries[:-1], boundaries[1:])
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=10, help="number of heaviest devices to benchmark on")
+    args = parser.parse_args()
+
+    events = load_events()
+    counts = np.bincount(events.device)
+    heaviest = np.argsort(-counts, kind='stable')[:args.devices]
+    rows = np.flatnonzero(np.isin(events.device, heaviest))
+    rows = rows[np.lexsort((events.timestamp[rows], events.device[rows]))]
+
+    device = np.asarray(events.device[rows])
+    country = np.asarray(events.country[rows])
+    timestamp = events.timestamp[rows] // 1000  # seconds, as in 10
+    print(f"{len(heaviest)} heaviest devices, {len(rows)} events (largest device: {counts.max()} events)")
+
+    # Window from the user's previous guess, as in 10
+    previous_guess = np.where(np.r_[False, device[1:] == device[:-1]], np.roll(timestamp, 1), timestamp)
+    legacy, legacy_time = timed(lambda: per_device(legacy_countries_since_last, device, timestamp, country))
+    kernel, kernel_time = timed(lambda: distinct_countries_between(device, country, timestamp, previous_guess))
+    print(f"\nSince previous guess (column of 10): identical={np.array_equal(legacy, kernel)}")
+    print(f"  original loop: {legacy_time:8.3f}s")
+    print(f"  kernel:        {kernel_time:8.3f}s")
+
+    # Window from the previous guess of the same country, where windows are not empty
+    previous = previous_occurrence(device, country)
+    previous_same_country = np.where(previous >= 0, timestamp[previous], timestamp)
+    brute, brute_time = timed(lambda: per_device(brute_force_between, device, timestamp, country,
+                                                 previous_same_country))
+    kernel, kernel_time = timed(lambda: distinct_countries_between(device, country, timestamp,
+                                                                   previous_same_country))
+    print(f"\nSince previous guess of the same country: identical={np.array_equal(brute, kernel)}, "
+          f"mean window {kernel.mean():.1f} countries")
+    print(f"  brute force:   {brute_time:8.3f}s")
+    print(f"  kernel:        {kernel_time:8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Time and memory-profile every stage of the pipeline on synthetic exports of several sizes.
+
+For each size, `tools.generate_learning_data` writes an export to
+``data/benchmark/<size>/data/full/`` (kept for later runs with the same
+seed), and the scripts run one after another as separate processes with
+``data/benchmark/<size>/`` as working directory, exactly as on the real
+data. Every stage records wall time, CPU time and the peak RSS of its
+process, and their output goes to ``logs/<stage>.log`` next to the data.
+Scripts measured by `analytics.instrumentation` also write their run
+report to ``logs/<stage>.report.json``, whose stages are kept in the results.
+Linux reports a child's peak RSS as at least the parent's at fork time,
+so the export is generated in a subprocess too, keeping this process small.
+
+The results are written as JSON. With --compare, they are checked against
+an earlier results file: stages that got slower or bigger by more than
+--tolerance are listed, and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tools.generate_learning_data import SIZES
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join('data', 'benchmark')
+
+# (stage name, arguments to python); scripts are looked up in the project directory
+STAGES: List[Tuple[str, List[str]]] = [
+    ('01_filter', ['01_filter_data_to_only_contain_post_map_data_change_entries.py', '--stream']),
+    ('event_store', ['-c', 'from analytics.event_store import ensure_event_store; ensure_event_store()']),
+    ('02_wrong_data', ['02_get_top_10_countries_most_often_wrong_data.py']),
+    ('02_wrong_plot', ['02_get_top_10_countries_most_often_wrong_plot.py']),
+    ('03_right_data', ['03_get_top_10_countries_most_often_right_data.py']),
+    ('03_right_plot', ['03_get_top_10_countries_most_often_right_plot.py']),
+    ('04_distance_plot', ['04_plot_top_10_distance_from_country_center.py']),
+    ('05_region', ['05_get_worst_error_rate_per_region.py']),
+    ('06_trajectory', ['06_prototype_learning_trajectory.py']),
+    ('07_trajectories_3d', ['07_trajectories_3d_plot.py']),
+    ('08_first_see', ['08_get_error_rate_on_first_see_per_country.py']),
+    ('09_predictor', ['09_make_predictor_csv.py']),
+    ('10_alt_predictor', ['10_make_alt_predictor_csv.py', '--csv']),
+    ('10_alt_out_of_core', ['10_make_alt_predictor_csv.py', '--out-of-core']),
+]
+
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS = 0.2
+MIN_RSS_MB = 20
+
+
+def run_stage(arguments: List[str], cwd: str, log_path: str) -> Dict:
+    """Run `python <arguments>` in `cwd`; wall and CPU seconds, peak RSS and exit code of the process."""
+    script = arguments[0]
+    if script.endswith('.py'):
+        arguments = [os.path.join(PROJECT_DIR, script)] + arguments[1:]
+    report_path = os.path.splitext(log_path)[0] + '.report.json'
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR, MPLBACKEND='Agg', PIPELINE_REPORT=os.path.abspath(report_path))
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable] + arguments, cwd=cwd, env=env, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        # wait4 reports the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    result = {
+        'wall_s': round(wall, 3),
+        'cpu_s': round(usage.ru_utime + usage.ru_stime, 3),
+        'max_rss_mb': round(usage.ru_maxrss / 1024, 1),  # kilobytes on Linux
+        'returncode': process.returncode,
+    }
+    if os.path.exists(report_path):
+        with open(report_path, 'r') as f:
+            result['breakdown'] = json.load(f)['stages']
+    return result
+
+
+def prepare_workspace(size: str, n_events: int, seed: int, geo_path: str) -> Tuple[str, Optional[Dict]]:
+    """Workspace of one size, with outputs of earlier runs removed; the generation stage, if it had to generate."""
+    workspace = os.path.join(BENCHMARK_DIR, size)
+    data_dir = os.path.join(workspace, 'data', 'full')
+    marker = os.path.join(data_dir, 'generated.json')
+    wanted = {'events': n_events, 'seed': seed, 'geo': os.path.abspath(geo_path)}
+    generation = None
+    generated = None
+    if os.path.exists(marker):
+        with open(marker, 'r') as f:
+            generated = json.load(f)
+    if generated != wanted:
+        shutil.rmtree(workspace, ignore_errors=True)
+        os.makedirs(data_dir)
+        generation = run_stage(['-m', 'tools.generate_learning_data', str(n_events), '--out', os.path.abspath(data_dir),
+                                '--geo', os.path.abspath(geo_path), '--seed', str(seed)],
+                               PROJECT_DIR, os.path.join(workspace, 'generate.log'))
+        if generation['returncode'] != 0:
+            sys.exit(f"Generating {size} failed, see {os.path.join(workspace, 'generate.log')}")
+        with open(marker, 'w') as f:
+            json.dump(wanted, f)
+
+    # Everything the stages derive is rebuilt, so every run measures the same work
+    for name in os.listdir(data_dir):
+        if name not in ('learning_data.json', 'worldmap.geo.json', 'generated.json'):
+            path = os.path.join(data_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    for directory in ('plots', os.path.join('data', 'csv'), 'logs'):
+        shutil.rmtree(os.path.join(workspace, directory), ignore_errors=True)
+        os.makedirs(os.path.join(workspace, directory))
+    return workspace, generation
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Stages of `results` more than `tolerance` slower or bigger than in `baseline`."""
+    regressions = []
+    print(f"\n{'Size':<6} {'Stage':<20} {'Wall':>9} {'Baseline':>9} {'Ratio':>6} {'RSS MB':>8} {'Baseline':>9} {'Ratio':>6}")
+    for size, run in results['sizes'].items():
+        base_run = baseline.get('sizes', {}).get(size)
+        if base_run is None:
+            continue
+        for stage, now in run['stages'].items():
+            before = base_run['stages'].get(stage)
+            if before is None:
+                continue
+            wall_ratio = now['wall_s'] / max(before['wall_s'], 1e-9)
+            rss_ratio = now['max_rss_mb'] / max(before['max_rss_mb'], 1e-9)
+            print(f"{size:<6} {stage:<20} {now['wall_s']:>9.2f} {before['wall_s']:>9.2f} {wall_ratio:>6.2f} "
+                  f"{now['max_rss_mb']:>8.0f} {before['max_rss_mb']:>9.0f} {rss_ratio:>6.2f}")
+            if wall_ratio > 1 + tolerance and now['wall_s'] - before['wall_s'] > MIN_SECONDS:
+                regressions.append(f"{size} {stage}: wall {before['wall_s']:.2f}s -> {now['wall_s']:.2f}s")
+            if rss_ratio > 1 + tolerance and now['max_rss_mb'] - before['max_rss_mb'] > MIN_RSS_MB:
+                regressions.append(f"{size} {stage}: peak RSS {before['max_rss_mb']:.0f} -> {now['max_rss_mb']:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['10k', '1m'],
+                        help=f"export sizes: event counts or {', '.join(SIZES)} (default: 10k 1m)")
+    parser.add_argument('--stages', nargs='+', help=f"stages to run (default: all of {', '.join(s for s, _ in STAGES)})")
+    parser.add_argument('--geo', default=os.path.join(PROJECT_DIR, 'data', 'full', 'worldmap.geo.json'),
+                        help="map to take the countries from and to run the scripts with")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="results file (default: data/benchmark/results-<time>.json)")
+    parser.add_argument('--compare', metavar='BASELINE', help="earlier results file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative slowdown or memory growth with --compare (default: 0.2)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.geo):
+        args.geo = os.path.join(PROJECT_DIR, 'data', 'demo', 'worldmap.geo.json')
+    stages = [(name, arguments) for name, arguments in STAGES if not args.stages or name in args.stages]
+    results = {**environment(), 'sizes': {}}
+
+    for size in args.sizes:
+        n_events = SIZES.get(size.lower()) or int(size)
+        workspace, generation = prepare_workspace(size.lower(), n_events, args.seed, args.geo)
+        run = results['sizes'][size] = {'events': n_events, 'generation': generation, 'stages': {}}
+        print(f"\n{size}: {n_events} events in {workspace}" +
+              (f" (generated in {generation['wall_s']:.1f}s)" if generation else ''))
+        for name, arguments in stages:
+            stage = run['stages'][name] = run_stage(arguments, workspace, os.path.join(workspace, 'logs', f'{name}.log'))
+            status = '' if stage['returncode'] == 0 else f"  FAILED ({stage['returncode']}), see logs/{name}.log"
+            print(f"  {name:<20} {stage['wall_s']:>8.2f}s wall {stage['cpu_s']:>8.2f}s CPU "
+                  f"{stage['max_rss_mb']:>8.0f} MB{status}")
+
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, f"results-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == '__main__':
+    main()
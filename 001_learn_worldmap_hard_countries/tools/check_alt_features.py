@@ -0,0 +1,134 @@
+"""Check that the segment-ops features of 10_make_alt_predictor_csv.py match the former pandas implementation.
+
+`legacy_process_data` is 10's process_data before the switch to
+analytics.alt_features, with per-group Python callbacks. Both run on the same
+export (data/demo by default) and every column is compared; on a difference
+the first mismatching rows are printed and the exit status is 1.
+"""
+import argparse
+import importlib
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analytics.device_windows import distinct_countries_between
+from analytics.event_store import EventStore, read_export_events
+
+DEMO_SOURCE = 'data/demo/learning_data.json'
+
+
+def legacy_process_data(events: EventStore) -> pd.DataFrame:
+    """10's former process_data, without the progress bars and the unused user-country histories."""
+    entries_df = pd.DataFrame({
+        'deviceId': np.asarray(events.devices, dtype=object)[events.device],
+        'country': np.asarray(events.countries, dtype=object)[events.country],
+        'timestamp': events.timestamp // 1000,
+        'is_correct': events.is_correct
+    })
+    entries_df = entries_df.sort_values('timestamp', kind='stable')
+    entries_df['attempt_num'] = entries_df.groupby(['deviceId', 'country']).cumcount() + 1
+
+    first_attempts = entries_df[entries_df['attempt_num'] == 1].groupby('country')['is_correct'].apply(list)
+    third_attempts = entries_df[entries_df['attempt_num'] == 3].groupby('country')['is_correct'].apply(list)
+    fifth_attempts = entries_df[entries_df['attempt_num'] == 5].groupby('country')['is_correct'].apply(list)
+    global_stats = pd.DataFrame({
+        'first_guess_success_rate': first_attempts.apply(lambda x: sum(x) / len(x) if x else 0),
+        'first_guess_sample_size': first_attempts.apply(len),
+        'third_guess_success_rate': third_attempts.apply(lambda x: sum(x) / len(x) if x else 0),
+        'third_guess_sample_size': third_attempts.apply(len),
+        'fifth_guess_success_rate': fifth_attempts.apply(lambda x: sum(x) / len(x) if x else 0),
+        'fifth_guess_sample_size': fifth_attempts.apply(len)
+    }).fillna(0)
+
+    entries_df['user_total_guesses'] = entries_df.groupby('deviceId').cumcount() + 1
+    entries_df['streak'] = entries_df.groupby(['deviceId', 'country'])['is_correct'].transform(
+        lambda x: x[::-1].cumsum()[::-1] * x[::-1].cumprod()[::-1]
+    )
+    entries_df['prev_timestamp'] = entries_df.groupby(['deviceId', 'country'])['timestamp'].transform('shift')
+    entries_df['time_since_last_country'] = entries_df['timestamp'] - entries_df['prev_timestamp'].fillna(entries_df['timestamp'])
+    entries_df['prev_user_timestamp'] = entries_df.groupby('deviceId')['timestamp'].transform('shift')
+    entries_df['time_since_last_user'] = entries_df['timestamp'] - entries_df['prev_user_timestamp'].fillna(entries_df['timestamp'])
+
+    device_codes = pd.factorize(entries_df['deviceId'])[0]
+    by_device = np.argsort(device_codes, kind='stable')
+    country_codes = pd.factorize(entries_df['country'])[0]
+    timestamps = entries_df['timestamp'].to_numpy()
+    since = entries_df['prev_user_timestamp'].fillna(entries_df['timestamp']).to_numpy().astype(np.int64)
+    countries_since_last = np.empty(len(entries_df))
+    countries_since_last[by_device] = distinct_countries_between(
+        device_codes[by_device], country_codes[by_device], timestamps[by_device], since[by_device]
+    )
+    entries_df['countries_attempted_since_last'] = countries_since_last
+
+    entries_df['date'] = entries_df['timestamp'].apply(datetime.fromtimestamp).dt.date
+    entries_df['is_first_guess_of_day'] = entries_df['date'] != entries_df['date'].shift(1)
+
+    entries_df['correct_guesses'] = entries_df.groupby(['deviceId', 'country'])['is_correct'].transform('cumsum')
+    entries_df['correct_guess_percentage'] = entries_df['correct_guesses'] / (entries_df['attempt_num'] - 1)
+    entries_df['correct_guess_percentage'] = entries_df['correct_guess_percentage'].fillna(-1)
+
+    result_df = entries_df.merge(global_stats, on='country', how='left')
+    result_df['deviceId_country_timestamp'] = result_df['deviceId'] + '_' + result_df['country'] + '_' + result_df['timestamp'].astype(str)
+    final_columns = {
+        'deviceId': 'deviceId',
+        'country': 'country',
+        'timestamp': 'current_guess_timestamp',
+        'attempt_num': 'total_guesses',
+        'user_total_guesses': 'user_total_guesses',
+        'prev_timestamp': 'previous_guess_timestamp',
+        'streak': 'current_streak',
+        'correct_guess_percentage': 'correct_guess_percentage',
+        'time_since_last_country': 'time_since_last_country_guess',
+        'time_since_last_user': 'time_since_last_user_guess',
+        'countries_attempted_since_last': 'countries_attempted_since_last',
+        'is_first_guess_of_day': 'is_first_guess_of_day',
+        'is_correct': 'is_correct',
+        'deviceId_country_timestamp': 'deviceId_country_timestamp'
+    }
+    for col in global_stats.columns:
+        final_columns[col] = col
+    result_df = result_df[list(final_columns.keys())].rename(columns=final_columns)
+    return result_df.sort_values('deviceId_country_timestamp', kind='stable')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=DEMO_SOURCE, help="export file to compare on")
+    parser.add_argument('--workers', type=int, default=1, help="processes for the segment-ops run")
+    args = parser.parse_args()
+
+    alt_predictor = importlib.import_module('10_make_alt_predictor_csv')
+    events = read_export_events(args.source)
+    print(f"{len(events)} events from {args.source}")
+
+    start = time.perf_counter()
+    expected = legacy_process_data(events).reset_index(drop=True)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = alt_predictor.process_data(events, workers=args.workers).reset_index(drop=True)
+    segment_time = time.perf_counter() - start
+    print(f"  pandas callbacks: {legacy_time:8.3f}s")
+    print(f"  segment ops:      {segment_time:8.3f}s")
+
+    if list(actual.columns) != list(expected.columns):
+        print(f"Columns differ:\n  expected {list(expected.columns)}\n  actual   {list(actual.columns)}")
+        sys.exit(1)
+    # Sample sizes were floats when some country had no attempt of a rank, so dtypes are not compared
+    mismatched = False
+    for column in expected.columns:
+        same = (expected[column] == actual[column]) | (expected[column].isna() & actual[column].isna())
+        if not same.all():
+            mismatched = True
+            rows = np.flatnonzero(~same.to_numpy())
+            print(f"Column {column} differs in {len(rows)} rows, first at row {rows[0]}: "
+                  f"expected {expected[column].iloc[rows[0]]!r}, got {actual[column].iloc[rows[0]]!r}")
+    if mismatched:
+        sys.exit(1)
+    print(f"All {len(expected.columns)} columns identical for {len(expected)} rows")
+
+
+if __name__ == '__main__':
+    main()
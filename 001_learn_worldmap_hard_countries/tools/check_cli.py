@@ -0,0 +1,79 @@
+"""Check that the CLI's own options work after the command as well as before it.
+
+Starts `serve --socket <tmp> --no-preload` and checks that the daemon
+listens on that socket and not on the default one, runs a report through it
+with `--socket` after the report name and again with `--no-daemon`, and
+compares both outputs. `serve` and `stop` must reject arguments that aren't
+the CLI's, and `stop --socket <tmp>` must end the daemon.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from tools.cli import DEFAULT_SOCKET
+
+REPORT = '05_region'
+START_TIMEOUT = 60.0
+
+
+def cli(*arguments: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, '-m', 'tools.cli', *arguments], capture_output=True, text=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--report', default=REPORT, help=f"report to run (default: {REPORT})")
+    args = parser.parse_args()
+
+    failed = False
+    default_was_up = os.path.exists(DEFAULT_SOCKET)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, 'reports.sock')
+        daemon = subprocess.Popen([sys.executable, '-m', 'tools.cli', 'serve', '--socket', socket_path, '--no-preload'],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + START_TIMEOUT
+            while not os.path.exists(socket_path) and daemon.poll() is None and time.monotonic() < deadline:
+                time.sleep(0.1)
+            if not os.path.exists(socket_path):
+                print(f"serve --socket {socket_path} didn't create its socket")
+                sys.exit(1)
+            if not default_was_up and os.path.exists(DEFAULT_SOCKET):
+                failed = True
+                print(f"serve --socket also bound {DEFAULT_SOCKET}")
+
+            served = cli(args.report, '--socket', socket_path)
+            local = cli(args.report, '--no-daemon')
+            for name, result in (('--socket', served), ('--no-daemon', local)):
+                if result.returncode != 0:
+                    failed = True
+                    print(f"{args.report} {name} exited with {result.returncode}:\n{result.stderr}")
+            if served.stdout != local.stdout:
+                failed = True
+                print(f"{args.report} printed different output through the daemon and with --no-daemon")
+
+            for command in ('serve', 'stop'):
+                result = cli(command, '--socket', socket_path, 'extra')
+                if result.returncode != 2:
+                    failed = True
+                    print(f"{command} with an extra argument exited with {result.returncode}, expected 2")
+
+            stopped = cli('stop', '--socket', socket_path)
+            if stopped.returncode != 0 or daemon.wait(timeout=START_TIMEOUT) != 0:
+                failed = True
+                print(f"stop --socket didn't end the daemon:\n{stopped.stdout}{stopped.stderr}")
+        finally:
+            if daemon.poll() is None:
+                daemon.kill()
+                daemon.wait()
+
+    if failed:
+        sys.exit(1)
+    print(f"serve --socket, {args.report} --socket, {args.report} --no-daemon and stop --socket behave")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Check the streaming feature state against the batch features of 10_make_alt_predictor_csv.py.
+
+The guesses of an export are fed one by one, in the order 10 sorts them, into
+an empty `OnlineFeatureState`. Prefix columns must equal 10's on every row,
+`current_streak` on the last guess of each pair, and the success rates after
+the last guess. A second state built with `OnlineFeatureState.from_events`
+must equal the replayed one.
+"""
+import argparse
+import importlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from analytics.event_store import read_export_events
+from analytics.online_features import OnlineFeatureState
+
+DEMO_SOURCE = 'data/demo/learning_data.json'
+PREFIX_COLUMNS = [
+    'total_guesses', 'user_total_guesses', 'previous_guess_timestamp', 'correct_guess_percentage',
+    'time_since_last_country_guess', 'time_since_last_user_guess', 'countries_attempted_since_last',
+    'is_first_guess_of_day', 'is_correct', 'deviceId_country_timestamp',
+]
+
+
+def differing_rows(expected: pd.Series, actual: pd.Series) -> np.ndarray:
+    same = (expected.to_numpy() == actual.to_numpy()) | (expected.isna().to_numpy() & actual.isna().to_numpy())
+    return np.flatnonzero(~same)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=DEMO_SOURCE, help="export file to compare on")
+    args = parser.parse_args()
+
+    alt_predictor = importlib.import_module('10_make_alt_predictor_csv')
+    events = read_export_events(args.source)
+    print(f"{len(events)} events from {args.source}")
+    batch = alt_predictor.process_data(events)
+
+    # Replay in 10's processing order: by timestamp, ties in export order, as sorted before the final sort
+    order = np.argsort(events.timestamp // 1000, kind='stable')
+    state = OnlineFeatureState(day_timezone=alt_predictor.DAY_TIMEZONE)
+    start = time.perf_counter()
+    rows = [
+        state.update(events.devices[events.device[i]], events.countries[events.country[i]],
+                     int(events.timestamp[i] // 1000), bool(events.is_correct[i]))
+        for i in order.tolist()
+    ]
+    elapsed = time.perf_counter() - start
+    print(f"  online updates: {elapsed:8.3f}s ({elapsed / max(len(rows), 1) * 1e6:.1f} us per guess)")
+    # Both sides in the order of 10's CSVs
+    online = pd.DataFrame(rows).sort_values('deviceId_country_timestamp', kind='stable').reset_index(drop=True)
+    batch = batch.reset_index(drop=True)
+
+    failed = False
+    for column in PREFIX_COLUMNS:
+        rows_off = differing_rows(batch[column], online[column])
+        if len(rows_off):
+            failed = True
+            print(f"Column {column} differs in {len(rows_off)} rows, first at row {rows_off[0]}")
+    last_of_pair = (batch['total_guesses'] == batch.groupby(['deviceId', 'country'], observed=True)['total_guesses'].transform('max')).to_numpy()
+    if len(differing_rows(batch['current_streak'][last_of_pair], online['current_streak'][last_of_pair])):
+        failed = True
+        print("current_streak differs on the last guess of a pair")
+    rate_columns = [column for column in batch.columns if column.endswith(('_success_rate', '_sample_size'))]
+    final = pd.DataFrame([state.rank_counts[country] for country in batch['country']])
+    for rank_index, rank in enumerate(state.ranks):
+        correct = final[rank_index].str[0].to_numpy()
+        attempts = final[rank_index].str[1].to_numpy()
+        rates = np.divide(correct, attempts, out=np.zeros(len(attempts)), where=attempts > 0)
+        rate_column, size_column = rate_columns[2 * rank_index], rate_columns[2 * rank_index + 1]
+        if not (np.array_equal(rates, batch[rate_column]) and np.array_equal(attempts, batch[size_column])):
+            failed = True
+            print(f"Success rates for rank {rank} differ after the last guess")
+
+    # Bulk-built state must equal the replayed one
+    built = OnlineFeatureState.from_events(events, day_timezone=alt_predictor.DAY_TIMEZONE)
+    replayed_pairs = {key: (p.attempts, p.correct, p.streak, p.last_timestamp) for key, p in state.pairs.items()}
+    built_pairs = {key: (p.attempts, p.correct, p.streak, p.last_timestamp) for key, p in built.pairs.items()}
+    replayed_devices = {key: (d.guesses, d.last_timestamp) for key, d in state.devices.items()}
+    built_devices = {key: (d.guesses, d.last_timestamp) for key, d in built.devices.items()}
+    if (built_pairs != replayed_pairs or built_devices != replayed_devices
+            or built.rank_counts != state.rank_counts or built.last_day != state.last_day):
+        failed = True
+        print("State built from the events differs from the replayed state")
+
+    if failed:
+        sys.exit(1)
+    print(f"Online features match 10 on {len(batch)} rows; bulk-built state matches the replay")
+
+
+if __name__ == '__main__':
+    main()
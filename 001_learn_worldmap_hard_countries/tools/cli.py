@@ -0,0 +1,221 @@
+"""One entry point for the numbered scripts, optionally answered by a warm daemon.
+
+`python -m tools.cli <report> [arguments]` runs one of the scripts, named as
+in `tools.run_pipeline` (``04_distance_plot``, or any unique prefix such as
+``04``), with the given arguments. The CLI's own options (--socket,
+--no-daemon, --no-preload) may come before or after the command; everything
+else is passed to the script. The CLI itself only imports the standard
+library; pandas, matplotlib and the analytics modules are imported by the
+script that needs them.
+
+`serve` starts a daemon on a Unix socket (``data/full/reports.sock``) that
+runs the scripts in its own process. Its imports happen once, and the events,
+attempt index, aggregates, country table and map index stay resident
+(`analytics.resident`) until the store or the map changes; before each
+report, the store is rebuilt if the export has changed. While the daemon is
+up, the CLI forwards every report to it and prints the report's output, so a
+report takes the milliseconds of its own work instead of a cold start.
+`stop` ends the daemon.
+"""
+import argparse
+import io
+import json
+import os
+import runpy
+import socket
+import socketserver
+import sys
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Dict, List, Optional
+
+from tools.run_pipeline import PROJECT_DIR, STAGES
+
+DEFAULT_SOCKET = 'data/full/reports.sock'
+
+# Report name -> script
+REPORTS: Dict[str, str] = {stage.name: stage.command[1] for stage in STAGES if stage.command[1].endswith('.py')}
+
+
+def resolve_report(name: str) -> Optional[str]:
+    """The report called `name`, or the only one it is a prefix of."""
+    if name in REPORTS:
+        return name
+    matches = [report for report in REPORTS if report.startswith(name)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def run_script(report: str, arguments: List[str]) -> int:
+    """Run a report's script in this process, as `python <script> <arguments>` would; its exit code."""
+    script = os.path.join(PROJECT_DIR, REPORTS[report])
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    saved_argv = sys.argv
+    sys.argv = [script, *arguments]
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            return exit.code or 0
+        print(exit.code, file=sys.stderr)
+        return 1
+    finally:
+        sys.argv = saved_argv
+    return 0
+
+
+def serve_report(report: str, arguments: List[str]) -> int:
+    """Run a report in the daemon, with the store brought up to date first and per-report state reset after."""
+    from analytics.event_store import SOURCE_CANDIDATES, ensure_event_store
+    from analytics.instrumentation import finish_report
+
+    try:
+        if any(os.path.exists(path) for path in SOURCE_CANDIDATES):
+            ensure_event_store()
+        return run_script(report, arguments)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        finish_report()
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+
+def warm_up() -> None:
+    """Import what the scripts use and load the data they share, so the first report is fast too."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    import pandas  # noqa: F401
+
+    from analytics.attempt_index import load_attempt_index
+    from analytics.country_table import load_country_table
+    from analytics.event_store import SOURCE_CANDIDATES, load_events
+    from analytics.geo_index import GEO_PATH, load_geo_index
+
+    if any(os.path.exists(path) for path in SOURCE_CANDIDATES):
+        events = load_events()
+        load_attempt_index(events=events)
+        load_country_table()
+    if os.path.exists(GEO_PATH):
+        load_geo_index()
+
+
+class ReportHandler(socketserver.StreamRequestHandler):
+    """One request per connection: a JSON line in, a JSON line with the output and exit code back."""
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if request.get('ping'):
+            response = {'output': '', 'exit_code': 0}
+        elif request.get('stop'):
+            self.server.stopping = True
+            response = {'output': "Daemon stopped\n", 'exit_code': 0}
+        else:
+            output = io.StringIO()
+            start = time.perf_counter()
+            cwd = os.getcwd()
+            try:
+                os.chdir(request['cwd'])
+                with redirect_stdout(output), redirect_stderr(output):
+                    exit_code = serve_report(request['report'], request['arguments'])
+            finally:
+                os.chdir(cwd)
+            response = {'output': output.getvalue(), 'exit_code': exit_code}
+            print(f"{request['report']} {' '.join(request['arguments'])}: exit code {exit_code} "
+                  f"in {time.perf_counter() - start:.2f}s", flush=True)
+        self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+def send_request(socket_path: str, request: Dict) -> Optional[Dict]:
+    """The daemon's response to `request`, or None if no daemon listens on `socket_path`."""
+    if not os.path.exists(socket_path):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return None
+        client.sendall((json.dumps(request) + '\n').encode())
+        with client.makefile('rb') as response:
+            return json.loads(response.readline())
+
+
+def serve(socket_path: str, preload: bool = True) -> None:
+    """Answer report requests on `socket_path`, one at a time, until asked to stop."""
+    if send_request(socket_path, {'ping': True}) is not None:
+        sys.exit(f"A daemon is already listening on {socket_path}")
+    if os.path.exists(socket_path):
+        # Left behind by a daemon that didn't shut down cleanly
+        os.remove(socket_path)
+
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from analytics.resident import keep_resident
+    keep_resident()
+    if preload:
+        start = time.perf_counter()
+        warm_up()
+        print(f"Loaded in {time.perf_counter() - start:.1f}s", flush=True)
+
+    os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+    server = socketserver.UnixStreamServer(socket_path, ReportHandler)
+    os.chmod(socket_path, 0o600)
+    server.stopping = False
+    print(f"Serving reports on {socket_path}", flush=True)
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     usage='%(prog)s [--socket S] [--no-daemon] [--no-preload] command ...')
+    parser.add_argument('command', help=f"a report ({', '.join(REPORTS)}, or a unique prefix), "
+                                        f"serve, stop or list")
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help="arguments of the report's script")
+    # The CLI's own options, accepted before or after the command; the others go to the report
+    options = argparse.ArgumentParser(add_help=False, allow_abbrev=False, argument_default=argparse.SUPPRESS)
+    for container in (parser, options):
+        container.add_argument('--socket', help=f"daemon socket (default: {DEFAULT_SOCKET})")
+        container.add_argument('--no-daemon', action='store_true', help="run the report in this process even if "
+                                                                        "a daemon is up")
+        container.add_argument('--no-preload', action='store_true', help="with serve: load the data on the first "
+                                                                         "report instead of at start")
+    parser.set_defaults(socket=DEFAULT_SOCKET, no_daemon=False, no_preload=False)
+    args = parser.parse_args()
+    args, args.arguments = options.parse_known_args(args.arguments, namespace=args)
+
+    if args.command in ('list', 'serve', 'stop') and args.arguments:
+        parser.error(f"{args.command} takes no arguments besides the CLI's options, got {' '.join(args.arguments)}")
+    if args.command == 'list':
+        for report, script in REPORTS.items():
+            print(f"{report:<20} {script}")
+        return
+    if args.command == 'serve':
+        serve(args.socket, preload=not args.no_preload)
+        return
+    if args.command == 'stop':
+        response = send_request(args.socket, {'stop': True})
+        print(response['output'] if response else f"No daemon on {args.socket}", end='' if response else '\n')
+        return
+
+    report = resolve_report(args.command)
+    if report is None:
+        parser.error(f"unknown report {args.command!r}; one of {', '.join(REPORTS)}")
+    if not args.no_daemon:
+        response = send_request(args.socket, {'report': report, 'arguments': args.arguments, 'cwd': os.getcwd()})
+        if response is not None:
+            sys.stdout.write(response['output'])
+            sys.exit(response['exit_code'])
+    sys.exit(run_script(report, args.arguments))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Generate a synthetic learning_data.json of any size, shaped like the Firestore export.
+
+The data is random but behaves like the real export where the pipeline
+cares about it:
+- device activity is heavy-tailed (a few devices make most guesses)
+- each device plays in sessions of closely spaced guesses separated by
+  longer breaks
+- countries come from the map's admin names, plus a small share of
+  pre-map-change names that 01 filters out
+- every country has its own difficulty, and the error rate falls with each
+  further attempt at the same country
+- clicks, distances and timings follow skewed distributions that depend on
+  whether the guess was right
+
+Columns are generated as typed arrays (strings as codes) and only turned
+into JSON text a chunk at a time, so 10M events need about 1 GB of memory.
+Document ids are sorted, as in the export.
+"""
+import argparse
+import os
+import shutil
+import time
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from analytics.geo_index import GEO_PATH, build_geo_index
+from analytics.segment_ops import group_order, segment_cumcount, segment_starts
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+DEMO_GEO = 'data/demo/worldmap.geo.json'
+START = np.datetime64('2025-03-01T00:00:00', 'ms')
+WRITE_CHUNK = 50_000
+
+# Country names of the old map, which 01 removes
+OLD_NAMES = ['Swaziland', 'Macedonia', 'Czech Republic', 'Burma', 'Cape Verde', 'East Timor',
+             'Antigua and Barb.', 'Bosnia and Herz.', 'Dem. Rep. Congo', 'Central African Rep.']
+OLD_NAME_SHARE = 0.02
+
+_ID_ALPHABET = np.frombuffer(b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz', dtype=np.uint8)
+
+
+def device_ids(rng: np.random.Generator, n_devices: int) -> List[str]:
+    """Random version-4 UUID strings."""
+    raw = rng.integers(0, 16, size=(n_devices, 32)).astype(np.uint8)
+    hex_digits = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)[raw]
+    text = hex_digits.view('S32').ravel().astype(str)
+    return [f'{h[:8]}-{h[8:12]}-4{h[13:16]}-{"89ab"[int(h[16], 16) % 4]}{h[17:20]}-{h[20:]}' for h in text]
+
+
+def sorted_id_prefixes(rng: np.random.Generator, n_events: int) -> np.ndarray:
+    """Sorted, distinct random integers below 62**10, the first half of each document id."""
+    prefixes = np.sort(rng.integers(0, _ID_ALPHABET.size ** 10, size=n_events, dtype=np.int64))
+    # Push duplicates up by one; the gaps between 62**10 random values leave room for that
+    while n_events > 1:
+        duplicates = np.flatnonzero(prefixes[1:] <= prefixes[:-1]) + 1
+        if not duplicates.size:
+            break
+        prefixes[duplicates] = prefixes[duplicates - 1] + 1
+    return prefixes
+
+
+def document_ids(rng: np.random.Generator, prefixes: np.ndarray) -> np.ndarray:
+    """20-character Firestore-style ids: the base-62 prefix, which sets the order, and 10 random characters."""
+    digits = np.empty((len(prefixes), 20), dtype=np.uint8)
+    value = prefixes.copy()
+    for position in range(9, -1, -1):
+        value, digits[:, position] = np.divmod(value, _ID_ALPHABET.size)
+    digits[:, 10:] = rng.integers(0, _ID_ALPHABET.size, size=(len(prefixes), 10))
+    return _ID_ALPHABET[digits].view('S20').ravel().astype(str)
+
+
+def generate_events(n_events: int, countries: List[str], seed: int = 0, n_devices: int = 0) -> Dict:
+    """Columns of `n_events` synthetic events, in document id order.
+
+    'device' and 'country' are codes into the lists 'devices' and 'countries',
+    'doc_id_prefix' the sorted integers the document ids are built from.
+    """
+    rng = np.random.default_rng(seed)
+    n_devices = n_devices or max(5, n_events // 60)
+
+    # Heavy-tailed device activity: Zipf-like weights
+    weights = 1 / np.arange(1, n_devices + 1) ** 1.1
+    device = rng.choice(n_devices, size=n_events, p=weights / weights.sum()).astype(np.int32)
+
+    # Sessions per device: guesses ~20 s apart, with a break of hours to days after ~3% of guesses
+    start = rng.uniform(0, 40 * 86400e3, size=n_devices)
+    gaps = np.where(rng.random(n_events) < 0.03, rng.exponential(86400e3, n_events), rng.exponential(20e3, n_events))
+    by_device = np.argsort(device, kind='stable')
+    gaps = gaps[by_device]
+    new_device = segment_starts(device[by_device])
+    cumulative = np.cumsum(gaps)
+    device_base = np.maximum.accumulate(np.where(new_device, cumulative - gaps, 0))
+    offset_ms = np.empty(n_events)
+    offset_ms[by_device] = start[device[by_device]] + cumulative - device_base
+    timestamp = START + offset_ms.astype(np.int64).astype('timedelta64[ms]')
+
+    # Countries: somewhat uneven popularity, plus a few names of the old map
+    names = list(countries) + OLD_NAMES
+    popularity = rng.dirichlet(np.full(len(countries), 5.0))
+    country = rng.choice(len(countries), size=n_events, p=popularity).astype(np.int32)
+    old = rng.random(n_events) < OLD_NAME_SHARE
+    country[old] = len(countries) + rng.integers(0, len(OLD_NAMES), size=old.sum())
+
+    # Difficulty per country, falling with each further attempt of the same device
+    difficulty = np.r_[rng.beta(2, 8, size=len(countries)), np.full(len(OLD_NAMES), 0.3)]
+    order = group_order(device, country, offset_ms)
+    attempt = np.empty(n_events, dtype=np.int32)
+    attempt[order] = segment_cumcount(segment_starts(device[order], country[order])) + 1
+    p_wrong = difficulty[country] * 0.8 ** np.minimum(attempt - 1, 20)
+    wrong = rng.random(n_events) < p_wrong
+
+    clicks = np.where(wrong, 2 + np.minimum(rng.geometric(0.45, n_events) - 1, 8), 1).astype(np.int8)
+    distance = np.where(wrong, rng.lognormal(5.4, 0.6, n_events), rng.lognormal(3.5, 0.7, n_events))
+    ms_first = np.clip(rng.lognormal(7.8, 0.6, n_events), 250, 60_000).astype(np.int64)
+    ms_finish = ms_first + np.where(wrong, (clicks - 1) * np.clip(rng.lognormal(7.2, 0.5, n_events), 200, 30_000), 0)
+
+    return {
+        'doc_id_prefix': sorted_id_prefixes(rng, n_events),
+        'timestamp': timestamp,
+        'country': country,
+        'countries': names,
+        'msFromExerciseToFirstClick': ms_first.astype(np.int32),
+        'msFromExerciseToFinishClick': ms_finish.astype(np.int32),
+        'numberOfClicksNeeded': clicks,
+        'distanceOfFirstClickToCenterOfCountry': distance,
+        'device': device,
+        'devices': device_ids(rng, n_devices),
+    }
+
+
+def export_chunks(columns: Dict, seed: int = 0, chunk_rows: int = WRITE_CHUNK) -> Iterator[str]:
+    """JSON text of the export, a chunk of events at a time."""
+    rng = np.random.default_rng([seed, 1])
+    n_events = len(columns['doc_id_prefix'])
+    countries = np.asarray(columns['countries'], dtype=object)
+    devices = np.asarray(columns['devices'], dtype=object)
+    yield '{\n'
+    for start in range(0, n_events, chunk_rows):
+        chunk = slice(start, start + chunk_rows)
+        doc_ids = document_ids(rng, columns['doc_id_prefix'][chunk])
+        timestamps = np.datetime_as_string(columns['timestamp'][chunk], unit='ms')
+        entries = [
+            f'  "{doc_id}": {{\n'
+            f'    "timestamp": "{ts}Z",\n'
+            f'    "country": "{country}",\n'
+            f'    "msFromExerciseToFirstClick": {first},\n'
+            f'    "msFromExerciseToFinishClick": {finish},\n'
+            f'    "numberOfClicksNeeded": {clicks},\n'
+            f'    "distanceOfFirstClickToCenterOfCountry": {distance!r},\n'
+            f'    "deviceId": "{device}",\n'
+            f'    "id": {index}\n'
+            f'  }}'
+            for doc_id, ts, country, first, finish, clicks, distance, device, index in zip(
+                doc_ids, timestamps, countries[columns['country'][chunk]],
+                columns['msFromExerciseToFirstClick'][chunk].tolist(),
+                columns['msFromExerciseToFinishClick'][chunk].tolist(),
+                columns['numberOfClicksNeeded'][chunk].tolist(),
+                columns['distanceOfFirstClickToCenterOfCountry'][chunk].tolist(),
+                devices[columns['device'][chunk]], range(start, start + len(doc_ids)))
+        ]
+        yield ',\n'.join(entries) + (',\n' if start + chunk_rows < n_events else '\n')
+    yield '}\n'
+
+
+def write_dataset(out_dir: str, n_events: int, geo_path: str = GEO_PATH, seed: int = 0, n_devices: int = 0) -> None:
+    """Write learning_data.json and the map into `out_dir`, laid out like data/full."""
+    os.makedirs(out_dir, exist_ok=True)
+    countries = build_geo_index(geo_path).admin_names()
+    columns = generate_events(n_events, countries, seed=seed, n_devices=n_devices)
+    tmp_path = os.path.join(out_dir, 'learning_data.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for text in export_chunks(columns, seed=seed):
+            f.write(text)
+    os.replace(tmp_path, os.path.join(out_dir, 'learning_data.json'))
+    if os.path.abspath(geo_path) != os.path.abspath(os.path.join(out_dir, 'worldmap.geo.json')):
+        shutil.copyfile(geo_path, os.path.join(out_dir, 'worldmap.geo.json'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('size', help=f"number of events, or one of {', '.join(SIZES)}")
+    parser.add_argument('--out', help="output directory (default: data/benchmark/<size>/data/full)")
+    parser.add_argument('--geo', help=f"map to take the countries from (default: {GEO_PATH}, else {DEMO_GEO})")
+    parser.add_argument('--devices', type=int, default=0, help="number of devices (default: one per 60 events)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    n_events = SIZES.get(args.size.lower()) or int(args.size)
+    out_dir = args.out or os.path.join('data', 'benchmark', args.size.lower(), 'data', 'full')
+    start = time.perf_counter()
+    geo_path = args.geo or (GEO_PATH if os.path.exists(GEO_PATH) else DEMO_GEO)
+    write_dataset(out_dir, n_events, geo_path=geo_path, seed=args.seed, n_devices=args.devices)
+    print(f"Wrote {n_events} events to {out_dir} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Print the per-country error rates of a slice of the learning events.
+
+Filters are combined with AND through `analytics.event_query`, e.g. the
+countries guessed wrong most often in Africa by users with at least 50
+guesses, in April:
+
+    --region Africa --min-guesses 50 --since 2025-04-01 --until 2025-04-30
+"""
+import argparse
+import time
+
+import numpy as np
+
+from analytics.day_cube import day_number
+from analytics.event_query import ACTIVITY_TIERS, EventQuery
+from analytics.event_store import DEFAULT_STORE
+from analytics.timestamps import MS_PER_DAY
+
+
+def iso_date(value: str) -> str:
+    day_number(value)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--store', default=DEFAULT_STORE, help="event store to query")
+    parser.add_argument('--country', nargs='+', help="only these countries")
+    parser.add_argument('--region', help="only countries of this UN region of the map, e.g. Africa")
+    parser.add_argument('--subregion', help="only countries of this UN subregion, e.g. 'Western Africa'")
+    parser.add_argument('--device', nargs='+', help="only these devices")
+    parser.add_argument('--tier', choices=list(ACTIVITY_TIERS), help="only devices of this activity tier")
+    parser.add_argument('--min-guesses', type=int, help="only devices with at least this many guesses")
+    parser.add_argument('--max-guesses', type=int, help="only devices with at most this many guesses")
+    parser.add_argument('--new-since', type=iso_date, metavar='YYYY-MM-DD',
+                        help="only devices whose first guess was on this day or later")
+    parser.add_argument('--since', type=iso_date, metavar='YYYY-MM-DD', help="only guesses from this day on (UTC)")
+    parser.add_argument('--until', type=iso_date, metavar='YYYY-MM-DD',
+                        help="only guesses up to and including this day (UTC)")
+    parser.add_argument('--min-attempts', type=int, default=5, help="leave out countries with fewer attempts")
+    parser.add_argument('--top', type=int, default=10, help="number of countries to print")
+    args = parser.parse_args()
+
+    query = EventQuery(args.store)
+    start = time.perf_counter()
+    try:
+        selection = query.all()
+        if args.country:
+            selection &= query.country(*args.country)
+        if args.region:
+            selection &= query.region(args.region)
+        if args.subregion:
+            selection &= query.subregion(args.subregion)
+        if args.device:
+            selection &= query.device(*args.device)
+        if args.tier:
+            selection &= query.tier(args.tier)
+        if args.min_guesses is not None or args.max_guesses is not None:
+            selection &= query.activity(args.min_guesses, args.max_guesses)
+        if args.new_since:
+            selection &= query.first_seen(since=args.new_since)
+        if args.since or args.until:
+            selection &= query.dates(args.since, args.until)
+    except ValueError as error:
+        parser.error(str(error))
+    table = selection.country_table()
+    elapsed = time.perf_counter() - start
+
+    timestamps = np.asarray(query.events.timestamp)[selection.mask]
+    print(f"{len(selection)} of {len(query)} events, {selection.n_devices()} devices "
+          f"({elapsed * 1000:.1f} ms)")
+    if len(timestamps):
+        first, last = (np.datetime64(int(ms // MS_PER_DAY), 'D') for ms in (timestamps.min(), timestamps.max()))
+        print(f"Guesses from {first} to {last}")
+
+    # Countries with enough attempts, most often wrong first
+    codes = np.flatnonzero(table.attempts >= args.min_attempts)
+    rates = table.wrong[codes] / table.attempts[codes]
+    codes = codes[np.argsort(-rates, kind='stable')][:args.top]
+    print(f"\n{'Country':<32} {'Attempts':>9} {'% wrong':>8} {'First sights':>13} {'% wrong':>8}")
+    for code in codes:
+        first_sights = table.first_see_attempts[code]
+        first_wrong = (1 - table.first_see_correct[code] / first_sights) * 100 if first_sights else float('nan')
+        print(f"{table.countries[code]:<32} {table.attempts[code]:>9} "
+              f"{table.wrong[code] / table.attempts[code] * 100:>8.1f} {first_sights:>13} {first_wrong:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""Run the numbered scripts as a dependency graph, skipping stages whose inputs and code haven't changed.
+
+Like the scripts, it works on data/ and plots/ in the working directory.
+Every stage declares the files it reads and writes. A stage depends on the
+stages that write its inputs, and is fingerprinted by the content hashes of
+its inputs, of its script and of the `analytics` modules that script imports
+(found by following its imports), and by its command line. A stage whose
+fingerprint matches the last successful run, and whose outputs are still as
+that run left them, is skipped.
+
+Stages without dependencies on each other run in parallel (--jobs, one per
+CPU by default), so the report scripts 02 to 08 all run at once after the
+event store is built. The event store stage also builds the aggregates,
+the attempt index and the map index, so the scripts running in parallel
+only ever read these caches.
+
+File hashes are cached by size and modification time in
+``data/full/pipeline/state.json``, next to the fingerprints, so an unchanged
+export isn't read again. The output of every stage is saved to
+``data/full/pipeline/<stage>.log``.
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = 'data/full/pipeline'
+STATE_VERSION = 1
+HASH_CHUNK = 1 << 20
+
+EXPORT = 'data/full/learning_data.json'
+GEO = 'data/full/worldmap.geo.json'
+FILTERED = 'data/full/learning_data_after_cutoff.json'
+EVENTS = 'data/full/events'
+
+# Builds the caches that the scripts after 01 share
+PREPARE_STORES = (
+    'from analytics.attempt_index import load_attempt_index; from analytics.country_table import load_country_table; '
+    'from analytics.geo_index import load_geo_index; '
+    'load_attempt_index(); load_country_table(); load_geo_index()'
+)
+
+
+@dataclass
+class Stage:
+    """A step of the pipeline; data paths are relative to the working directory, code paths to the project."""
+    name: str
+    command: List[str]
+    inputs: List[str]
+    outputs: List[str]
+    # Source files the stage runs; the analytics modules they import are added
+    code: List[str]
+    # Only run when named on the command line
+    manual: bool = False
+    needs: List[str] = field(default_factory=list)
+
+
+def python_stage(name: str, script: str, inputs: List[str], outputs: List[str], *arguments: str) -> Stage:
+    return Stage(name, [sys.executable, script, *arguments], inputs, outputs, [script])
+
+
+STAGES: List[Stage] = [
+    Stage('00_download', ['node', '00_get_firebase_data.js'], [], [EXPORT], ['00_get_firebase_data.js'], manual=True),
+    python_stage('01_filter', '01_filter_data_to_only_contain_post_map_data_change_entries.py', [EXPORT, GEO],
+                 [FILTERED]),
+    Stage('event_store', [sys.executable, '-c', PREPARE_STORES], [FILTERED, GEO], [EVENTS],
+          ['analytics/attempt_index.py', 'analytics/country_table.py', 'analytics/geo_index.py']),
+    python_stage('02_wrong_data', '02_get_top_10_countries_most_often_wrong_data.py', [EVENTS], []),
+    python_stage('02_wrong_plot', '02_get_top_10_countries_most_often_wrong_plot.py', [EVENTS],
+                 ['plots/top_10_wrong_guesses_table.tex']),
+    python_stage('03_right_data', '03_get_top_10_countries_most_often_right_data.py', [EVENTS], []),
+    python_stage('03_right_plot', '03_get_top_10_countries_most_often_right_plot.py', [EVENTS],
+                 ['plots/top_10_right_guesses_table.tex']),
+    python_stage('04_distance_plot', '04_plot_top_10_distance_from_country_center.py', [EVENTS],
+                 ['plots/top_10_distance_boxplot.png']),
+    python_stage('05_region', '05_get_worst_error_rate_per_region.py', [EVENTS, GEO],
+                 ['plots/error_rates_by_region.tex']),
+    python_stage('06_trajectory', '06_prototype_learning_trajectory.py', [EVENTS],
+                 ['plots/learning_trajectory_dominica.png', 'plots/learning_trajectory_dominica_table.tex']),
+    python_stage('07_trajectories_3d', '07_trajectories_3d_plot.py', [EVENTS], ['plots/learning_trajectories_3d.png']),
+    python_stage('08_first_see', '08_get_error_rate_on_first_see_per_country.py', [EVENTS],
+                 ['plots/first_see_error_rates_table.tex']),
+    python_stage('09_predictor', '09_make_predictor_csv.py', [EVENTS],
+                 ['data/csv/predictor_data_full.csv', 'data/csv/predictor_data_demo.csv']),
+    python_stage('10_alt_predictor', '10_make_alt_predictor_csv.py', [EVENTS],
+                 ['data/full/predictor_alt'] + [f'data/csv/predictor_data_alt_{split}.csv'
+                                                for split in ('full', 'train', 'val', 'demo')], '--csv'),
+]
+
+
+class FileHasher:
+    """Content hashes of files and directories, reusing the hash of files whose size and mtime are unchanged."""
+
+    def __init__(self, cache: Dict[str, List]):
+        self.cache = cache
+
+    def file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self.cache.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        self.cache[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def path_hash(self, path: str) -> Optional[str]:
+        """Hash of a file, or of a directory's relative paths and file hashes; None if it doesn't exist."""
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            # Half-written .tmp directories are not part of the result
+            dirs[:] = sorted(name for name in dirs if not name.endswith('.tmp'))
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(f'{os.path.relpath(file_path, path)}\0{self.file_hash(file_path)}\n'.encode())
+        return digest.hexdigest()
+
+
+def imported_sources(entry_files: List[str]) -> List[str]:
+    """`entry_files` and every module of this project they import, directly or not, relative to the project."""
+    sources = list(entry_files)
+    seen = set(sources)
+    for path in sources:
+        if not path.endswith('.py') or not os.path.exists(os.path.join(PROJECT_DIR, path)):
+            continue
+        with open(os.path.join(PROJECT_DIR, path), 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        modules = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules += [node.module] + [f'{node.module}.{alias.name}' for alias in node.names]
+        for module in modules:
+            base = module.replace('.', '/')
+            for candidate in (base + '.py', os.path.join(base, '__init__.py')):
+                if os.path.exists(os.path.join(PROJECT_DIR, candidate)) and candidate not in seen:
+                    seen.add(candidate)
+                    sources.append(candidate)
+    return sorted(sources)
+
+
+def fingerprint(stage: Stage, hasher: FileHasher) -> str:
+    description = {
+        'command': [os.path.basename(stage.command[0])] + stage.command[1:],
+        'code': {path: hasher.path_hash(os.path.join(PROJECT_DIR, path)) for path in imported_sources(stage.code)},
+        'inputs': {path: hasher.path_hash(path) for path in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def load_state() -> Dict:
+    path = os.path.join(STATE_DIR, 'state.json')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            state = json.load(f)
+        if state.get('version') == STATE_VERSION:
+            return state
+    return {'version': STATE_VERSION, 'files': {}, 'stages': {}}
+
+
+def save_state(state: Dict) -> None:
+    path = os.path.join(STATE_DIR, 'state.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def is_up_to_date(stage: Stage, stage_fingerprint: str, state: Dict, hasher: FileHasher) -> bool:
+    """Whether the last successful run had this fingerprint and left the outputs as they are now."""
+    previous = state['stages'].get(stage.name)
+    if previous is None or previous['fingerprint'] != stage_fingerprint:
+        return False
+    return all(hasher.path_hash(path) == previous['outputs'].get(path) for path in stage.outputs)
+
+
+def run_command(stage: Stage) -> Dict:
+    """Run a stage's command, with its output going to its log; exit code and seconds."""
+    for path in stage.outputs:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    env.setdefault('MPLBACKEND', 'Agg')
+    log_path = os.path.join(STATE_DIR, f'{stage.name}.log')
+    # Scripts are run from the project directory, on the data in the working directory
+    command = [os.path.join(PROJECT_DIR, argument) if argument in stage.code else argument
+               for argument in stage.command]
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, env=env).returncode
+    return {'returncode': returncode, 'seconds': time.perf_counter() - start, 'log': log_path}
+
+
+def select_stages(names: List[str]) -> List[Stage]:
+    """The named stages and every stage they depend on; all non-manual stages without names."""
+    by_name = {stage.name: stage for stage in STAGES}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        sys.exit(f"Unknown stages: {', '.join(unknown)} (stages: {', '.join(by_name)})")
+    wanted: Set[str] = set(names) if names else {stage.name for stage in STAGES if not stage.manual}
+    producers = {output: stage.name for stage in STAGES for output in stage.outputs}
+    queue = list(wanted)
+    while queue:
+        for path in by_name[queue.pop()].inputs:
+            producer = producers.get(path)
+            # Manual stages only run when asked for; otherwise their outputs are taken as they are
+            if producer and producer not in wanted and not by_name[producer].manual:
+                wanted.add(producer)
+                queue.append(producer)
+    selected = [stage for stage in STAGES if stage.name in wanted]
+    for stage in selected:
+        stage.needs = sorted({producers[path] for path in stage.inputs if producers.get(path) in wanted})
+    return selected
+
+
+def run_pipeline(stages: List[Stage], jobs: int, force: Set[str], dry_run: bool = False) -> Dict[str, str]:
+    """Run `stages` in dependency order, up to `jobs` at a time; the status of each stage."""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    state = load_state()
+    hasher = FileHasher(state['files'])
+    status: Dict[str, str] = {}
+    fingerprints: Dict[str, str] = {}
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            # Start every stage whose dependencies are done, skipping those that are up to date
+            progressed = True
+            while progressed:
+                progressed = False
+                for stage in list(pending):
+                    needs = [status.get(need) for need in stage.needs]
+                    if any(need in ('failed', 'blocked') for need in needs):
+                        status[stage.name] = 'blocked'
+                    elif not all(need in ('up to date', 'ran', 'would run') for need in needs):
+                        continue
+                    elif 'would run' in needs:
+                        status[stage.name] = 'would run'
+                    else:
+                        if stage.name not in fingerprints:
+                            fingerprints[stage.name] = fingerprint(stage, hasher)
+                        if stage.name not in force and is_up_to_date(stage, fingerprints[stage.name], state, hasher):
+                            status[stage.name] = 'up to date'
+                        elif dry_run:
+                            status[stage.name] = 'would run'
+                        elif len(running) >= jobs:
+                            continue
+                        else:
+                            running[pool.submit(run_command, stage)] = stage
+                            status[stage.name] = 'running'
+                    pending.remove(stage)
+                    progressed = True
+                    if status[stage.name] != 'running':
+                        print(f"{stage.name:<20} {status[stage.name]}")
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                result = future.result()
+                if result['returncode'] == 0:
+                    status[stage.name] = 'ran'
+                    state['stages'][stage.name] = {
+                        'fingerprint': fingerprints[stage.name],
+                        'outputs': {path: hasher.path_hash(path) for path in stage.outputs},
+                    }
+                    print(f"{stage.name:<20} ran in {result['seconds']:.1f}s, output in {result['log']}")
+                else:
+                    status[stage.name] = 'failed'
+                    state['stages'].pop(stage.name, None)
+                    print(f"{stage.name:<20} FAILED ({result['returncode']}), see {result['log']}")
+                save_state(state)
+
+    save_state(state)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('stages', nargs='*',
+                        help=f"stages to bring up to date, with the stages they depend on (default: all but "
+                             f"{', '.join(stage.name for stage in STAGES if stage.manual)}; stages: "
+                             f"{', '.join(stage.name for stage in STAGES)})")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help="stages to run at once (default: one per CPU)")
+    parser.add_argument('--force', action='store_true', help="run the named stages (or all) even if up to date")
+    parser.add_argument('--dry-run', action='store_true', help="only list which stages would run")
+    args = parser.parse_args()
+
+    stages = select_stages(args.stages)
+    force = {stage.name for stage in stages if not args.stages or stage.name in args.stages} if args.force else set()
+    status = run_pipeline(stages, max(args.jobs, 1), force, dry_run=args.dry_run)
+    if any(value in ('failed', 'blocked') for value in status.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()